@@ -0,0 +1,194 @@
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import time
+import zipfile
+from typing import Iterable, List, Optional, Tuple
+
+# Anki 2.1 legacy collection (schema 11), the format every Anki version still imports from an .apkg
+collection_schema = """
+CREATE TABLE col (
+   id integer primary key, crt integer not null, mod integer not null, scm integer not null, ver integer not null,
+   dty integer not null, usn integer not null, ls integer not null, conf text not null, models text not null,
+   decks text not null, dconf text not null, tags text not null
+);
+CREATE TABLE notes (
+   id integer primary key, guid text not null, mid integer not null, mod integer not null, usn integer not null,
+   tags text not null, flds text not null, sfld integer not null, csum integer not null, flags integer not null,
+   data text not null
+);
+CREATE TABLE cards (
+   id integer primary key, nid integer not null, did integer not null, ord integer not null, mod integer not null,
+   usn integer not null, type integer not null, queue integer not null, due integer not null, ivl integer not null,
+   factor integer not null, reps integer not null, lapses integer not null, left integer not null,
+   odue integer not null, odid integer not null, flags integer not null, data text not null
+);
+CREATE TABLE revlog (
+   id integer primary key, cid integer not null, usn integer not null, ease integer not null, ivl integer not null,
+   lastIvl integer not null, factor integer not null, time integer not null, type integer not null
+);
+CREATE TABLE graves (usn integer not null, oid integer not null, type integer not null);
+CREATE INDEX ix_notes_usn on notes (usn);
+CREATE INDEX ix_cards_usn on cards (usn);
+CREATE INDEX ix_revlog_usn on revlog (usn);
+CREATE INDEX ix_cards_nid on cards (nid);
+CREATE INDEX ix_cards_sched on cards (did, queue, due);
+CREATE INDEX ix_revlog_cid on revlog (cid);
+CREATE INDEX ix_notes_csum on notes (csum);
+"""
+
+card_css = ".card { font-family: arial; font-size: 20px; text-align: center; color: black; background-color: white; }"
+
+default_deck_config = {
+   'id': 1, 'name': 'Default', 'mod': 0, 'usn': 0, 'maxTaken': 60, 'autoplay': True, 'timer': 0, 'replayq': True,
+   'dyn': False,
+   'new': {'bury': True, 'delays': [1, 10], 'initialFactor': 2500, 'ints': [1, 4, 7], 'order': 1, 'perDay': 20,
+           'separate': True},
+   'lapse': {'delays': [10], 'leechAction': 0, 'leechFails': 8, 'minInt': 1, 'mult': 0},
+   'rev': {'bury': True, 'ease4': 1.3, 'fuzz': 0.05, 'ivlFct': 1, 'maxIvl': 36500, 'minSpace': 1, 'perDay': 100},
+}
+
+
+def stable_id(*parts: str) -> int:
+   # Ids derived from the deck name and row keys, so re-importing a package updates the notes instead of
+   # duplicating them
+   digest = hashlib.sha1("\0".join(parts).encode('utf-8')).digest()
+   return int.from_bytes(digest[:7], 'big') + 1
+
+
+def package_time(csv_path: str) -> int:
+   # Modification time of the notes and the collection: SOURCE_DATE_EPOCH for reproducible builds, otherwise the
+   # time the deck CSV was last written. Anki only updates notes on re-import when the package's are newer.
+   return int(os.environ.get('SOURCE_DATE_EPOCH') or os.stat(csv_path).st_mtime)
+
+
+def field_checksum(text: str) -> int:
+   return int(hashlib.sha1(text.encode('utf-8')).hexdigest()[:8], 16)
+
+
+def _deck(deck_id: int, name: str, now: int) -> dict:
+   return {
+      'id': deck_id, 'name': name, 'mod': now, 'usn': -1, 'desc': '', 'dyn': 0, 'conf': 1, 'collapsed': False,
+      'extendNew': 10, 'extendRev': 50, 'newToday': [0, 0], 'revToday': [0, 0], 'lrnToday': [0, 0],
+      'timeToday': [0, 0],
+   }
+
+
+def _model(model_id: int, deck_id: int, name: str, columns: List[str], now: int) -> dict:
+   # One card per row: the first column asks, the whole row answers
+   answer = "{{FrontSide}}\n\n<hr id=answer>\n\n" + "<br>\n".join(f"{{{{{column}}}}}" for column in columns[1:])
+   return {
+      'id': model_id, 'name': name, 'type': 0, 'mod': now, 'usn': -1, 'sortf': 0, 'did': deck_id, 'vers': [],
+      'tags': [], 'css': card_css, 'latexPre': '', 'latexPost': '', 'latexsvg': False,
+      'req': [[0, 'any', [0]]],
+      'flds': [{'name': column, 'ord': i, 'sticky': False, 'rtl': False, 'font': 'Arial', 'size': 20, 'media': []}
+               for i, column in enumerate(columns)],
+      'tmpls': [{'name': 'Card 1', 'ord': 0, 'qfmt': f"{{{{{columns[0]}}}}}", 'afmt': answer, 'did': None,
+                 'bqfmt': '', 'bafmt': ''}],
+   }
+
+
+class AnkiPackage:
+   """Writes an .apkg: media goes into the zip as it arrives, the collection is added on close."""
+
+   def __init__(self, path: str, deck_name: str, columns: List[str], now: Optional[int] = None):
+      self.deck_name = deck_name
+      self.columns = columns
+      self.archive = zipfile.ZipFile(path, 'w')
+      self.media_map = {}
+      # SQLite needs a real file, so only the collection is staged next to the package
+      handle, self.collection_path = tempfile.mkstemp(suffix='.anki2', dir=os.path.dirname(os.path.abspath(path)))
+      os.close(handle)
+      self.collection = sqlite3.connect(self.collection_path)
+      self.collection.executescript(collection_schema)
+      self.now = int(time.time()) if now is None else now
+      self.deck_id = stable_id('deck', deck_name)
+      self.model_id = stable_id('model', deck_name)
+      self.note_count = 0
+      self.note_keys = {}  # Note id -> row key, to catch two rows that would be one note
+
+   def __enter__(self):
+      return self
+
+   def __exit__(self, exc_type, *exc_info):
+      if exc_type is None:
+         self.close()
+      else:
+         self.collection.close()
+         self.archive.close()
+         os.remove(self.collection_path)
+
+   def add_media(self, file_name: str, data: bytes):
+      # Images and clips are stored as they are, PNGs are compressed already
+      member = str(len(self.media_map))
+      self.archive.writestr(self._member(member, zipfile.ZIP_STORED), data)
+      self.media_map[member] = file_name
+
+   def _member(self, name: str, compress_type: int) -> zipfile.ZipInfo:
+      # Dated like the notes, so the same deck always zips to the same bytes
+      member = zipfile.ZipInfo(name, time.gmtime(max(self.now, 315532800))[:6])
+      member.compress_type = compress_type
+      return member
+
+   def add_notes(self, rows: Iterable[List[str]], keys: Optional[Iterable[str]] = None):
+      # keys identify the notes across builds, the first field does when there are none
+      rows = list(rows)
+      keys = [fields[0] for fields in rows] if keys is None else list(keys)
+      if len(keys) != len(rows):
+         raise ValueError(f"{len(rows)} rows but {len(keys)} note keys")
+      notes, cards = [], []
+      for key, fields in zip(keys, rows):
+         note_id = stable_id('note', self.deck_name, key)
+         if note_id in self.note_keys:
+            raise ValueError(f"Rows {self.note_keys[note_id]!r} and {key!r} of {self.deck_name} have the same note id")
+         self.note_keys[note_id] = key
+         guid = format(note_id, 'x')
+         notes.append((note_id, guid, self.model_id, self.now, -1, '', '\x1f'.join(fields), fields[0],
+                       field_checksum(fields[0]), 0, ''))
+         cards.append((note_id, note_id, self.deck_id, 0, self.now, -1, 0, 0, self.note_count, 0, 0, 0, 0, 0, 0, 0,
+                       0, ''))
+         self.note_count += 1
+      self.collection.executemany("INSERT INTO notes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", notes)
+      self.collection.executemany(
+         "INSERT INTO cards VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", cards)
+
+   def close(self):
+      now_ms = self.now * 1000
+      decks = {'1': _deck(1, 'Default', self.now), str(self.deck_id): _deck(self.deck_id, self.deck_name, self.now)}
+      models = {str(self.model_id): _model(self.model_id, self.deck_id, f"{self.deck_name} card", self.columns,
+                                           self.now)}
+      conf = {'activeDecks': [1], 'curDeck': 1, 'newSpread': 0, 'collapseTime': 1200, 'timeLim': 0,
+              'estTimes': True, 'dueCounts': True, 'curModel': None, 'nextPos': self.note_count, 'sortType': 'noteFld',
+              'sortBackwards': False, 'addToCur': True}
+      self.collection.execute(
+         "INSERT INTO col VALUES (1, ?, ?, ?, 11, 0, 0, 0, ?, ?, ?, ?, '{}')",
+         (self.now, now_ms, now_ms, json.dumps(conf), json.dumps(models), json.dumps(decks),
+          json.dumps({'1': default_deck_config})))
+      self.collection.commit()
+      self.collection.close()
+      with open(self.collection_path, 'rb') as collection_file:
+         self.archive.writestr(self._member('collection.anki2', zipfile.ZIP_DEFLATED), collection_file.read())
+      self.archive.writestr(self._member('media', zipfile.ZIP_DEFLATED), json.dumps(self.media_map))
+      self.archive.close()
+      os.remove(self.collection_path)
+
+
+def read_tsv(csv_path: str) -> Tuple[List[str], List[List[str]]]:
+   # The deck CSVs are plain tab separated lines, without quoting
+   with open(csv_path, encoding='utf-8') as csvfile:
+      lines = csvfile.read().splitlines()
+   return lines[0].split('\t'), [line.split('\t') for line in lines[1:]]
+
+
+def write_package(package_path: str, deck_name: str, csv_path: str, media: Iterable[Tuple[str, bytes]],
+                  note_keys: Optional[List[str]] = None):
+   # media yields (file name, PNG bytes) while the images are still being rendered; note_keys are the DeckStore
+   # keys of the CSV rows
+   columns, rows = read_tsv(csv_path)
+   with AnkiPackage(package_path, deck_name, columns, package_time(csv_path)) as package:
+      package.add_notes(rows, note_keys)
+      for file_name, data in media:
+         package.add_media(file_name, data)
+   print(f"{package_path}: {len(rows)} notes, {len(package.media_map)} media files")
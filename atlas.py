@@ -0,0 +1,89 @@
+import glob
+import json
+import os
+import re
+from dataclasses import dataclass, asdict
+from typing import Dict, List, Tuple
+
+import numpy as np
+from PIL import Image
+
+# Largest sheet side, small enough for every image viewer and flashcard app we sync to
+max_sheet_size = 4096
+
+image_tag = re.compile(r'<img src="([^"]+)"\s*/?>')
+
+
+@dataclass
+class AtlasRegion:
+   sheet: str
+   x: int
+   y: int
+   w: int
+   h: int
+
+
+def pack(sizes: List[Tuple[int, int]], max_size: int = max_sheet_size) -> List[Tuple[int, int, int]]:
+   # Shelf packing in the given order: (sheet number, x, y) for every (width, height)
+   positions = []
+   sheet, x, y, shelf_height = 0, 0, 0, 0
+   for width, height in sizes:
+      if x + width > max_size:
+         x, y, shelf_height = 0, y + shelf_height, 0
+      if y + height > max_size:
+         sheet, x, y, shelf_height = sheet + 1, 0, 0, 0
+      positions.append((sheet, x, y))
+      x += width
+      shelf_height = max(shelf_height, height)
+   return positions
+
+
+def build_atlas(images: Dict[str, np.ndarray], atlas_prefix: str) -> Dict[str, AtlasRegion]:
+   # Writes <atlas_prefix>-<n>.png sheets and <atlas_prefix>.json, returns file name -> region
+   file_names = list(images.keys())
+   sizes = [(images[name].shape[1], images[name].shape[0]) for name in file_names]
+   positions = pack(sizes)
+
+   sheet_sizes: Dict[int, Tuple[int, int]] = {}
+   for (sheet, x, y), (width, height) in zip(positions, sizes):
+      sheet_width, sheet_height = sheet_sizes.get(sheet, (0, 0))
+      sheet_sizes[sheet] = (max(sheet_width, x + width), max(sheet_height, y + height))
+
+   sheets = {sheet: np.zeros((height, width, 4), dtype=np.uint8) for sheet, (width, height) in sheet_sizes.items()}
+   index: Dict[str, AtlasRegion] = {}
+   sheet_name = os.path.basename(atlas_prefix)
+   for name, (sheet, x, y), (width, height) in zip(file_names, positions, sizes):
+      sheets[sheet][y:y+height, x:x+width] = images[name]
+      index[name] = AtlasRegion(f"{sheet_name}-{sheet}.png", x, y, width, height)
+
+   for sheet, pixels in sheets.items():
+      Image.fromarray(pixels, 'RGBA').save(f"{atlas_prefix}-{sheet}.png")
+   # A deck that shrank leaves sheets behind that no card points at any more
+   sheet_number = re.compile(re.escape(sheet_name) + r'-(\d+)\.png')
+   for sheet_path in glob.glob(glob.escape(atlas_prefix) + '-*.png'):
+      match = sheet_number.fullmatch(os.path.basename(sheet_path))
+      if match and int(match.group(1)) not in sheets:
+         os.remove(sheet_path)
+   with open(f"{atlas_prefix}.json", mode='w', encoding='utf-8') as index_file:
+      json.dump({name: asdict(region) for name, region in index.items()}, index_file, indent=1)
+   return index
+
+
+def atlas_cell(region: AtlasRegion) -> str:
+   # Anki's media check and exports only see files named in src attributes or [sound:...], not in CSS, so the
+   # sheet is also named by a hidden <img> of the cell; the browser loads it once either way
+   return (f"<div style=\"width:{region.w}px;height:{region.h}px;"
+           f"background:url('{region.sheet}') -{region.x}px -{region.y}px;\">"
+           f"<img src=\"{region.sheet}\" style=\"display:none\"></div>")
+
+
+def rewrite_csv(csv_path: str, index: Dict[str, AtlasRegion]):
+   # Replace every <img src="..."> that points at a packed image with its atlas region
+   def replace(match: re.Match) -> str:
+      region = index.get(match.group(1))
+      return atlas_cell(region) if region else match.group(0)
+
+   with open(csv_path, mode='r', encoding='utf-8') as csvfile:
+      text = csvfile.read()
+   with open(csv_path, mode='w', encoding='utf-8') as csvfile:
+      csvfile.write(image_tag.sub(replace, text))
@@ -0,0 +1,276 @@
+import argparse
+import hashlib
+import json
+import os
+import wave
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Sound clips for the cards: block chords, melodic intervals and scales played up or down.
+# Every note of a batch of clips is synthesised at once, and clips are stored under a hash of their notes and
+# timing, so a clip shared by several cards or decks is synthesised and written once.
+# With DECK_AUDIO=wav (or ogg) every deck gets a Sound column of [sound:...] references; the .apkg carries the clips,
+# for CSV imports copy output/audio/ into Anki's collection.media like the images.
+
+SYNTH_VERSION = 1  # Bump whenever a change alters the synthesised samples
+sample_rate = 22050
+base_midi = 60  # K0 is middle C
+
+# Additive tone: relative amplitudes of the fundamental and its overtones
+harmonic_amplitudes = np.array([1.0, 0.5, 0.3, 0.15, 0.08])
+attack_seconds = 0.01
+decay_per_second = 2.5
+release_seconds = 0.15
+peak_level = 0.8
+# Notes x samples synthesised per step, which bounds the memory of one batch
+max_batch_samples = 4_000_000
+
+chord_seconds = 1.6
+interval_note_seconds = 0.7
+scale_note_seconds = 0.35
+
+default_audio_dir = 'output/audio/'
+WAV = 'wav'
+OGG = 'ogg'
+sound_column = 'Sound'
+
+
+@dataclass(frozen=True)
+class Clip:
+   pitches: Tuple[int, ...]
+   onsets: Tuple[float, ...]
+   durations: Tuple[float, ...]
+
+   def key(self) -> str:
+      description = {'pitches': self.pitches, 'onsets': self.onsets, 'durations': self.durations,
+                     'sample_rate': sample_rate, 'version': SYNTH_VERSION}
+      return hashlib.sha256(json.dumps(description).encode('utf-8')).hexdigest()[:20]
+
+   @property
+   def seconds(self) -> float:
+      return max(onset + duration for onset, duration in zip(self.onsets, self.durations)) + release_seconds
+
+
+def chord_clip(pitches: Sequence[int]) -> Clip:
+   # All notes at once, the order of the notes does not change the sound
+   pitches = tuple(sorted(int(pitch) for pitch in pitches))
+   return Clip(pitches, (0.0,) * len(pitches), (chord_seconds,) * len(pitches))
+
+
+def melodic_clip(pitches: Sequence[int], note_seconds: float) -> Clip:
+   # One note after the other, the last one held twice as long
+   count = len(pitches)
+   return Clip(tuple(int(pitch) for pitch in pitches), tuple(i * note_seconds for i in range(count)),
+               (note_seconds,) * (count - 1) + (2 * note_seconds,))
+
+
+def interval_clip(pitches: Sequence[int]) -> Clip:
+   return melodic_clip(pitches, interval_note_seconds)
+
+
+def scale_clip(pitches: Sequence[int]) -> Clip:
+   return melodic_clip(pitches, scale_note_seconds)
+
+
+def frequencies(pitches: np.ndarray) -> np.ndarray:
+   return 440.0 * 2.0 ** ((pitches + base_midi - 69) / 12)
+
+
+def _synthesise_notes(pitches: np.ndarray, durations: np.ndarray, length: int) -> np.ndarray:
+   # [note, sample] tones with their envelope, every note of the batch in one array
+   t = np.arange(length) / sample_rate
+   fundamentals = frequencies(pitches)
+   tones = np.zeros((len(pitches), length))
+   for harmonic, amplitude in enumerate(harmonic_amplitudes, start=1):
+      # Overtones above the Nyquist frequency would alias, so they are left out
+      audible = (fundamentals * harmonic < sample_rate / 2)[:, None]
+      tones += audible * amplitude * np.sin(2 * np.pi * harmonic * fundamentals[:, None] * t[None, :])
+   envelope = (np.minimum(t / attack_seconds, 1.0)[None, :] * np.exp(-decay_per_second * t)[None, :]
+               * np.clip((durations[:, None] + release_seconds - t[None, :]) / release_seconds, 0.0, 1.0))
+   return tones * envelope
+
+
+def synthesise(clips: List[Clip]) -> List[np.ndarray]:
+   # Float samples of every clip, peak normalised
+   counts = [len(clip.pitches) for clip in clips]
+   clip_index = np.repeat(np.arange(len(clips)), counts)
+   pitches = np.array([pitch for clip in clips for pitch in clip.pitches], dtype=float)
+   onsets = np.rint(np.array([onset for clip in clips for onset in clip.onsets]) * sample_rate).astype(np.int64)
+   durations = np.array([duration for clip in clips for duration in clip.durations])
+   note_length = int(np.ceil((durations.max() + release_seconds) * sample_rate))
+   clip_lengths = [int(np.ceil(clip.seconds * sample_rate)) for clip in clips]
+   width = max(clip_lengths) + note_length
+
+   # Every note is added into its clip at its onset in one bincount, notes of a chord simply sum up
+   mixed = np.zeros(len(clips) * width)
+   step = max(1, max_batch_samples // note_length)
+   for start in range(0, len(pitches), step):
+      notes = slice(start, start + step)
+      tones = _synthesise_notes(pitches[notes], durations[notes], note_length)
+      positions = (clip_index[notes] * width + onsets[notes])[:, None] + np.arange(note_length)[None, :]
+      mixed += np.bincount(positions.ravel(), weights=tones.ravel(), minlength=len(mixed))
+   mixed = mixed.reshape(len(clips), width)
+
+   samples = []
+   for row, length in zip(mixed, clip_lengths):
+      row = row[:length]
+      peak = np.abs(row).max()
+      samples.append(row * (peak_level / peak) if peak > 0 else row)
+   return samples
+
+
+def write_wav(file_path: str, samples: np.ndarray):
+   pcm = np.round(np.clip(samples, -1.0, 1.0) * 32767).astype('<i2')
+   with wave.open(file_path, 'wb') as wav_file:
+      wav_file.setnchannels(1)
+      wav_file.setsampwidth(2)
+      wav_file.setframerate(sample_rate)
+      wav_file.writeframes(pcm.tobytes())
+
+
+def write_ogg(file_path: str, samples: np.ndarray):
+   # Ogg Vorbis needs the optional soundfile package
+   import soundfile
+   soundfile.write(file_path, samples, sample_rate, format='OGG', subtype='VORBIS')
+
+
+class ClipCache:
+   """Clip files named by their key, so every deck finds the clips any deck synthesised before."""
+
+   def __init__(self, audio_dir: str = default_audio_dir, audio_format: str = WAV, batch_size: int = 64):
+      if audio_format not in (WAV, OGG):
+         raise ValueError(f"Unknown audio format: {audio_format}")
+      self.audio_dir = audio_dir
+      self.audio_format = audio_format
+      self.batch_size = batch_size
+      self.synthesised = 0
+      self.reused = 0
+
+   def file_name(self, clip: Clip) -> str:
+      return f"{clip.key()}.{self.audio_format}"
+
+   def ensure(self, clips: List[Clip]) -> List[str]:
+      # File names of the clips, synthesising only those that are not on disk yet
+      os.makedirs(self.audio_dir, exist_ok=True)
+      missing: Dict[str, Clip] = {}
+      for clip in clips:
+         file_name = self.file_name(clip)
+         if file_name in missing or os.path.exists(os.path.join(self.audio_dir, file_name)):
+            self.reused += 1
+         else:
+            missing[file_name] = clip
+      pending = list(missing.items())
+      write = write_wav if self.audio_format == WAV else write_ogg
+      for start in range(0, len(pending), self.batch_size):
+         batch = pending[start:start + self.batch_size]
+         for (file_name, _), samples in zip(batch, synthesise([clip for _, clip in batch])):
+            tmp_path = os.path.join(self.audio_dir, file_name + '.tmp')
+            write(tmp_path, samples)
+            os.replace(tmp_path, os.path.join(self.audio_dir, file_name))
+      self.synthesised += len(pending)
+      return [self.file_name(clip) for clip in clips]
+
+
+def chord_clips() -> Iterator[Tuple[str, Clip]]:
+   # Keyed like the rows of the chord deck
+   from chord_syllables import ChordType, ChordInversionType, make_chord
+   from draw_intervals import bases
+
+   for root in bases[0:12]:
+      for inversion_type in ChordInversionType:
+         for chord_type in ChordType:
+            chord = make_chord(root, chord_type, inversion_type, 0)
+            yield f"{root}-{chord.syllables}-{chord_type.value}-{inversion_type.value}", chord_clip(chord.notes)
+
+
+def interval_clips() -> Iterator[Tuple[str, Clip]]:
+   from interval_syllables import iter_intervals
+
+   for left_to_right, _, _, notes in iter_intervals():
+      yield left_to_right, interval_clip(notes)
+
+
+def mode_clips() -> Iterator[Tuple[str, Clip]]:
+   # Scales going down are played from the top
+   from draw_intervals import note_names
+   from draw_scales_on_piano_keyboard import Direction, make_modes
+   from theory_tables import scales_intervals
+
+   for mode in scales_intervals:
+      for note in note_names[0:12]:
+         for direction in Direction:
+            mode_notes = make_modes(note, mode, base_octave=1, direction=direction)
+            notes = mode_notes.notes if direction == Direction.UP else mode_notes.notes[::-1]
+            yield f"{mode} Mode: {note}{'->' if direction == Direction.UP else '<-'}{note}", scale_clip(notes)
+
+
+deck_clips = {
+   'chords': chord_clips,
+   'intervals': interval_clips,
+   'modes': mode_clips,
+}
+
+
+def default_audio_format() -> Optional[str]:
+   audio_format = os.environ.get('DECK_AUDIO', '') or None
+   if audio_format is not None and audio_format not in (WAV, OGG):
+      raise ValueError(f"DECK_AUDIO is {WAV} or {OGG}, got {audio_format!r}")
+   return audio_format
+
+
+def deck_sounds(deck: str, cache: ClipCache) -> Dict[str, str]:
+   # Deck row key -> clip file name, synthesising the clips that are not on disk yet
+   keys, clips = zip(*deck_clips[deck]())
+   return dict(zip(keys, cache.ensure(list(clips))))
+
+
+def sound_tag(file_name: str) -> str:
+   return f"[sound:{file_name}]"
+
+
+def with_sounds(deck: str, rows: List[tuple], columns: List[str]) -> Tuple[List[tuple], List[str], List[str]]:
+   # The deck's (key, annotation key, fields) rows and columns with a Sound column, and the paths of the clips they
+   # play. Rows and columns are returned as they are when DECK_AUDIO is not set.
+   audio_format = default_audio_format()
+   if audio_format is None:
+      return rows, columns, []
+   cache = ClipCache(default_audio_dir, audio_format)
+   sounds = deck_sounds(deck, cache)
+   rows = [(key, annotation_key, {**fields, sound_column: sound_tag(sounds[key])})
+           for key, annotation_key, fields in rows]
+   paths = [os.path.join(cache.audio_dir, file_name) for file_name in dict.fromkeys(sounds.values())]
+   return rows, columns + [sound_column], paths
+
+
+def build_deck_audio(deck: str, cache: ClipCache) -> str:
+   # Writes <deck>-sounds.tsv next to the clips: deck row key and the Anki [sound:...] reference
+   sounds = deck_sounds(deck, cache)
+   index_path = os.path.join(cache.audio_dir, f"{deck}-sounds.tsv")
+   with open(index_path, mode='w', encoding='utf-8') as index_file:
+      index_file.write(f"Key\t{sound_column}\n")
+      for key, file_name in sounds.items():
+         index_file.write(f"{key}\t{sound_tag(file_name)}\n")
+   return index_path
+
+
+def main(argv: Optional[List[str]] = None):
+   parser = argparse.ArgumentParser(description="Synthesise the sound clips of the chord, interval and mode decks")
+   parser.add_argument('decks', nargs='*', metavar='deck',
+                       help=f"decks to build: {', '.join(deck_clips)} (all of them by default)")
+   parser.add_argument('--audio-dir', default=default_audio_dir)
+   parser.add_argument('--format', choices=[WAV, OGG], default=WAV)
+   args = parser.parse_args(argv)
+   unknown = [deck for deck in args.decks if deck not in deck_clips]
+   if unknown:
+      parser.error(f"unknown deck: {', '.join(unknown)}")
+
+   cache = ClipCache(args.audio_dir, args.format)
+   for deck in args.decks or deck_clips:
+      print(build_deck_audio(deck, cache))
+   print(f"synthesised {cache.synthesised} clips, reused {cache.reused}")
+
+
+if __name__ == '__main__':
+   main()
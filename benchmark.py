@@ -0,0 +1,230 @@
+import argparse
+import contextlib
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional
+
+from draw_intervals import draw_keyboard, draw_piano_roll, MATPLOTLIB, RASTER
+
+# Offline benchmarks for the renderers and the deck generators, saved as JSON so runs can be compared:
+#   python benchmark.py -o before.json
+#   python benchmark.py -o after.json --compare before.json
+
+repository_dir = os.path.dirname(os.path.abspath(__file__))
+backends = [MATPLOTLIB, RASTER]
+octave_counts = [1, 2, 4]
+decks = ['chords', 'intervals', 'modes']
+# Sub-directories the generators render into, relative to their output_dir
+deck_directories = {
+   'chords': ['keyboard/', 'pianoroll/'],
+   'intervals': ['keyboard/', 'pianoroll/'],
+   'modes': [''],
+}
+# A chord that fits on a one octave keyboard, with the colours the coloured decks use
+sample_notes = ['K1', 'M1', 'G1']
+sample_colours = {'K1': 'yellow', 'M1': 'lightgreen', 'G1': 'lightyellow'}
+
+
+def peak_rss_kib(who: int = resource.RUSAGE_SELF) -> int:
+   # ru_maxrss is in KiB on Linux
+   return resource.getrusage(who).ru_maxrss
+
+
+def time_calls(function: Callable[[], object], repeat: int, warmup: int = 1) -> Dict[str, float]:
+   for _ in range(warmup):
+      function()
+   timings = []
+   for _ in range(repeat):
+      start = time.perf_counter()
+      function()
+      timings.append(time.perf_counter() - start)
+   return {
+      'repeat': repeat,
+      'min_ms': min(timings) * 1000,
+      'median_ms': statistics.median(timings) * 1000,
+      'mean_ms': statistics.fmean(timings) * 1000,
+   }
+
+
+def image_latency(repeat: int) -> Dict[str, dict]:
+   # Per-image latency of each renderer, the first (template building) call is the warm-up
+   results = {}
+   with tempfile.TemporaryDirectory() as output_dir:
+      output_dir += '/'
+      for backend in backends:
+         for octaves in octave_counts:
+            results[f"draw_keyboard/{backend}/{octaves}"] = time_calls(
+               lambda: draw_keyboard(output_dir, 'keyboard.png', sample_notes, sample_colours, octaves, backend), repeat)
+            results[f"draw_piano_roll/{backend}/{octaves}"] = time_calls(
+               lambda: draw_piano_roll(output_dir, 'pianoroll.png', sample_notes, sample_colours, octaves, backend),
+               repeat)
+   return results
+
+
+def theory_latency(repeat: int) -> Dict[str, dict]:
+   from chord_syllables import make_chord, ChordType, ChordInversionType
+   from draw_scales_on_piano_keyboard import make_modes, Direction
+
+   return {
+      'make_chord': time_calls(lambda: make_chord('J', ChordType.MINOR, ChordInversionType.FIRST_INVERSION, 1), repeat),
+      'make_modes': time_calls(lambda: make_modes('J', 'Dorian', 1, Direction.DOWN), repeat),
+   }
+
+
+def build_deck(deck: str, output_dir: str):
+   from decks import deck_generators
+
+   for directory in deck_directories[deck]:
+      os.makedirs(output_dir + directory, exist_ok=True)
+   csv_path = os.path.join(output_dir, f"{deck}.csv")
+   store_path = os.path.join(output_dir, 'decks.sqlite')
+   deck_generators[deck](csv_path=csv_path, output_dir=output_dir, store_path=store_path)
+
+
+def count_files(directory: str, suffix: str) -> int:
+   return sum(name.endswith(suffix) for _, _, names in os.walk(directory) for name in names)
+
+
+def deck_child(deck: str) -> dict:
+   # Runs in its own interpreter, so the peak RSS belongs to this rebuild alone
+   with tempfile.TemporaryDirectory() as output_dir:
+      output_dir += '/'
+      start = time.perf_counter()
+      with contextlib.redirect_stdout(sys.stderr):
+         build_deck(deck, output_dir)
+      seconds = time.perf_counter() - start
+      images = count_files(output_dir, '.png')
+   return {
+      'seconds': seconds,
+      'images': images,
+      'images_per_second': images / seconds if seconds else 0.0,
+      'peak_rss_kib': peak_rss_kib(),
+      'peak_rss_children_kib': peak_rss_kib(resource.RUSAGE_CHILDREN),
+   }
+
+
+def deck_throughput(backend: str, processes: int) -> Dict[str, dict]:
+   results = {}
+   env = dict(os.environ, DECK_BACKEND=backend, DECK_PROCESSES=str(processes), DECK_OUTPUT='files')
+   for deck in decks:
+      completed = subprocess.run([sys.executable, __file__, '--deck-child', deck], cwd=repository_dir, env=env,
+                                 check=True, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+      results[f"{deck}/{backend}"] = json.loads(completed.stdout)
+   return results
+
+
+def full_rebuild(backend: str, processes: int) -> dict:
+   # All three decks in one interpreter, the way decks.py builds a release
+   env = dict(os.environ, DECK_BACKEND=backend, DECK_PROCESSES=str(processes), DECK_OUTPUT='files')
+   completed = subprocess.run([sys.executable, __file__, '--rebuild-child'], cwd=repository_dir, env=env,
+                              check=True, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+   return json.loads(completed.stdout)
+
+
+def rebuild_child() -> dict:
+   with tempfile.TemporaryDirectory() as output_dir:
+      start = time.perf_counter()
+      with contextlib.redirect_stdout(sys.stderr):
+         for deck in decks:
+            build_deck(deck, os.path.join(output_dir, deck) + '/')
+      seconds = time.perf_counter() - start
+      images = count_files(output_dir, '.png')
+   return {
+      'seconds': seconds,
+      'images': images,
+      'peak_rss_kib': peak_rss_kib(),
+      'peak_rss_children_kib': peak_rss_kib(resource.RUSAGE_CHILDREN),
+   }
+
+
+def environment() -> dict:
+   import matplotlib
+   import numpy
+   import PIL
+
+   try:
+      commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=repository_dir, check=True, text=True,
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL).stdout.strip()
+   except (OSError, subprocess.CalledProcessError):
+      commit = None
+   return {
+      'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+      'commit': commit,
+      'python': platform.python_version(),
+      'platform': platform.platform(),
+      'cpu_count': os.cpu_count(),
+      'matplotlib': matplotlib.__version__,
+      'numpy': numpy.__version__,
+      'pillow': PIL.__version__,
+   }
+
+
+def run(repeat: int, processes: int, selected_backends: List[str], include_decks: bool) -> dict:
+   results = {'environment': environment(), 'processes': processes,
+              'latency': {**image_latency(repeat), **theory_latency(repeat * 10)}}
+   if include_decks:
+      results['decks'] = {}
+      results['rebuild'] = {}
+      for backend in selected_backends:
+         results['decks'].update(deck_throughput(backend, processes))
+         results['rebuild'][backend] = full_rebuild(backend, processes)
+   return results
+
+
+def compare(old: dict, new: dict, threshold: float) -> List[str]:
+   # Everything that got slower than threshold (0.1 = 10 %), as printable lines
+   regressions = []
+   pairs = [(f"latency {name}", old['latency'][name]['median_ms'], value['median_ms'])
+            for name, value in new['latency'].items() if name in old.get('latency', {})]
+   pairs += [(f"deck {name}", old['decks'][name]['seconds'], value['seconds'])
+             for name, value in new.get('decks', {}).items() if name in old.get('decks', {})]
+   pairs += [(f"rebuild {name}", old['rebuild'][name]['seconds'], value['seconds'])
+             for name, value in new.get('rebuild', {}).items() if name in old.get('rebuild', {})]
+   for name, before, after in pairs:
+      change = (after - before) / before if before else 0.0
+      print(f"{name:40} {before:10.2f} -> {after:10.2f} {change:+7.1%}")
+      if change > threshold:
+         regressions.append(name)
+   return regressions
+
+
+def main(argv: Optional[List[str]] = None):
+   parser = argparse.ArgumentParser(description="Benchmark the renderers and the deck generators")
+   parser.add_argument('-o', '--output', default='benchmark.json', help="where to save the JSON results")
+   parser.add_argument('--repeat', type=int, default=20, help="timed calls per latency benchmark")
+   parser.add_argument('--processes', type=int, default=1, help="render pool size for the deck benchmarks")
+   parser.add_argument('--backend', action='append', choices=backends, help="deck backends (all by default)")
+   parser.add_argument('--no-decks', action='store_true', help="only measure the per-call latencies")
+   parser.add_argument('--compare', metavar='BASELINE', help="report changes against an earlier results file")
+   parser.add_argument('--threshold', type=float, default=0.1, help="slowdown that counts as a regression")
+   parser.add_argument('--deck-child', choices=decks, help=argparse.SUPPRESS)
+   parser.add_argument('--rebuild-child', action='store_true', help=argparse.SUPPRESS)
+   args = parser.parse_args(argv)
+
+   if args.deck_child:
+      print(json.dumps(deck_child(args.deck_child)))
+      return
+   if args.rebuild_child:
+      print(json.dumps(rebuild_child()))
+      return
+
+   results = run(args.repeat, args.processes, args.backend or backends, not args.no_decks)
+   with open(args.output, mode='w', encoding='utf-8') as output_file:
+      json.dump(results, output_file, indent=1)
+   print(f"saved {args.output}")
+   if args.compare:
+      with open(args.compare, encoding='utf-8') as baseline_file:
+         regressions = compare(json.load(baseline_file), results, args.threshold)
+      if regressions:
+         sys.exit(f"regressions: {', '.join(regressions)}")
+
+
+if __name__ == '__main__':
+   main()
@@ -1,8 +1,15 @@
 from enum import Enum
-from typing import Dict, List
+from typing import List, Optional, Union
 
-from draw_intervals import draw_keyboard, bases, keys_per_octave, draw_piano_roll
-from my_csv import read_file
+from audio import with_sounds
+from deck_store import DeckStore, default_store_path
+from draw_intervals import bases, keys_per_octave
+from instrumentation import profiled, stage
+from my_csv import csv_file_path, read_file
+from palettes import RGBA, get_scheme
+from pitch import Pitch, PitchClass
+from render_jobs import RenderJob, render_deck, KEYBOARD, PIANO_ROLL
+from theory_tables import chord_entry
 
 
 class ChordType(Enum):
@@ -17,165 +24,100 @@ class ChordInversionType(Enum):
    SECOND_INVERSION = 'second inversion'
 
 
-root_suffix = 'u'
-mi_up = 'i'
-ma_up = 'a'
-pe_up = 'u'
-mi_do = 'e'
-ma_do = 'o'
-pe_do = 'y'
-
-au_up = 'i'
-au_do = 'e'
-di_up = 'ya'
-di_do = 'yo'
-
-root_colour = 'yellow'
-
-mi_up_colour = 'lightblue'
-ma_up_colour = 'lightgreen'
-pe_up_colour = 'lightyellow'
-au_up_colour = 'lightsalmon'
-di_up_colour = 'plum'
-
-mi_do_colour = 'cornflowerblue'
-ma_do_colour = 'mediumseagreen'
-pe_do_colour = 'khaki'
-au_do_colour = 'darksalmon'
-di_do_colour = 'orchid'
-
 class Chord:
-   notes: list[str]
-   colours: dict[str, str]
+   notes: list[Pitch]
+   colours: dict[Pitch, RGBA]
    syllables: str
 
-def make_chord(root_: str, chord_type: ChordType, inversion_type: ChordInversionType,
-               base_octave: int) -> Chord:
-
-   root_index = bases.index(root_)
-   colours = []
-   syllables = [root_suffix, ma_up, pe_up]
-
-   if chord_type == ChordType.MAJOR:
-      chord_interval_nums = [0, 4, 7]
-   elif chord_type == ChordType.MINOR:
-      chord_interval_nums = [0, 3, 7]
-   elif chord_type == ChordType.AUGMENTED:
-      chord_interval_nums = [0, 4, 8]
-   elif chord_type == ChordType.DIMINISHED:
-      chord_interval_nums = [0, 3, 6]
-
-   notes = [(root_index + interval) for interval in chord_interval_nums]
-
-   if inversion_type == ChordInversionType.ROOT:
-      if ChordType.MINOR == chord_type:
-         syllables = [root_suffix,mi_up, pe_up]
-         colours = [root_colour, mi_up_colour, pe_up_colour]
-      if ChordType.MAJOR == chord_type:
-         syllables = [root_suffix, ma_up, pe_up]
-         colours = [root_colour, ma_up_colour, pe_up_colour]
-      if ChordType.DIMINISHED == chord_type:
-         syllables = [root_suffix, mi_up, di_up]
-         colours = [root_colour, mi_up_colour, di_up_colour]
-      if ChordType.AUGMENTED == chord_type:
-         syllables = [root_suffix, ma_up, au_up]
-         colours = [root_colour, ma_up_colour, au_up_colour]
-
-   if inversion_type == ChordInversionType.FIRST_INVERSION:
-      notes[0] += 12
-      notes  = [notes[1], notes[2], notes[0]]
-      if ChordType.MINOR == chord_type:
-         syllables = [mi_do, pe_do, root_suffix]
-         colours = [mi_do_colour, pe_do_colour, root_colour]
-      if ChordType.MAJOR == chord_type:
-         syllables = [ma_do, pe_do, root_suffix]
-         colours = [ma_do_colour, pe_do_colour, root_colour]
-      if ChordType.DIMINISHED == chord_type:
-         syllables = [mi_do, di_do, root_suffix]
-         colours = [mi_do_colour, di_do_colour, root_colour]
-      if ChordType.AUGMENTED == chord_type:
-         syllables = [ma_do, au_do, root_suffix]
-         colours = [ma_do_colour, au_do_colour, root_colour]
-
-   if inversion_type == ChordInversionType.SECOND_INVERSION:
-      notes[2] -= 12
-      notes  = [notes[2], notes[0], notes[1]]
-      notes = [note+12 for note in notes]
-      if ChordType.MINOR == chord_type:
-         syllables = [pe_do, root_suffix, mi_up]
-         colours = [pe_do_colour, root_colour, mi_up_colour]
-      if ChordType.MAJOR == chord_type:
-         syllables = [pe_do, root_suffix, ma_up]
-         colours = [pe_do_colour, root_colour, ma_up_colour]
-      if ChordType.DIMINISHED == chord_type:
-         syllables = [di_do, root_suffix, mi_up]
-         colours = [di_do_colour, root_colour, mi_up_colour]
-      if ChordType.AUGMENTED == chord_type:
-         syllables = [au_do, root_suffix, ma_up]
-         colours = [au_do_colour, root_colour, ma_up_colour]
-
-   if all(note >= 12 for note in notes):
-      notes = [note-12 for note in notes]
+def make_chord(root_: str, chord_type: Union[ChordType, str], inversion_type: Union[ChordInversionType, str],
+               base_octave: int, scheme: Optional[str] = None) -> Chord:
+   # Chord types and inversions outside the enums (sevenths, ninths) are passed by their theory_tables name
+   pitches, syllables, colour_slots = chord_entry(PitchClass[root_], getattr(chord_type, 'value', chord_type),
+                                                  getattr(inversion_type, 'value', inversion_type))
+   chord_colours = get_scheme(scheme).rgba('chord_colours')
+   colours = [chord_colours[slot] for slot in colour_slots]
 
    return_chord= Chord()
-   return_chord.notes = [f"{bases[note_i % keys_per_octave]}{note_i // keys_per_octave + base_octave}" for note_i in notes]
+   return_chord.notes = [Pitch(note_i + base_octave * keys_per_octave) for note_i in pitches]
    return_chord.colours = {}
    s = ""
    for i, note in enumerate(return_chord.notes):
       return_chord.colours[note] = colours[i]
-      s += f"{note[0]}{syllables[i]}"
+      s += f"{note.pitch_class.name}{syllables[i]}"
    return_chord.syllables = s
    return return_chord
 
-count = 0
 
-chord_from_file: Dict[str, Dict[str,str]] = read_file()
-with open('result.csv', mode='w') as csvfile:
-   csvfile.write("Syllables\tMnemonic\tKeyboard\tPianoroll\tTypeAndQuality\tKeyboardColoured\tPianorollColoured\t"
-                 "relative_chord_type_1\trelative_chord_syllables_1\trelative_chord_keyboard_1\t"
-                 "relative_chord_type_2\trelative_chord_syllables_2\trelative_chord_keyboard_2"
-                 "\n")
+chord_columns = ['Syllables', 'Mnemonic', 'Keyboard', 'Pianoroll', 'TypeAndQuality', 'KeyboardColoured',
+                 'PianorollColoured', 'relative_chord_type_1', 'relative_chord_syllables_1', 'relative_chord_keyboard_1',
+                 'relative_chord_type_2', 'relative_chord_syllables_2', 'relative_chord_keyboard_2']
+
+
+@profiled('chords')
+def generate_chord_deck(csv_path: str = 'result.csv', output_dir: str = 'output/chords/', scheme: Optional[str] = None,
+                        store_path: str = default_store_path):
+   count = 0
+   jobs: List[RenderJob] = []
+   rows = []
+
+   chords = {}
+   for root in bases[0:12]:
+      for chord_type in ChordType:
+         for inversion_type in ChordInversionType:
+            with stage('theory'):
+               chords[(root, chord_type, inversion_type)] = make_chord(root, chord_type, inversion_type, 0, scheme)
    for i, root in enumerate(bases[0:12]):
       for inversion_type in ChordInversionType:
          for chord_type in ChordType:
-            chord = make_chord(root, chord_type, inversion_type, 0)
+            chord = chords[(root, chord_type, inversion_type)]
             chord_name = f"{root}-{chord.syllables}-{chord_type.value}-{inversion_type.value}"
             file_name_keyboard = f"{chord_name}-keyboard-2.png"
             file_name_keyboard_coloured = (f"{chord_name}-keyboard-coloured-2.png")
             file_name_pianoroll = f"{chord_name}-pianoroll-2.png"
             file_name_pianoroll_coloured = (f"{chord_name}-pianoroll-coloured-2.png")
 
-            mnemonic = ''
-            if chord.syllables in chord_from_file:
-               mnemonic = chord_from_file[chord.syllables]['Mnemonic']
-
-            file_str = f"{chord.syllables}\t" \
-                       f"{mnemonic}\t" \
-                       f"<img src=\"{file_name_keyboard}\">\t" \
-                       f"<img src=\"{file_name_pianoroll}\">\t" \
-                       f"{chord_type.value} {inversion_type.value}\t" \
-                       f"<img src=\"{file_name_keyboard_coloured}\">\t" \
-                       f"<img src=\"{file_name_pianoroll_coloured}\">\t"
-
-            relative_chords: List[str] = []
+            fields = {
+               'Syllables': chord.syllables,
+               'Keyboard': f"<img src=\"{file_name_keyboard}\">",
+               'Pianoroll': f"<img src=\"{file_name_pianoroll}\">",
+               'TypeAndQuality': f"{chord_type.value} {inversion_type.value}",
+               'KeyboardColoured': f"<img src=\"{file_name_keyboard_coloured}\">",
+               'PianorollColoured': f"<img src=\"{file_name_pianoroll_coloured}\">",
+            }
+            relative_number = 0
             for relative_chord_type in ChordInversionType:
                if relative_chord_type == inversion_type:
                   continue
-               relative_chord_syllables = make_chord(root, chord_type, relative_chord_type, 0).syllables
-               relative_chords.append(f"{relative_chord_type.value}\t{relative_chord_syllables}")
+               relative_number += 1
+               relative_chord_syllables = chords[(root, chord_type, relative_chord_type)].syllables
                relative_chord_name = f"{root}-{relative_chord_syllables}-{chord_type.value}-{relative_chord_type.value}"
                relative_file_name_keyboard = f"{relative_chord_name}-keyboard-coloured-2.png"
-               relative_chords.append(f"<img src=\"{relative_file_name_keyboard}\">")
-            file_str += "\t".join(relative_chords)
+               fields[f'relative_chord_type_{relative_number}'] = relative_chord_type.value
+               fields[f'relative_chord_syllables_{relative_number}'] = relative_chord_syllables
+               fields[f'relative_chord_keyboard_{relative_number}'] = f"<img src=\"{relative_file_name_keyboard}\">"
 
             print(chord.syllables)
-            csvfile.write(file_str + '\n')
-
-            draw_keyboard('output/chords/keyboard/', file_name_keyboard, chord.notes)
-            draw_keyboard('output/chords/keyboard/', file_name_keyboard_coloured,
-                          chord.notes, chord.colours)
-            draw_piano_roll('output/chords/pianoroll/', file_name_pianoroll, chord.notes)
-            draw_piano_roll('output/chords/pianoroll/', file_name_pianoroll_coloured,
-                            chord.notes, chord.colours)
+            # Mnemonics belong to the syllables, so chords that sound alike share one
+            rows.append((chord_name, chord.syllables, fields))
+
+            jobs.append(RenderJob(KEYBOARD, output_dir + 'keyboard/', file_name_keyboard, chord.notes))
+            jobs.append(RenderJob(KEYBOARD, output_dir + 'keyboard/', file_name_keyboard_coloured,
+                                  chord.notes, chord.colours))
+            jobs.append(RenderJob(PIANO_ROLL, output_dir + 'pianoroll/', file_name_pianoroll, chord.notes))
+            jobs.append(RenderJob(PIANO_ROLL, output_dir + 'pianoroll/', file_name_pianoroll_coloured,
+                                  chord.notes, chord.colours))
             count += 1
-print("count = ", count)
+
+   with stage('audio'):
+      rows, columns, sounds = with_sounds('chords', rows, chord_columns)
+   with stage('csv'), DeckStore(store_path) as store:
+      store.import_annotations('chords', csv_file_path, read_file, ['Mnemonic'])
+      print("updated rows = ", store.update_rows('chords', rows))
+      store.export_tsv('chords', csv_path, columns, {'Mnemonic': ''})
+      keys = store.keys('chords')
+   render_deck(jobs, output_dir, 'chords', csv_path, note_keys=keys, media_paths=sounds)
+   print("count = ", count)
+
+
+if __name__ == '__main__':
+   generate_chord_deck()
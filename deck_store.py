@@ -0,0 +1,176 @@
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+# Generated fields of every deck row plus the hand-written ones (mnemonics, songs to practice)
+default_store_path = 'decks.sqlite'
+
+schema = """
+CREATE TABLE IF NOT EXISTS rows (
+   deck TEXT NOT NULL,
+   key TEXT NOT NULL,
+   position INTEGER NOT NULL,
+   annotation_key TEXT NOT NULL,
+   fields TEXT NOT NULL,
+   fields_hash TEXT NOT NULL,
+   PRIMARY KEY (deck, key)
+);
+CREATE INDEX IF NOT EXISTS rows_by_position ON rows (deck, position);
+CREATE TABLE IF NOT EXISTS annotations (
+   deck TEXT NOT NULL,
+   key TEXT NOT NULL,
+   field TEXT NOT NULL,
+   value TEXT,
+   PRIMARY KEY (deck, key, field)
+);
+CREATE TABLE IF NOT EXISTS sources (
+   path TEXT PRIMARY KEY,
+   mtime_ns INTEGER NOT NULL,
+   size INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS imported (
+   deck TEXT NOT NULL,
+   key TEXT NOT NULL,
+   field TEXT NOT NULL,
+   value TEXT,
+   PRIMARY KEY (deck, key, field)
+);
+"""
+
+
+class DeckStore:
+   """SQLite store of deck rows keyed per deck, with manual annotations kept apart from generated fields."""
+
+   def __init__(self, path: str = default_store_path):
+      self.connection = sqlite3.connect(path)
+      self.connection.executescript(schema)
+
+   def close(self):
+      self.connection.close()
+
+   def __enter__(self):
+      return self
+
+   def __exit__(self, *exc_info):
+      if exc_info[0] is None:
+         self.connection.commit()
+      self.close()
+
+   def import_annotations(self, deck: str, source_path: str, load: Callable[[], Dict[str, Dict[str, str]]],
+                          fields: List[str]) -> bool:
+      # Only re-parse a hand-maintained file when it changed since the last import. Then only the values that
+      # changed in the file since that import win, so edits made with `deck_store.py set` survive it.
+      stat = os.stat(source_path)
+      known = self.connection.execute("SELECT mtime_ns, size FROM sources WHERE path = ?", (source_path,)).fetchone()
+      if known == (stat.st_mtime_ns, stat.st_size):
+         return False
+      last_import = {(key, field): value for key, field, value in self.connection.execute(
+         "SELECT key, field, value FROM imported WHERE deck = ?", (deck,))}
+      values = [(deck, key, field, row.get(field)) for key, row in load().items() for field in fields]
+      missing = object()
+      self.connection.executemany(
+         "INSERT OR REPLACE INTO annotations (deck, key, field, value) VALUES (?, ?, ?, ?)",
+         (value for value in values if last_import.get(value[1:3], missing) != value[3]))
+      self.connection.execute("DELETE FROM imported WHERE deck = ?", (deck,))
+      self.connection.executemany("INSERT INTO imported (deck, key, field, value) VALUES (?, ?, ?, ?)", values)
+      self.connection.execute("INSERT OR REPLACE INTO sources (path, mtime_ns, size) VALUES (?, ?, ?)",
+                              (source_path, stat.st_mtime_ns, stat.st_size))
+      self.connection.commit()
+      return True
+
+   def set_annotation(self, deck: str, key: str, field: str, value: Optional[str]):
+      self.connection.execute("INSERT OR REPLACE INTO annotations (deck, key, field, value) VALUES (?, ?, ?, ?)",
+                              (deck, key, field, value))
+
+   def annotation(self, deck: str, key: str, field: str) -> Optional[str]:
+      row = self.connection.execute("SELECT value FROM annotations WHERE deck = ? AND key = ? AND field = ?",
+                                    (deck, key, field)).fetchone()
+      return row[0] if row else None
+
+   def update_rows(self, deck: str, rows: Iterable[tuple]) -> int:
+      # rows: (key, annotation key, generated fields) in deck order. Writes only the rows whose fields changed,
+      # drops the rows that are no longer generated with the annotations no row uses any more, and returns how many
+      # rows were written.
+      existing = {key: (position, fields_hash) for key, position, fields_hash in self.connection.execute(
+         "SELECT key, position, fields_hash FROM rows WHERE deck = ?", (deck,))}
+      changed = []
+      seen = set()
+      for position, (key, annotation_key, fields) in enumerate(rows):
+         fields_json = json.dumps(fields, ensure_ascii=False)
+         fields_hash = hashlib.sha256(f"{annotation_key}\0{fields_json}".encode('utf-8')).hexdigest()
+         seen.add(key)
+         if existing.get(key) != (position, fields_hash):
+            changed.append((deck, key, position, annotation_key, fields_json, fields_hash))
+      self.connection.executemany(
+         "INSERT OR REPLACE INTO rows (deck, key, position, annotation_key, fields, fields_hash) "
+         "VALUES (?, ?, ?, ?, ?, ?)", changed)
+      self.connection.executemany("DELETE FROM rows WHERE deck = ? AND key = ?",
+                                  ((deck, key) for key in existing if key not in seen))
+      self.connection.execute("DELETE FROM annotations WHERE deck = ? AND key NOT IN "
+                              "(SELECT annotation_key FROM rows WHERE deck = ?)", (deck, deck))
+      self.connection.commit()
+      return len(changed)
+
+   def keys(self, deck: str) -> List[str]:
+      # Row keys in deck order, the order export_tsv writes the rows in
+      return [key for key, in self.connection.execute("SELECT key FROM rows WHERE deck = ? ORDER BY position, key",
+                                                       (deck,))]
+
+   def iter_rows(self, deck: str, columns: List[str], annotation_defaults: Dict[str, str]) -> Iterator[List[str]]:
+      # Generated fields and annotations merged into the column order, streamed in deck order
+      query = ("SELECT rows.key, rows.fields, annotations.field, annotations.value FROM rows "
+               "LEFT JOIN annotations ON annotations.deck = rows.deck AND annotations.key = rows.annotation_key "
+               "WHERE rows.deck = ? ORDER BY rows.position, rows.key")
+      # One row per key: neighbouring rows may well have the same generated fields
+      current_key, current_fields, current_annotations = None, None, {}
+      for key, fields_json, field, value in self.connection.execute(query, (deck,)):
+         if current_fields is None or key != current_key:
+            if current_fields is not None:
+               yield self._merge(current_fields, current_annotations, columns, annotation_defaults)
+            current_key, current_fields, current_annotations = key, fields_json, {}
+         if field is not None:
+            current_annotations[field] = value
+      if current_fields is not None:
+         yield self._merge(current_fields, current_annotations, columns, annotation_defaults)
+
+   @staticmethod
+   def _merge(fields_json: str, annotations: Dict[str, Optional[str]], columns: List[str],
+              annotation_defaults: Dict[str, str]) -> List[str]:
+      fields = json.loads(fields_json)
+      row = []
+      for column in columns:
+         if column in annotation_defaults:
+            value = annotations.get(column)
+            row.append(annotation_defaults[column] if value is None else value)
+         else:
+            row.append(fields.get(column, ''))
+      return row
+
+   def export_tsv(self, deck: str, csv_path: str, columns: List[str], annotation_defaults: Dict[str, str]) -> bool:
+      # Leaves the CSV alone, mtime included, when it already holds these rows; returns whether it was written
+      lines = ["\t".join(columns) + "\n"]
+      lines += ["\t".join(row) + "\n" for row in self.iter_rows(deck, columns, annotation_defaults)]
+      text = ''.join(lines)
+      if os.path.exists(csv_path):
+         with open(csv_path, mode='r', encoding='utf-8') as csvfile:
+            if csvfile.read() == text:
+               return False
+      with open(csv_path, mode='w', encoding='utf-8') as csvfile:
+         csvfile.write(text)
+      return True
+
+
+if __name__ == '__main__':
+   # python deck_store.py set <deck> <key> <field> <value>   edit a mnemonic or song without touching any CSV
+   # python deck_store.py get <deck> <key> <field>
+   command, *arguments = sys.argv[1:]
+   with DeckStore() as store:
+      if command == 'set':
+         store.set_annotation(*arguments)
+      elif command == 'get':
+         print(store.annotation(*arguments))
+      else:
+         sys.exit(f"unknown command: {command}")
@@ -0,0 +1,42 @@
+import argparse
+from typing import List, Optional
+
+from chord_syllables import ChordType, ChordInversionType, Chord, make_chord, generate_chord_deck
+from draw_intervals import interval_to_letters
+from draw_scales_on_piano_keyboard import Direction, ModeNotes, make_modes, make_sargam, generate_mode_deck
+from interval_syllables import generate_interval_deck
+from palettes import scheme_names, set_active_scheme
+from pitch import Pitch, PitchClass
+
+__all__ = [
+   'ChordType', 'ChordInversionType', 'Chord', 'make_chord',
+   'Direction', 'ModeNotes', 'make_modes', 'make_sargam',
+   'interval_to_letters', 'Pitch', 'PitchClass',
+   'generate_chord_deck', 'generate_interval_deck', 'generate_mode_deck',
+   'main',
+]
+
+deck_generators = {
+   'chords': generate_chord_deck,
+   'intervals': generate_interval_deck,
+   'modes': generate_mode_deck,
+}
+
+
+def main(argv: Optional[List[str]] = None):
+   parser = argparse.ArgumentParser(description="Generate the chord, interval and mode flashcard decks")
+   parser.add_argument('decks', nargs='*', metavar='deck',
+                       help=f"decks to build: {', '.join(deck_generators)} (all of them by default)")
+   parser.add_argument('--palette', choices=scheme_names(), help="colour scheme for every deck")
+   args = parser.parse_args(argv)
+   unknown = [deck for deck in args.decks if deck not in deck_generators]
+   if unknown:
+      parser.error(f"unknown deck: {', '.join(unknown)}")
+   if args.palette:
+      set_active_scheme(args.palette)
+   for deck in args.decks or deck_generators:
+      deck_generators[deck]()
+
+
+if __name__ == '__main__':
+   main()
@@ -1,5 +1,19 @@
-from matplotlib import pyplot as plt
+import io
+import os
+from typing import BinaryIO, Union
 
+from instrumentation import stage
+from pitch import Pitch, PitchClass, NoteLike
+
+# matplotlib and NumPy are imported by the renderers on first use, so the note helpers load instantly
+
+# Bump whenever a change alters the rendered pixels, so cached images get re-rendered
+RENDERER_VERSION = 1
+
+# Rendering backends: matplotlib patches, the NumPy compositor in raster_backend or SVG text from svg_backend
+MATPLOTLIB = 'matplotlib'
+RASTER = 'raster'
+SVG = 'svg'
 
 keys_per_octave = 12
 white_keys = ['K', 'D', 'M', 'F', 'G', 'L', 'B']
@@ -10,88 +24,273 @@ black_keys = ['T', 'N', 'J', 'R', 'P']
 white_key_positions = {'K': 0, 'D': 1, 'M': 2, 'F': 3, 'G': 4, 'L': 5, 'B': 6}
 black_key_positions = {'T': 0, 'N': 1, 'J': 3, 'R': 4, 'P': 5}
 white_key_to_black_key = {'K': 'T', 'D': 'N', 'F': 'J', 'G': 'R', 'L': 'P'}
+white_key_pitch_classes = [PitchClass[key] for key in white_keys]
+# Pitch class of the black key right of each white key, None where there is none
+black_key_pitch_classes = [PitchClass[white_key_to_black_key[key]] if key in white_key_to_black_key else None
+                           for key in white_keys]
 
 
-def draw_piano_roll(path, file_name: str, note_list: list[str], colours=None):
-   octaves = 2  # Set the number of octaves you want to see
-   total_keys = octaves * keys_per_octave
-   total_white_keys = octaves * white_keys_per_octave
-   colours = colours or {}
-   start_x = 1
-   note_indexes = [get_note_index(note) for note in note_list]
-   total_keys = octaves * keys_per_octave
-   plt.figure(figsize=(8, 2*octaves))  # Increase the height of the graph to display more octaves
-   plt.ylim(0, total_keys)
-   plt.xlim(0, 5)
+class KeyboardTemplate:
+   """Keyboard figure built once per (octaves, start white key) and recoloured for every image."""
+
+   def __init__(self, octaves: int, start_white_key: int):
+      from matplotlib.backends.backend_agg import FigureCanvasAgg
+      from matplotlib.figure import Figure
+      from matplotlib.patches import Rectangle
+
+      self.octaves = octaves
+      self.start_white_key = start_white_key
+      total_white_keys = octaves * white_keys_per_octave
+      self.figure = Figure(figsize=(7/2*octaves, 2))
+      self.canvas = FigureCanvasAgg(self.figure)
+      axes = self.figure.add_subplot()
+      axes.set_xlim(-start_white_key, total_white_keys-start_white_key)
+      axes.set_ylim(0, 3)
+
+      # Patches by pitch together with the colour they have when not highlighted
+      self.key_patches: dict[int, tuple['Rectangle', str]] = {}
+
+      # Draw white keys
+      for i in range(-start_white_key, white_keys_per_octave * octaves - start_white_key):
+         octave = i // white_keys_per_octave
+         patch = axes.add_patch(Rectangle((i, 0), 1, 3, facecolor='white', edgecolor='black'))
+         self.key_patches[octave * keys_per_octave + white_key_pitch_classes[i % white_keys_per_octave]] = (patch, 'white')
+
+      for i in range(-start_white_key, white_keys_per_octave * octaves - start_white_key):
+         octave = i // white_keys_per_octave
+         black_key = black_key_pitch_classes[i % white_keys_per_octave]
+         if black_key is not None:
+            patch = axes.add_patch(Rectangle((i+0.7, 1.3), (1-0.7)*2, 1.7, facecolor='black', edgecolor='black'))
+            self.key_patches[octave * keys_per_octave + black_key] = (patch, 'black')
+
+      axes.axis('off')  # Hide the axes
+      self.highlighted: list[int] = []
+
+   def recolour(self, highlighted_notes: list[Pitch], colours: dict[Pitch, str]):
+      # Only the keys touched by the previous image need to be reset
+      for note in self.highlighted:
+         patch, default_colour = self.key_patches[note]
+         patch.set_facecolor(default_colour)
+      self.highlighted = [note for note in highlighted_notes if note in self.key_patches]
+      for note in self.highlighted:
+         patch, default_colour = self.key_patches[note]
+         patch.set_facecolor(colours.get(note, 'darkred' if default_colour == 'black' else 'lightcoral'))
+
+   def save(self, file: Union[str, BinaryIO]):
+      self.figure.savefig(file, format='png')
+
+   def rasterise(self, scale: float = 1.0) -> 'np.ndarray':
+      return draw_canvas(self.figure, self.canvas, scale)
+
+
+class PianoRollTemplate:
+   """Piano roll figure with its background built once per (octaves, start index)."""
+
+   def __init__(self, octaves: int, start_index: int):
+      from matplotlib.backends.backend_agg import FigureCanvasAgg
+      from matplotlib.figure import Figure
+      from matplotlib.patches import Rectangle
+
+      self.octaves = octaves
+      self.start_index = start_index
+      total_keys = octaves * keys_per_octave
+      self.figure = Figure(figsize=(8, 2*octaves))  # Increase the height of the graph to display more octaves
+      self.canvas = FigureCanvasAgg(self.figure)
+      self.axes = self.figure.add_subplot()
+      self.axes.set_ylim(0, total_keys)
+      self.axes.set_xlim(0, 5)
+
+      # Draw the background for the piano roll
+      for i in range(-start_index, total_keys-start_index):
+         is_sharp = note_names[i % keys_per_octave] in black_keys
+         back_colour = 'whitesmoke' if is_sharp else 'white'
+         self.axes.add_patch(Rectangle((0, i+start_index), 28, 1, facecolor=back_colour, edgecolor='whitesmoke'))
+
+      # Remove axis ticks and labels for a cleaner look on the piano roll
+      self.axes.set_xticks([])
+      self.axes.set_yticks([])
+      self.note_patches: list['Rectangle'] = []
+
+   def place_notes(self, note_indexes: list[int], colours: list[str]):
+      from matplotlib.patches import Rectangle
+
+      for patch in self.note_patches:
+         patch.remove()
+      start_x = 1
+      self.note_patches = [
+         self.axes.add_patch(Rectangle((start_x, note+self.start_index), 3, 1, facecolor=colour, edgecolor='whitesmoke'))
+         for note, colour in zip(note_indexes, colours)
+      ]
+
+   def save(self, file: Union[str, BinaryIO]):
+      self.figure.savefig(file, format='png')
+
+   def rasterise(self, scale: float = 1.0) -> 'np.ndarray':
+      return draw_canvas(self.figure, self.canvas, scale)
+
+
+def draw_canvas(figure, canvas, scale: float) -> 'np.ndarray':
+   # RGBA pixels of a matplotlib template's figure. Larger images come from drawing the same figure at a higher dpi,
+   # the shared template keeps its own.
+   import numpy as np
+
+   dpi = figure.dpi
+   if scale != 1:
+      figure.set_dpi(dpi * scale)
+   try:
+      canvas.draw()
+      return np.array(canvas.buffer_rgba())
+   finally:
+      if scale != 1:
+         figure.set_dpi(dpi)
+
+
+_keyboard_templates: dict[tuple[int, int], KeyboardTemplate] = {}
+_piano_roll_templates: dict[tuple[int, int], PianoRollTemplate] = {}
+
 
+def get_keyboard_template(octaves: int, start_white_key: int) -> KeyboardTemplate:
+   key = (octaves, start_white_key)
+   if key not in _keyboard_templates:
+      _keyboard_templates[key] = KeyboardTemplate(octaves, start_white_key)
+   return _keyboard_templates[key]
+
+
+def get_piano_roll_template(octaves: int, start_index: int) -> PianoRollTemplate:
+   key = (octaves, start_index)
+   if key not in _piano_roll_templates:
+      _piano_roll_templates[key] = PianoRollTemplate(octaves, start_index)
+   return _piano_roll_templates[key]
+
+
+def encode_template(template) -> bytes:
+   # The PNG of any prepared template, whatever its backend: anything with a save(file).
+   # With matplotlib this includes drawing the figure, savefig always redraws it
+   with stage('encode'):
+      buffer = io.BytesIO()
+      template.save(buffer)
+      return buffer.getvalue()
+
+
+def encode_pixels(pixels: 'np.ndarray', file: Union[str, BinaryIO], backend=MATPLOTLIB):
+   # Encodes rasterised pixels into the same PNG the template's save() writes, without the template
+   if backend == RASTER:
+      from PIL import Image
+      Image.fromarray(pixels, 'RGBA').save(file, format='PNG')
+   else:
+      import matplotlib
+      from matplotlib.image import imsave
+      imsave(file, pixels, format='png', origin='upper', dpi=matplotlib.rcParams['figure.dpi'])
+
+
+def write_file(file_path: str, data: bytes):
+   # Every deck image is written this way. Replaced rather than rewritten in place, so hardlinked copies of the old
+   # image keep their pixels and nothing ever sees half a file.
+   with stage('write'):
+      tmp_path = file_path + '.tmp'
+      with open(tmp_path, 'wb') as image_file:
+         image_file.write(data)
+      os.replace(tmp_path, file_path)
+
+
+def resize_pixels(pixels: 'np.ndarray', scale: float) -> 'np.ndarray':
+   # RGBA pixels resampled to scale times their size, a copy when the scale is 1
+   import numpy as np
+   from PIL import Image
+
+   if scale == 1:
+      return pixels.copy()
+   size = (round(pixels.shape[1] * scale), round(pixels.shape[0] * scale))
+   return np.asarray(Image.fromarray(pixels, 'RGBA').resize(size, Image.LANCZOS))
+
+
+def rasterise_template(template, scale: float = 1.0) -> 'np.ndarray':
+   # RGBA pixels of any prepared template, anything with a rasterise(scale)
+   with stage('rasterise'):
+      return template.rasterise(scale)
+
+
+def prepare_piano_roll(note_list: list[NoteLike], colours=None, octaves=2, backend=MATPLOTLIB):
+   # The shared piano roll template of the backend with the notes placed, like prepare_keyboard
+   total_keys = octaves * keys_per_octave
+   note_indexes, colours = parse_notes(note_list, colours)
    start_index_to_place_in_the_middle = calculate_start_index(note_indexes, total_keys)
 
-   # Draw the background for the piano roll
-   for i in range(-start_index_to_place_in_the_middle, total_keys-start_index_to_place_in_the_middle):
-      is_sharp = note_names[i % keys_per_octave] in black_keys
-      back_colour = 'whitesmoke' if is_sharp else 'white'
-      plt.gca().add_patch(plt.Rectangle((0, i+start_index_to_place_in_the_middle), 28, 1,
-                                        facecolor=back_colour, edgecolor='whitesmoke'))
+   with stage('patches'):
+      if backend == RASTER:
+         from raster_backend import get_piano_roll_raster
+         template = get_piano_roll_raster(octaves, start_index_to_place_in_the_middle)
+      elif backend == SVG:
+         from svg_backend import get_piano_roll_svg
+         template = get_piano_roll_svg(octaves, start_index_to_place_in_the_middle)
+      else:
+         template = get_piano_roll_template(octaves, start_index_to_place_in_the_middle)
+      template.place_notes(note_indexes, [colours.get(note, 'pink') for note in note_indexes])
+   return template
+
+
+def draw_piano_roll(path, file_name: str, note_list: list[NoteLike], colours=None, octaves=2, backend=MATPLOTLIB):
+   write_file(path + file_name, encode_template(prepare_piano_roll(note_list, colours, octaves, backend)))
+
+
+def render_piano_roll(note_list: list[NoteLike], colours=None, octaves=2, backend=MATPLOTLIB,
+                      scale: float = 1.0) -> 'np.ndarray':
+   # RGBA pixels of the piano roll, for callers that pack or encode images themselves
+   return rasterise_template(prepare_piano_roll(note_list, colours, octaves, backend), scale)
+
 
-   # Draw the notes on the piano roll
-   for i, note in enumerate(note_indexes):
-      colour = colours.get(note_list[i], 'pink')
-      plt.gca().add_patch(plt.Rectangle((start_x, note+start_index_to_place_in_the_middle), 3, 1,
-                                        facecolor=colour, edgecolor='whitesmoke'))
+def encode_piano_roll(note_list: list[NoteLike], colours=None, octaves=2, backend=MATPLOTLIB) -> bytes:
+   # The same PNG draw_piano_roll writes, for callers that store it somewhere other than a file
+   return encode_template(prepare_piano_roll(note_list, colours, octaves, backend))
 
-   # Remove axis ticks and labels for a cleaner look on the piano roll
-   plt.xticks([])
-   plt.yticks([])
 
-   plt.savefig(path + file_name)
-   # plt.show()
-   plt.close()
+def get_note_index(note: NoteLike) -> Pitch:
+   return Pitch.parse(note)
 
 
-def get_note_index(note:str):
-   note_name = note[0]
-   octave = int(note[1])
-   return note_names.index(note_name) + octave * keys_per_octave
+def parse_notes(notes: list[NoteLike], colours: dict = None) -> tuple[list[Pitch], dict[Pitch, str]]:
+   # Notes and colour keys as integer pitches: renderers work on those, callers may still pass note names like 'K1'
+   return ([Pitch.parse(note) for note in notes or []],
+           {Pitch.parse(note): colour for note, colour in (colours or {}).items()})
 
 
-def draw_keyboard(path, file_name: str, highlighted_notes: list[str] = None, colours: dict[str, str] = None, octaves=2):
+def prepare_keyboard(highlighted_notes: list[NoteLike] = None, colours: dict[NoteLike, str] = None, octaves=2,
+                     backend=MATPLOTLIB):
+   # The shared keyboard template of the backend with the notes coloured in, for callers that draw on it
+   # themselves. Valid until the next keyboard of the same size and position is prepared.
    total_keys = octaves * keys_per_octave
-   total_white_keys = octaves * white_keys_per_octave
-   highlighted_notes = highlighted_notes or []
-   colours = colours or {}
-   note_indexes = [get_note_index(note) for note in highlighted_notes]
+   note_indexes, colours = parse_notes(highlighted_notes, colours)
    start_index = calculate_start_index(note_indexes, total_keys)
    start_white_key = round(start_index / keys_per_octave * white_keys_per_octave)
 
-   plt.figure(figsize=(7/2*octaves, 2))
-   plt.xlim(-start_white_key, total_white_keys-start_white_key)
-   plt.ylim(0, 3)
-
-   # Draw white keys
-   for i in range(-start_white_key, white_keys_per_octave * octaves - start_white_key):
-      white_key = white_keys[i % white_keys_per_octave]
-      octave = i // white_keys_per_octave
-      colour = 'white'
-      if f'{white_key}{octave}' in highlighted_notes:
-         colour = colours.get(f'{white_key}{octave}', 'lightcoral')
-      plt.gca().add_patch(plt.Rectangle((i, 0), 1, 3,
-                                        facecolor=colour, edgecolor='black'))
-
-   for i in range(-start_white_key, white_keys_per_octave * octaves - start_white_key):
-      white_key = white_keys[i % white_keys_per_octave]
-      octave = i // white_keys_per_octave
-      if white_key in white_key_to_black_key:
-         black_key = white_key_to_black_key[white_key]
-         colour = 'black'
-         if f'{black_key}{octave}' in highlighted_notes:
-            colour = colours.get(f'{black_key}{octave}', 'darkred')
-         plt.gca().add_patch(plt.Rectangle((i+0.7, 1.3), (1-0.7)*2, 1.7,
-                                           facecolor=colour, edgecolor='black'))
-
-   plt.axis('off')  # Hide the axes
-   plt.savefig(path + file_name)
-   # plt.show()
-   plt.close()
+   with stage('patches'):
+      if backend == RASTER:
+         from raster_backend import get_keyboard_raster
+         template = get_keyboard_raster(octaves, start_white_key)
+      elif backend == SVG:
+         from svg_backend import get_keyboard_svg
+         template = get_keyboard_svg(octaves, start_white_key)
+      else:
+         template = get_keyboard_template(octaves, start_white_key)
+      template.recolour(note_indexes, colours)
+   return template
+
+
+def draw_keyboard(path, file_name: str, highlighted_notes: list[NoteLike] = None, colours: dict[NoteLike, str] = None,
+                  octaves=2, backend=MATPLOTLIB):
+   write_file(path + file_name, encode_template(prepare_keyboard(highlighted_notes, colours, octaves, backend)))
+
+
+def render_keyboard(highlighted_notes: list[NoteLike] = None, colours: dict[NoteLike, str] = None,
+                    octaves=2, backend=MATPLOTLIB, scale: float = 1.0) -> 'np.ndarray':
+   # RGBA pixels of the keyboard, for callers that pack or encode images themselves
+   return rasterise_template(prepare_keyboard(highlighted_notes, colours, octaves, backend), scale)
+
+
+def encode_keyboard(highlighted_notes: list[NoteLike] = None, colours: dict[NoteLike, str] = None,
+                    octaves=2, backend=MATPLOTLIB) -> bytes:
+   # The same PNG draw_keyboard writes, for callers that store it somewhere other than a file
+   return encode_template(prepare_keyboard(highlighted_notes, colours, octaves, backend))
 
 
 def calculate_start_index(note_indexes, total_keys):
@@ -112,6 +311,8 @@ def interval_to_letters(interval_list: list[str]) -> list[str]:
       clean_interval = interval.lstrip('-')  # Remove the '-' sign if present
       if clean_interval == 'A4' or clean_interval == 'd5':
          clean_interval = 'Triton'
+      # Other enharmonic spellings sing like the interval with the same number of semitones
+      clean_interval = {'A2': 'm3', 'd4': 'M3', 'A5': 'm6', 'd7': 'M6'}.get(clean_interval, clean_interval)
       if clean_interval in interval_names:
          index = interval_names.index(clean_interval)
          if is_downward:
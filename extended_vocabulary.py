@@ -0,0 +1,228 @@
+import argparse
+import glob
+import heapq
+import os
+import re
+from dataclasses import dataclass, field
+from itertools import islice
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from chord_syllables import make_chord
+from draw_intervals import bases, keys_per_octave
+from draw_scales_on_piano_keyboard import Direction, make_modes
+from render_cache import RenderCache
+from render_jobs import RenderJob, render_jobs, KEYBOARD, PIANO_ROLL
+from theory_tables import chord_type_intervals, inversion_names, all_scales_intervals
+
+# Every chord type in every inversion and every scale in both directions, on 1 to 4 octave keyboards.
+# Cards come out of lazy generators in one canonical order; a shard builds every N-th card of it:
+#   python extended_vocabulary.py build --shard 3/8
+#   python extended_vocabulary.py merge --shards 8
+
+octave_layouts = [1, 2, 3, 4]
+default_output_dir = 'output/extended/'
+# Images are rendered in batches while the cards are still being generated
+render_batch_size = 1024
+
+chord_columns = ['Syllables', 'Root', 'ChordType', 'Inversion', 'Octaves', 'Keyboard', 'KeyboardColoured',
+                 'Pianoroll', 'PianorollColoured']
+scale_columns = ['ModeAndDirection', 'Scale', 'Octaves', 'Syllables', 'KeyboardPicture', 'KeyboardPictureNoColours']
+deck_columns = {'extended-chords': chord_columns, 'extended-scales': scale_columns}
+
+
+@dataclass
+class Card:
+   deck: str
+   ordinal: int  # Position in the canonical order of its deck
+   fields: List[str]
+   jobs: List[RenderJob] = field(default_factory=list)
+
+
+def fits(notes: List[int], octaves: int) -> bool:
+   # The keyboard is centred on the notes, so they fit when their span leaves a key free
+   return max(notes) - min(notes) < octaves * keys_per_octave - 1
+
+
+def iter_chord_cards(output_dir: str = default_output_dir) -> Iterator[Card]:
+   image_dir = output_dir + 'chords/'
+   ordinal = 0
+   for octaves in octave_layouts:
+      for root in bases[0:12]:
+         for chord_type, intervals in chord_type_intervals.items():
+            for inversion in inversion_names[:len(intervals)]:
+               chord = make_chord(root, chord_type, inversion, 0)
+               if not fits(chord.notes, octaves):
+                  continue
+               chord_name = f"{root}-{chord.syllables}-{chord_type}-{inversion}-{octaves}".replace(' ', '-')
+               file_names = [f"{chord_name}-{suffix}.png" for suffix in
+                             ('keyboard', 'keyboard-coloured', 'pianoroll', 'pianoroll-coloured')]
+               yield Card('extended-chords', ordinal,
+                          [chord.syllables, root, chord_type, inversion, str(octaves)] +
+                          [f"<img src=\"{file_name}\">" for file_name in file_names],
+                          [RenderJob(KEYBOARD, image_dir, file_names[0], chord.notes, octaves=octaves),
+                           RenderJob(KEYBOARD, image_dir, file_names[1], chord.notes, chord.colours, octaves),
+                           RenderJob(PIANO_ROLL, image_dir, file_names[2], chord.notes, octaves=octaves),
+                           RenderJob(PIANO_ROLL, image_dir, file_names[3], chord.notes, chord.colours, octaves)])
+               ordinal += 1
+
+
+def iter_scale_cards(output_dir: str = default_output_dir) -> Iterator[Card]:
+   image_dir = output_dir + 'scales/'
+   ordinal = 0
+   for octaves in octave_layouts:
+      for scale in all_scales_intervals:
+         for root in bases[0:12]:
+            for direction in Direction:
+               mode_notes = make_modes(root, scale, base_octave=1, direction=direction)
+               if not fits(mode_notes.notes, octaves):
+                  continue
+               up = direction == Direction.UP
+               scale_name = f"mode-{scale}-{root}-{'up' if up else 'do'}-{octaves}".replace(' ', '-')
+               file_names = [f"{scale_name}.png", f"{scale_name}-no-colours.png"]
+               syllables = mode_notes.syllables if up else mode_notes.syllables[::-1]
+               yield Card('extended-scales', ordinal,
+                          [f"{scale} Mode: {root}{'->' if up else '<-'}{root}", scale, str(octaves), "".join(syllables)]
+                          + [f"<img src=\"{file_name}\"/>" for file_name in file_names],
+                          [RenderJob(KEYBOARD, image_dir, file_names[0], mode_notes.notes, mode_notes.colours,
+                                     octaves),
+                           RenderJob(KEYBOARD, image_dir, file_names[1], mode_notes.notes,
+                                     mode_notes.direction_colours, octaves)])
+               ordinal += 1
+
+
+def iter_cards(output_dir: str = default_output_dir) -> Iterator[Card]:
+   yield from iter_chord_cards(output_dir)
+   yield from iter_scale_cards(output_dir)
+
+
+def parse_shard(shard: str) -> Tuple[int, int]:
+   # '3/8' is the third of eight shards, numbered from 1
+   match = re.fullmatch(r'(\d+)/(\d+)', shard)
+   if not match or not 1 <= int(match.group(1)) <= int(match.group(2)):
+      raise ValueError(f"Shard must look like i/N with 1 <= i <= N, got {shard!r}")
+   return int(match.group(1)), int(match.group(2))
+
+
+def shard_cards(cards: Iterable[Card], index: int, count: int) -> Iterator[Card]:
+   # Round robin over the canonical order, so every shard gets a similar mix of cheap and expensive cards
+   return islice(cards, index - 1, None, count)
+
+
+def shard_path(output_dir: str, deck: str, index: int, count: int) -> str:
+   return os.path.join(output_dir, 'shards', f"{deck}-{index}-of-{count}.tsv")
+
+
+def _batched(jobs: Iterable[RenderJob], size: int) -> Iterator[List[RenderJob]]:
+   iterator = iter(jobs)
+   while batch := list(islice(iterator, size)):
+      yield batch
+
+
+def build_shard(index: int, count: int, output_dir: str = default_output_dir, processes: Optional[int] = None):
+   # Writes this shard's rows, with their canonical ordinal first, and renders its images
+   for directory in ('chords/', 'scales/', 'shards/'):
+      os.makedirs(output_dir + directory, exist_ok=True)
+   shard_files = {deck: open(shard_path(output_dir, deck, index, count), mode='w', encoding='utf-8')
+                  for deck in deck_columns}
+   cache = RenderCache(os.path.join(output_dir, 'shards', f"render-manifest-{index}-of-{count}.json"))
+   cards = images = 0
+
+   def shard_jobs() -> Iterator[RenderJob]:
+      nonlocal cards
+      for card in shard_cards(iter_cards(output_dir), index, count):
+         shard_files[card.deck].write("\t".join([str(card.ordinal)] + card.fields) + "\n")
+         cards += 1
+         yield from card.jobs
+
+   try:
+      for batch in _batched(shard_jobs(), render_batch_size):
+         outdated = cache.outdated_jobs(batch)
+         render_jobs(outdated, processes)
+         cache.record(outdated)
+         # After every batch, so an interrupted run keeps the images it already rendered
+         cache.save()
+         images += len(batch)
+   finally:
+      for shard_file in shard_files.values():
+         shard_file.close()
+   # Stale images are left to merge: a shard alone cannot tell a card that is gone from one that moved to another
+   # shard, which may be rendering it right now
+   print(f"shard {index}/{count}: {cards} cards, {images} images")
+
+
+def _read_shard(path: str) -> Iterator[Tuple[int, str]]:
+   with open(path, encoding='utf-8') as shard_file:
+      for line in shard_file:
+         ordinal, row = line.rstrip('\n').split('\t', 1)
+         yield int(ordinal), row
+
+
+def merge_shards(count: int, output_dir: str = default_output_dir):
+   # Streams the shard files back into one CSV per deck in canonical order, checking that no card is missing
+   for deck, columns in deck_columns.items():
+      paths = [shard_path(output_dir, deck, index, count) for index in range(1, count + 1)]
+      missing = [path for path in paths if not os.path.exists(path)]
+      if missing:
+         raise FileNotFoundError(f"Missing shards: {', '.join(missing)}")
+      csv_path = os.path.join(output_dir, f"{deck}.csv")
+      with open(csv_path, mode='w', encoding='utf-8') as csvfile:
+         csvfile.write("\t".join(columns) + "\n")
+         expected = 0
+         for ordinal, row in heapq.merge(*(_read_shard(path) for path in paths)):
+            if ordinal != expected:
+               raise ValueError(f"{deck}: card {expected} is missing or duplicated in the shards")
+            csvfile.write(row + "\n")
+            expected += 1
+      print(f"{csv_path}: {expected} cards")
+   removed = remove_stale_images(count, output_dir)
+   if removed:
+      print(f"removed {removed} images of cards that are gone")
+   stray = set(glob.glob(os.path.join(output_dir, 'shards', '*.tsv'))) - {
+      shard_path(output_dir, deck, index, count) for deck in deck_columns for index in range(1, count + 1)}
+   if stray:
+      print(f"ignored shards from another split: {', '.join(sorted(stray))}")
+
+
+def remove_stale_images(count: int, output_dir: str = default_output_dir) -> int:
+   # Once every shard is built: the images any manifest names that no card has any more, whichever split into
+   # shards rendered them. Manifests of other splits are dropped, the current split's manifests own every image.
+   jobs = [job for card in iter_cards(output_dir) for job in card.jobs]
+   manifest_name = re.compile(r'render-manifest-\d+-of-(\d+)\.json')
+   removed = 0
+   for manifest_path in glob.glob(os.path.join(glob.escape(output_dir), 'shards', 'render-manifest-*-of-*.json')):
+      match = manifest_name.fullmatch(os.path.basename(manifest_path))
+      if not match:
+         continue
+      cache = RenderCache(manifest_path)
+      removed += len(cache.remove_stale(jobs))
+      if int(match.group(1)) == count:
+         cache.save()
+      else:
+         os.remove(manifest_path)
+   return removed
+
+
+def main(argv: Optional[List[str]] = None):
+   parser = argparse.ArgumentParser(description="Build the extended chord and scale decks, optionally in shards")
+   parser.add_argument('--output-dir', default=default_output_dir)
+   commands = parser.add_subparsers(dest='command', required=True)
+   build = commands.add_parser('build', help="render one shard (all cards by default)")
+   build.add_argument('--shard', default='1/1', help="i/N: build every N-th card starting with the i-th")
+   build.add_argument('--processes', type=int, help="render pool size (DECK_PROCESSES by default)")
+   merge = commands.add_parser('merge', help="assemble the deck CSVs from the shard files")
+   merge.add_argument('--shards', type=int, required=True, help="how many shards the build was split into")
+   args = parser.parse_args(argv)
+
+   output_dir = os.path.join(args.output_dir, '')
+   if args.command == 'build':
+      try:
+         index, count = parse_shard(args.shard)
+      except ValueError as error:
+         parser.error(str(error))
+      build_shard(index, count, output_dir, args.processes)
+   else:
+      merge_shards(args.shards, output_dir)
+
+
+if __name__ == '__main__':
+   main()
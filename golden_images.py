@@ -0,0 +1,218 @@
+import argparse
+import base64
+import glob
+import hashlib
+import io
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from image_dedup import pixel_digest
+from render_jobs import default_processes
+
+# Golden fingerprints of the deck images, to see which cards a renderer or palette change touched:
+#   python golden_images.py record output/      before the change
+#   python golden_images.py check output/       after rebuilding the decks
+# Every image is kept as the hashes of its file and of its pixels, a 64 bit difference hash and a 16x16 grey
+# thumbnail, so a check never needs the reference PNGs, and only decodes the fresh images whose files changed.
+# Changed images get a diff thumbnail: the stored thumbnail next to the new image, with the changed cells outlined.
+
+default_fingerprints_path = 'output/golden-fingerprints.json'
+default_diff_dir = 'output/golden-diff/'
+grid_size = 16
+hash_size = 8
+cell_threshold = 8  # Grey levels a thumbnail cell may move before it is outlined
+thumbnail_width = 240
+
+# Status of an image that differs from its fingerprint
+CHANGED = 'changed'
+MISSING = 'missing'
+NEW = 'new'
+
+
+@dataclass(frozen=True)
+class Fingerprint:
+   file_digest: str  # Same file, same pixels: nothing to decode
+   digest: str  # pixel_digest, the same for the same pixels however the PNG was encoded
+   perceptual_hash: int
+   grid: bytes  # grid_size * grid_size grey levels, row by row
+
+   def to_json(self) -> dict:
+      return {'file': self.file_digest, 'pixels': self.digest, 'dhash': f"{self.perceptual_hash:016x}",
+              'grid': base64.b64encode(self.grid).decode('ascii')}
+
+   @classmethod
+   def from_json(cls, data: dict) -> 'Fingerprint':
+      return cls(data['file'], data['pixels'], int(data['dhash'], 16), base64.b64decode(data['grid']))
+
+   def grid_array(self) -> np.ndarray:
+      return np.frombuffer(self.grid, dtype=np.uint8).reshape(grid_size, grid_size)
+
+
+@dataclass(frozen=True)
+class Difference:
+   name: str  # Path of the image relative to the checked directory
+   status: str
+   distance: Optional[int] = None  # Differing bits of the perceptual hashes, 0 for changes too small to see
+   diff_path: Optional[str] = None
+
+
+def _grey(pixels: np.ndarray) -> Image.Image:
+   # The cards are shown on white, so transparent pixels count as white
+   image = Image.fromarray(pixels, 'RGBA')
+   background = Image.new('RGBA', image.size, 'white')
+   return Image.alpha_composite(background, image).convert('L')
+
+
+def fingerprint(data: bytes, pixels: np.ndarray) -> Fingerprint:
+   grey = _grey(pixels)
+   # Difference hash: is each cell of a 9x8 thumbnail brighter than its right neighbour
+   small = np.asarray(grey.resize((hash_size + 1, hash_size), Image.BOX), dtype=np.int16)
+   bits = (small[:, 1:] < small[:, :-1]).ravel()
+   perceptual_hash = int(np.packbits(bits).view('>u8')[0])
+   grid = np.asarray(grey.resize((grid_size, grid_size), Image.BOX), dtype=np.uint8)
+   return Fingerprint(file_digest(data), pixel_digest(pixels), perceptual_hash, grid.tobytes())
+
+
+def file_digest(data: bytes) -> str:
+   return hashlib.sha256(data).hexdigest()
+
+
+def _read(file_path: str) -> bytes:
+   with open(file_path, 'rb') as image_file:
+      return image_file.read()
+
+
+def _decode(data: bytes) -> np.ndarray:
+   with Image.open(io.BytesIO(data)) as image:
+      return np.asarray(image if image.mode == 'RGBA' else image.convert('RGBA'))
+
+
+def image_names(root: str, exclude: Optional[str] = None) -> List[str]:
+   # Every PNG below root, as posix paths relative to it
+   exclude = os.path.abspath(exclude) + os.sep if exclude else None
+   names = []
+   for file_path in glob.glob(os.path.join(glob.escape(root), '**', '*.png'), recursive=True):
+      if exclude is None or not os.path.abspath(file_path).startswith(exclude):
+         names.append(os.path.relpath(file_path, root).replace(os.sep, '/'))
+   return sorted(names)
+
+
+def _fingerprint_file(root: str, name: str) -> Tuple[str, Fingerprint]:
+   data = _read(os.path.join(root, name))
+   return name, fingerprint(data, _decode(data))
+
+
+def _map(function, items: List[tuple], processes: int) -> List:
+   if processes <= 1 or len(items) <= 1:
+      return [function(*item) for item in items]
+   chunksize = max(1, len(items) // (processes * 4))
+   with ProcessPoolExecutor(max_workers=processes) as executor:
+      return list(executor.map(function, *zip(*items), chunksize=chunksize))
+
+
+def record(root: str, fingerprints_path: str = default_fingerprints_path, processes: Optional[int] = None,
+           exclude: Optional[str] = default_diff_dir) -> int:
+   names = image_names(root, exclude)
+   fingerprints = dict(_map(_fingerprint_file, [(root, name) for name in names], processes or default_processes()))
+   directory = os.path.dirname(fingerprints_path)
+   if directory:
+      os.makedirs(directory, exist_ok=True)
+   tmp_path = fingerprints_path + '.tmp'
+   with open(tmp_path, mode='w', encoding='utf-8') as fingerprints_file:
+      json.dump({name: fingerprints[name].to_json() for name in names}, fingerprints_file, indent=1,
+                sort_keys=True)
+   os.replace(tmp_path, fingerprints_path)
+   return len(names)
+
+
+def load_fingerprints(fingerprints_path: str = default_fingerprints_path) -> Dict[str, Fingerprint]:
+   with open(fingerprints_path, mode='r', encoding='utf-8') as fingerprints_file:
+      return {name: Fingerprint.from_json(data) for name, data in json.load(fingerprints_file).items()}
+
+
+def diff_thumbnail(pixels: np.ndarray, reference: Fingerprint, current: Fingerprint) -> Image.Image:
+   # The stored grey thumbnail on the left, the new image on the right, changed cells outlined in red on both
+   height = max(1, round(pixels.shape[0] * thumbnail_width / pixels.shape[1]))
+   size = (thumbnail_width, height)
+   before = Image.fromarray(reference.grid_array(), 'L').resize(size, Image.NEAREST).convert('RGB')
+   after = _grey(pixels).resize(size, Image.BOX).convert('RGB')
+   sheet = Image.new('RGB', (2 * thumbnail_width + 4, height), 'white')
+   sheet.paste(before, (0, 0))
+   sheet.paste(after, (thumbnail_width + 4, 0))
+   draw = ImageDraw.Draw(sheet)
+   changed = np.abs(current.grid_array().astype(np.int16) - reference.grid_array()) > cell_threshold
+   cell_width, cell_height = thumbnail_width / grid_size, height / grid_size
+   for row, column in zip(*np.nonzero(changed)):
+      for left in (0, thumbnail_width + 4):
+         x, y = left + column * cell_width, row * cell_height
+         draw.rectangle((x, y, x + cell_width - 1, y + cell_height - 1), outline='red')
+   return sheet
+
+
+def _check_file(root: str, name: str, reference: Fingerprint, diff_dir: Optional[str]) -> Optional[Difference]:
+   data = _read(os.path.join(root, name))
+   if file_digest(data) == reference.file_digest:
+      return None
+   pixels = _decode(data)
+   if pixel_digest(pixels) == reference.digest:
+      return None  # Encoded differently, same pixels
+   current = fingerprint(data, pixels)
+   diff_path = None
+   if diff_dir is not None:
+      diff_path = os.path.join(diff_dir, os.path.splitext(name)[0] + '-diff.png')
+      os.makedirs(os.path.dirname(diff_path), exist_ok=True)
+      diff_thumbnail(pixels, reference, current).save(diff_path)
+   return Difference(name, CHANGED, bin(current.perceptual_hash ^ reference.perceptual_hash).count('1'), diff_path)
+
+
+def check(root: str, fingerprints: Dict[str, Fingerprint], diff_dir: Optional[str] = default_diff_dir,
+          processes: Optional[int] = None) -> List[Difference]:
+   # Only the images that differ from their fingerprints, in name order
+   if diff_dir is not None:
+      # Thumbnails of the last check would otherwise look like changes of this one
+      for old_diff in glob.glob(os.path.join(glob.escape(diff_dir), '**', '*-diff.png'), recursive=True):
+         os.remove(old_diff)
+   names = image_names(root, diff_dir)
+   present = [name for name in names if name in fingerprints]
+   changed = _map(_check_file, [(root, name, fingerprints[name], diff_dir) for name in present],
+                  processes or default_processes())
+   differences = [difference for difference in changed if difference is not None]
+   differences += [Difference(name, NEW) for name in names if name not in fingerprints]
+   differences += [Difference(name, MISSING) for name in set(fingerprints) - set(names)]
+   return sorted(differences, key=lambda difference: difference.name)
+
+
+def main(argv: Optional[List[str]] = None):
+   parser = argparse.ArgumentParser(description="Record fingerprints of the deck images, or check a build against them")
+   parser.add_argument('command', choices=['record', 'check'])
+   parser.add_argument('root', nargs='?', default='output/', help="directory holding the deck images")
+   parser.add_argument('--fingerprints', default=default_fingerprints_path)
+   parser.add_argument('--diff-dir', default=default_diff_dir, help="where check writes the diff thumbnails")
+   parser.add_argument('--processes', type=int, default=None)
+   args = parser.parse_args(argv)
+
+   if args.command == 'record':
+      count = record(args.root, args.fingerprints, args.processes, args.diff_dir)
+      print(f"recorded {count} images in {args.fingerprints}")
+      return
+
+   fingerprints = load_fingerprints(args.fingerprints)
+   differences = check(args.root, fingerprints, args.diff_dir, args.processes)
+   for difference in differences:
+      if difference.status == CHANGED:
+         print(f"{difference.status:8} {difference.name}  hash distance {difference.distance}  {difference.diff_path}")
+      else:
+         print(f"{difference.status:8} {difference.name}")
+   print(f"{len(differences)} of {len(fingerprints)} images differ")
+   sys.exit(1 if differences else 0)
+
+
+if __name__ == '__main__':
+   main()
@@ -0,0 +1,124 @@
+import hashlib
+import json
+import os
+import shutil
+from typing import Dict, List, Optional, Sequence, Tuple, TYPE_CHECKING
+
+from atlas import image_tag
+from image_variants import Variant, variant_paths
+
+if TYPE_CHECKING:
+   import numpy as np
+
+# Dedup modes: pixel-identical images are encoded once, the duplicates become hardlinks to that file,
+# or are not written at all and the deck CSV points at the one file instead
+OFF = 'off'
+LINK = 'link'
+CSV = 'csv'
+
+# Shared by every deck, so an image one deck already holds is not stored again by the next
+default_index_path = 'output/image-index.json'
+
+
+def default_dedup_mode() -> str:
+   return os.environ.get('DECK_DEDUP', OFF)
+
+
+def pixel_digest(pixels: 'np.ndarray') -> str:
+   return hashlib.sha256(repr(pixels.shape).encode('ascii') + pixels.tobytes()).hexdigest()
+
+
+class Deduplicator:
+   """Index of pixel digest -> the file holding those pixels, and the bookkeeping of one deck's duplicates."""
+
+   def __init__(self, mode: str, index_path: str = default_index_path):
+      if mode not in (LINK, CSV):
+         raise ValueError(f"Unknown dedup mode: {mode}")
+      self.mode = mode
+      self.index_path = index_path
+      self.canonical: Dict[str, str] = {}
+      # Duplicate file -> the file with its pixels, kept across builds: in CSV mode that file is all there is
+      self.duplicate_of: Dict[str, str] = {}
+      if os.path.exists(index_path):
+         with open(index_path, mode='r', encoding='utf-8') as index_file:
+            index = json.load(index_file)
+         if 'canonical' not in index:
+            index = {'canonical': index}  # Indexes written before duplicates were kept
+         self.canonical = {digest: file_path for digest, file_path in index['canonical'].items()
+                           if os.path.exists(file_path)}
+         self.duplicate_of = {file_path: canonical_path
+                              for file_path, canonical_path in index.get('duplicates', {}).items()
+                              if os.path.exists(canonical_path)}
+      self.renamed: Dict[str, str] = {}
+      self.duplicates = 0
+      self.bytes_saved = 0
+
+   def forget(self, file_paths: List[str]):
+      # Those files are about to be rewritten or removed, so they no longer hold the pixels recorded for them
+      file_paths = set(file_paths)
+      self.canonical = {digest: file_path for digest, file_path in self.canonical.items()
+                        if file_path not in file_paths}
+      self.duplicate_of = {file_path: canonical_path for file_path, canonical_path in self.duplicate_of.items()
+                           if file_path not in file_paths}
+
+   def holds(self, file_path: str) -> bool:
+      # Whether an image that is not on disk is still covered by the file with its pixels
+      return file_path in self.duplicate_of and os.path.exists(self.duplicate_of[file_path])
+
+   def duplicates_of(self, file_paths: List[str]) -> List[str]:
+      # The recorded duplicates of those files, which no longer hold the same pixels once they are rewritten
+      file_paths = set(file_paths)
+      return [file_path for file_path, canonical_path in self.duplicate_of.items() if canonical_path in file_paths]
+
+   def use_files(self, file_paths: List[str]):
+      # The images of the deck being built: rewrite_csv points their duplicates at the files with their pixels
+      self.renamed = {os.path.basename(file_path): os.path.basename(self.duplicate_of[file_path])
+                      for file_path in file_paths if file_path in self.duplicate_of}
+
+   def resolve(self, duplicates: List[Tuple[str, str]], sizes: Optional[Dict[str, Sequence[Variant]]] = None):
+      # (duplicate file, file with the same pixels), once every canonical file has been written.
+      # The other sizes of the duplicate, which the canonical file was written with too, are linked as well.
+      for file_path, canonical_path in duplicates:
+         variants = (sizes or {}).get(file_path, ())
+         for path, target in zip([file_path] + variant_paths(file_path, variants),
+                                 [canonical_path] + variant_paths(canonical_path, variants)):
+            if os.path.exists(path):
+               os.remove(path)
+            if self.mode == LINK:
+               try:
+                  os.link(target, path)
+               except OSError:
+                  shutil.copyfile(target, path)
+         self.duplicate_of[file_path] = canonical_path
+         self.duplicates += 1
+         self.bytes_saved += os.path.getsize(canonical_path)
+
+   def rewrite_csv(self, csv_path: str):
+      # Only needed in CSV mode, the duplicates were never written there
+      def replace(match) -> str:
+         name = match.group(1)
+         return match.group(0).replace(name, self.renamed[name]) if name in self.renamed else match.group(0)
+
+      with open(csv_path, mode='r', encoding='utf-8') as csvfile:
+         text = csvfile.read()
+      with open(csv_path, mode='w', encoding='utf-8') as csvfile:
+         csvfile.write(image_tag.sub(replace, text))
+
+   def report(self, rendered: int) -> str:
+      return (f"dedup: {self.duplicates} of {rendered} rendered images were duplicates, "
+              f"saved {self.duplicates} encodes and {self.bytes_saved} bytes")
+
+   def save(self):
+      directory = os.path.dirname(self.index_path)
+      if directory:
+         os.makedirs(directory, exist_ok=True)
+      tmp_path = self.index_path + '.tmp'
+      with open(tmp_path, mode='w', encoding='utf-8') as index_file:
+         json.dump({'canonical': self.canonical, 'duplicates': self.duplicate_of}, index_file, indent=1,
+                   sort_keys=True)
+      os.replace(tmp_path, self.index_path)
+
+
+def deduplicator(mode: Optional[str] = None) -> Optional[Deduplicator]:
+   mode = mode or default_dedup_mode()
+   return None if mode == OFF else Deduplicator(mode)
@@ -0,0 +1,114 @@
+import glob
+import os
+import re
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple, TYPE_CHECKING
+from urllib.parse import quote
+
+from instrumentation import stage
+
+if TYPE_CHECKING:
+   import numpy as np
+
+# Extra sizes and formats of every deck image, all resampled from one render at the largest requested scale, while
+# the 1x image is rendered as it always is:
+#   DECK_SIZES=2x,0.5x,0.5x.webp
+# The 1x PNG keeps its usual name, so the deck CSVs are unchanged; every other variant is written next to it as
+# <name>@<scale>x.<format>, e.g. K-KuMaGu-major-root-keyboard-2@2x.png. With PNG sizes, the <img> tags of the deck
+# CSVs list them in srcset.
+
+formats = {'png': 'PNG', 'webp': 'WEBP', 'jpg': 'JPEG'}
+_variant_spec = re.compile(r'(\d+(?:\.\d+)?)x(?:\.(png|webp|jpg))?')
+
+
+@dataclass(frozen=True)
+class Variant:
+   scale: float
+   format: str = 'png'
+
+   def __str__(self) -> str:
+      return f"{self.scale:g}x.{self.format}"
+
+
+def parse_variants(spec: str) -> Tuple[Variant, ...]:
+   variants = []
+   for item in filter(None, (item.strip() for item in spec.split(','))):
+      match = _variant_spec.fullmatch(item)
+      if not match or float(match.group(1)) <= 0:
+         raise ValueError(f"Image sizes look like 2x, 0.5x or 0.5x.webp, got {item!r}")
+      variant = Variant(float(match.group(1)), match.group(2) or 'png')
+      # The 1x PNG is always written, under the image's own name
+      if variant != Variant(1.0) and variant not in variants:
+         variants.append(variant)
+   return tuple(variants)
+
+
+def default_variants() -> Tuple[Variant, ...]:
+   return parse_variants(os.environ.get('DECK_SIZES', ''))
+
+
+def render_scale(variants: Sequence[Variant]) -> float:
+   # The one render every size is made from
+   return max([1.0] + [variant.scale for variant in variants])
+
+
+def variant_file_name(file_name: str, variant: Variant) -> str:
+   stem, _ = os.path.splitext(file_name)
+   return f"{stem}@{variant.scale:g}x.{variant.format}"
+
+
+def srcset(file_name: str, variants: Sequence[Variant]) -> str:
+   # For <img src="..." srcset="...">: the PNG variants, which every Anki client can show. The names are URL
+   # quoted, a space would end the name inside srcset.
+   names = [(file_name, 1.0)] + [(variant_file_name(file_name, variant), variant.scale) for variant in variants
+                                 if variant.format == 'png']
+   return ', '.join(f"{quote(name, safe='@')} {scale:g}x" for name, scale in names)
+
+
+def use_srcset(csv_path: str, sizes: Dict[str, Sequence[Variant]]):
+   # Adds the larger and smaller PNGs of every deck image to its <img> tag, so cards pick the size of the screen
+   from atlas import image_tag
+
+   def add_srcset(match) -> str:
+      name = match.group(1)
+      if not any(variant.format == 'png' for variant in sizes.get(name, ())):
+         return match.group(0)
+      end = '/>' if match.group(0).endswith('/>') else '>'
+      return f'<img src="{name}" srcset="{srcset(name, sizes[name])}"{end}'
+
+   with open(csv_path, mode='r', encoding='utf-8') as csvfile:
+      text = csvfile.read()
+   with open(csv_path, mode='w', encoding='utf-8') as csvfile:
+      csvfile.write(image_tag.sub(add_srcset, text))
+
+
+def write_variants(pixels: 'np.ndarray', scale: float, file_path: str, variants: Sequence[Variant]):
+   # pixels were rendered at scale; writes every variant of the image at file_path from them
+   import io
+   from PIL import Image
+   from draw_intervals import resize_pixels, write_file
+
+   with stage('encode'):
+      outputs: List[Tuple[str, bytes]] = []
+      for variant in variants:
+         image = Image.fromarray(resize_pixels(pixels, variant.scale / scale), 'RGBA')
+         if variant.format == 'jpg':
+            # JPEG has no alpha channel, the cards are drawn on white anyway
+            background = Image.new('RGB', image.size, 'white')
+            background.paste(image, mask=image.getchannel('A'))
+            image = background
+         buffer = io.BytesIO()
+         image.save(buffer, format=formats[variant.format])
+         outputs.append((variant_file_name(file_path, variant), buffer.getvalue()))
+   for output_path, data in outputs:
+      write_file(output_path, data)
+
+
+def remove_variants(file_path: str):
+   # Whatever sizes were written next to the image back then
+   for variant_path in glob.glob(glob.escape(os.path.splitext(file_path)[0]) + '@*x.*'):
+      os.remove(variant_path)
+
+
+def variant_paths(file_path: str, variants: Optional[Sequence[Variant]]) -> List[str]:
+   return [variant_file_name(file_path, variant) for variant in variants or ()]
@@ -0,0 +1,172 @@
+import os
+import statistics
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import partial, wraps
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set
+
+# Opt-in stage timings for the deck builds:
+#   DECK_PROFILE=chords,modes      time the stages of those decks (or 'all')
+#   DECK_PROFILE_MEMORY=1          also trace allocations with tracemalloc, which slows the build down; stages of
+#                                  pool workers report the largest peak of any one worker
+# Stages: theory (make_chord / make_modes), patches (picking and recolouring a template), encode (PNG encoding,
+# including the figure draw for matplotlib), write (the disk write), rasterise (pixels for the atlas),
+# csv (store update and export) and render (all images of the deck, around the stages above).
+
+_enabled_decks: Set[str] = set()
+_active: Optional['Recorder'] = None
+
+
+def enable_profiling(*decks: str):
+   _enabled_decks.update(decks)
+
+
+def profiling_enabled(deck: str) -> bool:
+   decks = _enabled_decks | {name.strip() for name in os.environ.get('DECK_PROFILE', '').split(',') if name.strip()}
+   return deck in decks or 'all' in decks
+
+
+def memory_tracing_enabled() -> bool:
+   return os.environ.get('DECK_PROFILE_MEMORY', '') not in ('', '0')
+
+
+class Recorder:
+   """Durations per stage and, when tracing, the peak traced memory each stage added."""
+
+   def __init__(self, name: str, trace_memory: bool = False):
+      self.name = name
+      self.trace_memory = trace_memory
+      self.samples: Dict[str, List[float]] = defaultdict(list)
+      self.memory_peaks: Dict[str, int] = defaultdict(int)
+      self.snapshots: List[tracemalloc.Snapshot] = []
+      self._memory_stack: List[List[int]] = []
+
+   def enter_memory_stage(self):
+      # Nested stages share the one tracemalloc peak, so an inner stage hands its peak on to the outer one
+      self._fold_peak()
+      self._memory_stack.append([tracemalloc.get_traced_memory()[0], 0])
+      tracemalloc.reset_peak()
+
+   def exit_memory_stage(self, stage_name: str):
+      self._fold_peak()
+      start_memory, peak = self._memory_stack.pop()
+      self.memory_peaks[stage_name] = max(self.memory_peaks[stage_name], peak - start_memory)
+      if self._memory_stack:
+         self._memory_stack[-1][1] = max(self._memory_stack[-1][1], peak)
+
+   def _fold_peak(self):
+      if self._memory_stack:
+         self._memory_stack[-1][1] = max(self._memory_stack[-1][1], tracemalloc.get_traced_memory()[1])
+         tracemalloc.reset_peak()
+
+   def add(self, stage_name: str, seconds: float):
+      self.samples[stage_name].append(seconds)
+
+   def merge(self, samples: Dict[str, List[float]], memory_peaks: Optional[Dict[str, int]] = None):
+      # Stage samples of another process; its peaks were traced in that process, so the largest one is kept
+      for stage_name, durations in samples.items():
+         self.samples[stage_name].extend(durations)
+      for stage_name, peak in (memory_peaks or {}).items():
+         self.memory_peaks[stage_name] = max(self.memory_peaks[stage_name], peak)
+
+   def report(self) -> str:
+      lines = [f"profile of {self.name}:",
+               f"  {'stage':10} {'count':>7} {'total s':>9} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9}"
+               + (f" {'peak KiB':>10}" if self.trace_memory else "")]
+      for stage_name, durations in self.samples.items():
+         if len(durations) > 1:
+            p50, p90, p99 = (statistics.quantiles(durations, n=100, method='inclusive')[i] for i in (49, 89, 98))
+         else:
+            p50 = p90 = p99 = durations[0]
+         line = (f"  {stage_name:10} {len(durations):7} {sum(durations):9.3f} {p50 * 1000:9.3f} {p90 * 1000:9.3f} "
+                 f"{p99 * 1000:9.3f} {max(durations) * 1000:9.3f}")
+         if self.trace_memory:
+            line += f" {self.memory_peaks[stage_name] / 1024:10.1f}"
+         lines.append(line)
+      if len(self.snapshots) >= 2:
+         lines.append("  largest allocation growth:")
+         for difference in self.snapshots[-1].compare_to(self.snapshots[0], 'lineno')[:10]:
+            lines.append(f"    {difference}")
+      return "\n".join(lines)
+
+
+@contextmanager
+def stage(stage_name: str):
+   recorder = _active
+   if recorder is None:
+      yield
+      return
+   # Writer threads only record timings, the tracemalloc peak is shared by the whole process
+   trace_memory = recorder.trace_memory and threading.current_thread() is threading.main_thread()
+   if trace_memory:
+      recorder.enter_memory_stage()
+   start = time.perf_counter()
+   try:
+      yield
+   finally:
+      recorder.add(stage_name, time.perf_counter() - start)
+      if trace_memory:
+         recorder.exit_memory_stage(stage_name)
+
+
+@contextmanager
+def profile_deck(deck: str) -> Iterator[Optional[Recorder]]:
+   # Wraps a whole generator run, prints the report at the end when the deck is being profiled
+   global _active
+   if not profiling_enabled(deck) or _active is not None:
+      yield None
+      return
+   recorder = Recorder(deck, memory_tracing_enabled())
+   started_tracing = recorder.trace_memory and not tracemalloc.is_tracing()
+   if started_tracing:
+      tracemalloc.start()
+   if recorder.trace_memory:
+      recorder.snapshots.append(tracemalloc.take_snapshot())
+   _active = recorder
+   try:
+      yield recorder
+   finally:
+      _active = None
+      if recorder.trace_memory:
+         recorder.snapshots.append(tracemalloc.take_snapshot())
+      if started_tracing:
+         tracemalloc.stop()
+      print(recorder.report())
+
+
+def profiled(deck: str):
+   # Decorator for a deck generator: the whole call is one profile_deck run
+   def decorator(function: Callable) -> Callable:
+      @wraps(function)
+      def wrapper(*args, **kwargs):
+         with profile_deck(deck):
+            return function(*args, **kwargs)
+      return wrapper
+   return decorator
+
+
+def _call_recording(function: Callable, trace_memory: bool, item):
+   # Runs in a pool worker: records the stages of one call and hands them back with the result. Tracing, once
+   # started, stays on for the life of the worker.
+   global _active
+   if trace_memory and not tracemalloc.is_tracing():
+      tracemalloc.start()
+   _active = Recorder('worker', trace_memory)
+   try:
+      return function(item), dict(_active.samples), dict(_active.memory_peaks)
+   finally:
+      _active = None
+
+
+def map_recording(executor, function: Callable, items: Iterable, chunksize: int = 1) -> Iterator:
+   # executor.map that also brings the stage timings of the workers back into the active profile
+   if _active is None:
+      yield from executor.map(function, items, chunksize=chunksize)
+      return
+   calls = executor.map(partial(_call_recording, function, _active.trace_memory), items, chunksize=chunksize)
+   for result, samples, memory_peaks in calls:
+      _active.merge(samples, memory_peaks)
+      yield result
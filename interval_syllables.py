@@ -1,4 +1,11 @@
-from draw_intervals import draw_piano_roll, draw_keyboard, bases
+from typing import Iterator, List, Tuple
+
+from audio import with_sounds
+from deck_store import DeckStore, default_store_path
+from draw_intervals import bases
+from instrumentation import profiled, stage
+from pitch import Pitch
+from render_jobs import RenderJob, render_deck, KEYBOARD, PIANO_ROLL
 
 # Original syllable definitions
 root_suffix = 'u'
@@ -49,12 +56,11 @@ up_qualities = [root_suffix, mi_up, ma_up, mi_up, ma_up, pe_up, tr_up, pe_up, mi
 do_qualities = [root_suffix, mi_do, ma_do, mi_do, ma_do, pe_do, tr_do, pe_do, mi_do, ma_do, mi_do, ma_do, pe_do + pe_do]
 assert len(bases) == len(up_qualities)
 
-# Open CSV file for writing
-with open('intervals.csv', 'w', encoding='utf-8') as csvfile:
-   # Write header
-   csvfile.write("LeftToRight\tRightToLeft\tInterval\tKeyboard\tPianoRoll\tSargamUp\tSargamDown\n")
+interval_columns = ['LeftToRight', 'RightToLeft', 'Interval', 'Keyboard', 'PianoRoll', 'SargamUp', 'SargamDown']
 
-   count = 0
+
+def iter_intervals() -> Iterator[Tuple[str, str, int, List[Pitch]]]:
+   # (left to right syllables, right to left syllables, semitones, notes) of every card in deck order
    for i, root in enumerate(bases):
       if i == len(bases)-1:
          break
@@ -65,23 +71,48 @@ with open('intervals.csv', 'w', encoding='utf-8') as csvfile:
          n_note = bases[interval_index]
          if root == n_note:
             continue
-         count += 1
          leftToRight = root + root_suffix + n_note + up_quality
          rightToLeft = n_note + root_suffix + root + do_quality
-         img_url_keyboard = f"keyboard_{leftToRight}_{rightToLeft}.png"
-         img_url_piano_roll = f"pianoroll_{leftToRight}_{rightToLeft}.png"
-         notes = [root+'0', n_note + str((i+j)//12)]
+         yield leftToRight, rightToLeft, j, [Pitch.of(i, 0), Pitch(i + j)]
+
+
+@profiled('intervals')
+def generate_interval_deck(csv_path: str = 'intervals.csv', output_dir: str = 'output/intervals/',
+                           store_path: str = default_store_path):
+   count = 0
+   jobs = []
+   rows = []
+   for leftToRight, rightToLeft, j, notes in iter_intervals():
+      count += 1
+      img_url_keyboard = f"keyboard_{leftToRight}_{rightToLeft}.png"
+      img_url_piano_roll = f"pianoroll_{leftToRight}_{rightToLeft}.png"
+
+      # Get Sargam interval names for both directions
+      sargam_up = sargam_intervals_up[intervalNames[j]]
+      sargam_down = sargam_intervals_down[intervalNames[j]]
+
+      rows.append((leftToRight, leftToRight, {
+         'LeftToRight': leftToRight,
+         'RightToLeft': rightToLeft,
+         'Interval': intervalNames[j],
+         'Keyboard': f"<img src=\"{img_url_keyboard}\">",
+         'PianoRoll': f"<img src=\"{img_url_piano_roll}\">",
+         'SargamUp': sargam_up,
+         'SargamDown': sargam_down,
+      }))
 
-         # Get Sargam interval names for both directions
-         sargam_up = sargam_intervals_up[intervalNames[j]]
-         sargam_down = sargam_intervals_down[intervalNames[j]]
+      jobs.append(RenderJob(KEYBOARD, output_dir + 'keyboard/', img_url_keyboard, notes))
+      jobs.append(RenderJob(PIANO_ROLL, output_dir + 'pianoroll/', img_url_piano_roll, notes))
 
-         # Write data row
-         csvfile.write(f"{leftToRight}\t{rightToLeft}\t{intervalNames[j]}\t"
-                       f"<img src=\"{img_url_keyboard}\">\t<img src=\"{img_url_piano_roll}\">\t"
-                       f"{sargam_up}\t{sargam_down}\n")
+   with stage('audio'):
+      rows, columns, sounds = with_sounds('intervals', rows, interval_columns)
+   with stage('csv'), DeckStore(store_path) as store:
+      print("updated rows = ", store.update_rows('intervals', rows))
+      store.export_tsv('intervals', csv_path, columns, {})
+      keys = store.keys('intervals')
+   render_deck(jobs, output_dir, 'intervals', csv_path, note_keys=keys, media_paths=sounds)
+   print("count = ", count)
 
-         draw_keyboard('output/intervals/keyboard/', img_url_keyboard, notes)
-         draw_piano_roll('output/intervals/pianoroll/', img_url_piano_roll, notes)
 
-print("count = ", count)
+if __name__ == '__main__':
+   generate_interval_deck()
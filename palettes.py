@@ -0,0 +1,187 @@
+import os
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from theory_tables import interval_vocabulary, interval_semitones, keys_per_octave
+
+RGBA = Tuple[float, float, float, float]
+DEFAULT_SCHEME = 'default'
+
+
+# Function to convert HEX to RGB, same as matplotlib.colors.hex2color without importing matplotlib
+def hex_to_rgb(hex_color: str) -> List[float]:
+   return [int(hex_color[i:i+2], 16) / 255 for i in (1, 3, 5)]
+
+# Function to convert RGB to HEX, same as matplotlib.colors.to_hex
+def rgb_to_hex(rgb_color: List[float]) -> str:
+   return "#" + "".join(format(round(c * 255), "02x") for c in rgb_color)
+
+# Function to adjust brightness of the color
+def adjust_brightness(rgb_color: List[float], factor: float) -> List[float]:
+   if factor >= 0:
+      # Brighten: move color towards 1
+      return [min(1, c + (1 - c) * factor) for c in rgb_color]
+   else:
+      # Darken: move color towards 0
+      return [max(0, c * (1 + factor)) for c in rgb_color]
+
+
+def to_rgba(colour: str) -> RGBA:
+   if colour.startswith('#'):
+      return (*hex_to_rgb(colour), 1.0)
+   from PIL import ImageColor
+   return (*[c / 255 for c in ImageColor.getrgb(colour)[:3]], 1.0)
+
+
+def brightness_by_distance(base_colours: Callable[[str], str]) -> Callable[[str], str]:
+   # Brighter the further an interval goes up from the tonic, darker the further it goes down
+   def interval_colour(interval: str) -> str:
+      rgb_colour = hex_to_rgb(base_colours(interval))
+      distance_from_tonic = interval_semitones[interval]  # Signed distance in semitones
+      factor = (0.05 * distance_from_tonic)
+      return rgb_to_hex(adjust_brightness(rgb_colour, factor))
+   return interval_colour
+
+
+def quality_colours(colour_map: Dict[str, str]) -> Callable[[str], str]:
+   # Base colour from the interval quality letter: P, m, M, d or A
+   return lambda interval: colour_map[interval[-2]]
+
+
+def tonic_colours(tonic_colour: str, other_colour: str) -> Callable[[str], str]:
+   # Unisons and octaves stand out, every other interval shares one colour
+   return lambda interval: tonic_colour if interval[-2:] in ('P1', 'P8') else other_colour
+
+
+@dataclass
+class ColourScheme:
+   """Lookup tables of one colour scheme, indexed by the codes in theory_tables."""
+   name: str
+   # [interval code, RGBA]: mode keyboards coloured by interval quality and distance from the tonic
+   interval_colours: np.ndarray
+   # [interval code, RGBA]: mode keyboards that only tell the tonic from the other notes
+   direction_colours: np.ndarray
+   # [chord colour slot, RGBA]: slot = 12 * (note is below the root) + semitones from the root
+   chord_colours: np.ndarray
+   _rgba: Dict[str, List[RGBA]] = field(default_factory=dict, repr=False)
+
+   def rgba(self, table: str) -> List[RGBA]:
+      # The tables as tuples of floats, ready to hand to the renderers
+      if table not in self._rgba:
+         self._rgba[table] = [tuple(row) for row in getattr(self, table).tolist()]
+      return self._rgba[table]
+
+
+# Schemes are built on first use, so registering one costs nothing until a deck asks for it
+_scheme_factories: Dict[str, Callable[[], ColourScheme]] = {}
+_schemes: Dict[str, ColourScheme] = {}
+_active_scheme: Optional[str] = None
+
+
+def register_scheme(name: str, interval_colour: Callable[[str], str], direction_colour: Callable[[str], str],
+                    chord_up_colours: List[str], chord_down_colours: List[str]):
+   # The callables are evaluated once per interval when the tables are built, never per note
+   assert len(chord_up_colours) == len(chord_down_colours) == keys_per_octave
+
+   def build() -> ColourScheme:
+      return ColourScheme(
+         name,
+         np.array([to_rgba(interval_colour(interval)) for interval in interval_vocabulary]),
+         np.array([to_rgba(direction_colour(interval)) for interval in interval_vocabulary]),
+         np.array([to_rgba(colour) for colour in chord_up_colours + chord_down_colours]),
+      )
+   _scheme_factories[name] = build
+   _schemes.pop(name, None)
+
+
+def register_derived_scheme(name: str, base: str, transform: Callable[[np.ndarray], np.ndarray]):
+   # transform maps an [n, RGBA] table to a new one, e.g. a greyscale conversion
+   def build() -> ColourScheme:
+      base_scheme = get_scheme(base)
+      return ColourScheme(name, transform(base_scheme.interval_colours), transform(base_scheme.direction_colours),
+                          transform(base_scheme.chord_colours))
+   _scheme_factories[name] = build
+   _schemes.pop(name, None)
+
+
+def get_scheme(name: Optional[str] = None) -> ColourScheme:
+   name = name or active_scheme_name()
+   if name not in _schemes:
+      if name not in _scheme_factories:
+         raise KeyError(f"Unknown colour scheme: {name}")
+      _schemes[name] = _scheme_factories[name]()
+   return _schemes[name]
+
+
+def active_scheme_name() -> str:
+   return _active_scheme or os.environ.get('DECK_PALETTE', DEFAULT_SCHEME)
+
+
+def set_active_scheme(name: str):
+   if name not in _scheme_factories:
+      raise KeyError(f"Unknown colour scheme: {name}")
+   global _active_scheme
+   _active_scheme = name
+
+
+def scheme_names() -> List[str]:
+   return list(_scheme_factories)
+
+
+def greyscale(table: np.ndarray) -> np.ndarray:
+   # Rec. 601 luma, rounded to 8 bits so it encodes exactly
+   luma = np.rint((table[:, :3] @ np.array([0.299, 0.587, 0.114])) * 255) / 255
+   return np.column_stack([luma, luma, luma, table[:, 3]])
+
+
+root_colour = 'yellow'
+
+mi_up_colour = 'lightblue'
+ma_up_colour = 'lightgreen'
+pe_up_colour = 'lightyellow'
+au_up_colour = 'lightsalmon'
+di_up_colour = 'plum'
+
+mi_do_colour = 'cornflowerblue'
+ma_do_colour = 'mediumseagreen'
+pe_do_colour = 'khaki'
+au_do_colour = 'darksalmon'
+di_do_colour = 'orchid'
+
+register_scheme(
+   DEFAULT_SCHEME,
+   brightness_by_distance(quality_colours({
+      'P': '#FFFF00',    # Yellow (Perfect intervals)
+      'm': '#003F7B',    # Dark Blue (Minor intervals)
+      'M': '#00A41B',    # Green (Major intervals)
+      'd': '#898989',    # Grey (Diminished intervals)
+      'A': '#540000'     # Dark Green (Augmented intervals)
+   })),
+   brightness_by_distance(tonic_colours('#FFFF00', '#F08080')),
+   # Chord note colours by semitone distance from the root, above and below it
+   [root_colour, mi_up_colour, ma_up_colour, mi_up_colour, ma_up_colour, pe_up_colour,
+    di_up_colour, pe_up_colour, au_up_colour, ma_up_colour, mi_up_colour, ma_up_colour],
+   [root_colour, mi_do_colour, ma_do_colour, mi_do_colour, ma_do_colour, pe_do_colour,
+    di_do_colour, pe_do_colour, au_do_colour, ma_do_colour, mi_do_colour, ma_do_colour],
+)
+
+# Okabe-Ito colours, which stay distinguishable with the common colour vision deficiencies
+register_scheme(
+   'colour-blind',
+   brightness_by_distance(quality_colours({
+      'P': '#F0E442',    # Yellow
+      'm': '#0072B2',    # Blue
+      'M': '#009E73',    # Bluish green
+      'd': '#999999',    # Grey
+      'A': '#D55E00'     # Vermillion
+   })),
+   brightness_by_distance(tonic_colours('#F0E442', '#CC79A7')),
+   ['#F0E442', '#56B4E9', '#009E73', '#56B4E9', '#009E73', '#E69F00',
+    '#CC79A7', '#E69F00', '#D55E00', '#009E73', '#56B4E9', '#009E73'],
+   ['#F0E442', '#0072B2', '#006B4F', '#0072B2', '#006B4F', '#B07A00',
+    '#9E4F80', '#B07A00', '#A04600', '#006B4F', '#0072B2', '#006B4F'],
+)
+
+register_derived_scheme('greyscale', DEFAULT_SCHEME, greyscale)
@@ -0,0 +1,60 @@
+from enum import IntEnum
+from typing import Union
+
+keys_per_octave = 12
+
+
+class PitchClass(IntEnum):
+   K = 0
+   T = 1
+   D = 2
+   N = 3
+   M = 4
+   F = 5
+   J = 6
+   G = 7
+   R = 8
+   L = 9
+   P = 10
+   B = 11
+
+
+class Pitch(int):
+   """A key as a plain int, octave * 12 + pitch class, that prints as its note name ('K1', 'P-1', 'B10')."""
+   __slots__ = ()
+
+   @classmethod
+   def of(cls, pitch_class: Union[PitchClass, int], octave: int) -> 'Pitch':
+      return cls(octave * keys_per_octave + pitch_class)
+
+   @classmethod
+   def parse(cls, note: Union[str, int]) -> 'Pitch':
+      if isinstance(note, Pitch):
+         return note
+      if isinstance(note, int):
+         return cls(note)
+      return cls(int(note[1:]) * keys_per_octave + PitchClass[note[0]])
+
+   @property
+   def pitch_class(self) -> PitchClass:
+      return PitchClass(self % keys_per_octave)
+
+   @property
+   def octave(self) -> int:
+      return self // keys_per_octave
+
+   @property
+   def name(self) -> str:
+      return f"{self.pitch_class.name}{self.octave}"
+
+   def __str__(self):
+      return self.name
+
+   def __format__(self, format_spec):
+      return format(self.name, format_spec)
+
+   def __repr__(self):
+      return f"Pitch('{self.name}')"
+
+
+NoteLike = Union[Pitch, str, int]
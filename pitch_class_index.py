@@ -0,0 +1,229 @@
+import argparse
+import csv
+import html
+import re
+import sys
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from draw_intervals import interval_to_letters
+from pitch import Pitch, PitchClass, NoteLike
+from theory_tables import (chord_pitches, chord_syllable_codes, chord_type_names, inversion_names, syllable_vocabulary,
+                           mode_names, direction_names, mode_pitches, mode_interval_codes, mode_lengths,
+                           interval_vocabulary, keys_per_octave)
+
+# Reverse lookup from notes or syllables to the chords and scales of the decks. Every chord voicing and scale of
+# theory_tables is indexed by its 12-bit pitch-class mask, by its pitches relative to the octave of its first note
+# and by its syllables, so identifying pressed keys or checking a deck row is a dictionary lookup:
+#   python pitch_class_index.py identify K1 M1 G1
+#   python pitch_class_index.py identify KuMaGu
+#   python pitch_class_index.py validate
+
+
+@dataclass(frozen=True)
+class ChordMatch:
+   root: str
+   chord_type: str
+   inversion: str
+
+
+@dataclass(frozen=True)
+class ModeMatch:
+   mode: str
+   root: str
+   direction: str  # 'up' or 'down'
+
+
+def pitch_class_mask(notes: Iterable[NoteLike]) -> int:
+   mask = 0
+   for note in notes:
+      mask |= 1 << Pitch.parse(note) % keys_per_octave
+   return mask
+
+
+def relative_pitches(pitches: Iterable[int]) -> Tuple[int, ...]:
+   # The same notes in any octave give the same key: the first note is moved into octave 0
+   pitches = [int(pitch) for pitch in pitches]
+   return tuple(pitch - pitches[0] // keys_per_octave * keys_per_octave for pitch in pitches)
+
+
+_syllable = re.compile(r'[KTDNMFJGRLPB][aeiouy]+')
+
+
+def parse_syllables(text: str) -> Tuple[str, ...]:
+   # "KuBeLeGy FyMeDeKy" -> ('Ku', 'Be', ...), spaces between syllable groups do not matter
+   syllables = _syllable.findall(text)
+   if "".join(syllables) != re.sub(r'\s+', '', text):
+      raise ValueError(f"Not a syllable string: {text!r}")
+   return tuple(syllables)
+
+
+class PitchClassIndex:
+   """Chords and scales by pitch-class mask, by relative pitches and by syllables."""
+
+   def __init__(self):
+      self.chords_by_mask: Dict[int, List[ChordMatch]] = defaultdict(list)
+      self.chords_by_voicing: Dict[Tuple[int, ...], List[ChordMatch]] = defaultdict(list)
+      self.chords_by_syllables: Dict[Tuple[str, ...], List[ChordMatch]] = defaultdict(list)
+      self.modes_by_mask: Dict[int, List[ModeMatch]] = defaultdict(list)
+      self.modes_by_pitches: Dict[Tuple[int, ...], List[ModeMatch]] = defaultdict(list)
+      self.modes_by_syllables: Dict[Tuple[str, ...], List[ModeMatch]] = defaultdict(list)
+      # And the other way round, how the decks spell every chord and scale
+      self.syllables: Dict[object, Tuple[str, ...]] = {}
+
+      sizes = (chord_pitches >= 0).sum(axis=-1)
+      # Masks of every voicing at once, from the pitch classes the voicing covers
+      masks = np.bitwise_or.reduce(np.where(chord_pitches >= 0, 1 << (chord_pitches % keys_per_octave), 0), axis=-1)
+      for root, chord_type, inversion in zip(*np.nonzero(sizes)):
+         pitches = chord_pitches[root, chord_type, inversion, :sizes[root, chord_type, inversion]].tolist()
+         match = ChordMatch(PitchClass(root).name, chord_type_names[chord_type], inversion_names[inversion])
+         syllables = tuple(f"{PitchClass(pitch % keys_per_octave).name}{syllable_vocabulary[code]}" for pitch, code
+                           in zip(pitches, chord_syllable_codes[root, chord_type, inversion, :len(pitches)]))
+         self.chords_by_mask[int(masks[root, chord_type, inversion])].append(match)
+         self.chords_by_voicing[relative_pitches(pitches)].append(match)
+         self.chords_by_syllables[syllables].append(match)
+         self.syllables[match] = syllables
+
+      for mode_index, mode in enumerate(mode_names):
+         length = mode_lengths[mode_index]
+         for direction_index, direction in enumerate(direction_names):
+            vowels = interval_to_letters([interval_vocabulary[code] for code in
+                                          mode_interval_codes[0, mode_index, direction_index, :length]])
+            for root in range(keys_per_octave):
+               pitches = mode_pitches[root, mode_index, direction_index, :length].tolist()
+               syllables = [f"{PitchClass(pitch % keys_per_octave).name}{vowel}" for pitch, vowel in zip(pitches, vowels)]
+               if direction == 'down':
+                  # Scales going down are sung from the top, as the mode deck lists them
+                  pitches, syllables = pitches[::-1], syllables[::-1]
+               match = ModeMatch(mode, PitchClass(root).name, direction)
+               self.modes_by_mask[pitch_class_mask(pitches)].append(match)
+               self.modes_by_pitches[relative_pitches(pitches)].append(match)
+               self.modes_by_syllables[tuple(syllables)].append(match)
+               self.syllables[match] = tuple(syllables)
+
+   def chords_with_pitch_classes(self, notes: Iterable[NoteLike]) -> List[ChordMatch]:
+      # Every voicing of every chord made of exactly these pitch classes
+      return self.chords_by_mask.get(pitch_class_mask(notes), [])
+
+   def chords_with_voicing(self, notes: Iterable[NoteLike]) -> List[ChordMatch]:
+      # The chords voiced exactly like these notes, in any octave
+      return self.chords_by_voicing.get(relative_pitches(sorted(Pitch.parse(note) for note in notes)), [])
+
+   def modes_with_pitch_classes(self, notes: Iterable[NoteLike]) -> List[ModeMatch]:
+      return self.modes_by_mask.get(pitch_class_mask(notes), [])
+
+   def modes_with_pitches(self, notes: Iterable[NoteLike]) -> List[ModeMatch]:
+      # Notes in the order they are played, up or down from the tonic
+      return self.modes_by_pitches.get(relative_pitches(Pitch.parse(note) for note in notes), [])
+
+   def identify_keys(self, notes: Iterable[NoteLike]) -> List[ChordMatch]:
+      # Pressed keys, e.g. from a MIDI keyboard: the exact voicing if there is one, else any chord of those notes
+      notes = list(notes)
+      return self.chords_with_voicing(notes) or self.chords_with_pitch_classes(notes)
+
+   def identify_syllables(self, text: str) -> Tuple[List[ChordMatch], List[ModeMatch]]:
+      syllables = parse_syllables(text)
+      return self.chords_by_syllables.get(syllables, []), self.modes_by_syllables.get(syllables, [])
+
+
+_index: Optional[PitchClassIndex] = None
+
+
+def pitch_class_index() -> PitchClassIndex:
+   # Built on first use and shared by every caller of the process
+   global _index
+   if _index is None:
+      _index = PitchClassIndex()
+   return _index
+
+
+_inversion_suffix = re.compile(rf"^(.*) ({'|'.join(inversion_names)})$")
+_mode_description = re.compile(r"^(.*) Mode: ([A-Z])(->|<-)\2$")
+
+
+def validate_chord_rows(csv_path: str = 'data.csv') -> List[str]:
+   # Rows whose syllables are not how the decks spell the chord their image name and TypeAndQuality name
+   index = pitch_class_index()
+   problems = []
+   with open(csv_path, mode='r', encoding='utf-8') as csvfile:
+      for row in csv.DictReader(csvfile, delimiter='\t'):
+         if row['Syllables'] == 'Syllables':
+            continue  # A second header line
+         type_and_inversion = _inversion_suffix.match(row['TypeAndQuality'])
+         root = re.search(r'src="([A-Z])-', row['Keyboard'])
+         if not type_and_inversion or not root:
+            problems.append(f"{csv_path}: {row['Syllables']}: cannot read the chord from {row['TypeAndQuality']!r}")
+            continue
+         expected = ChordMatch(root.group(1), *type_and_inversion.groups())
+         if expected not in index.syllables:
+            problems.append(f"{csv_path}: {row['Syllables']}: there is no {row['TypeAndQuality']} chord")
+         elif tuple(_syllable.findall(row['Syllables'])) != index.syllables[expected]:
+            problems.append(f"{csv_path}: {expected.root} {row['TypeAndQuality']} is spelled "
+                            f"{''.join(index.syllables[expected])}, the row has {row['Syllables']}")
+   return problems
+
+
+def validate_mode_rows(csv_path: str = 'modes.txt') -> List[str]:
+   index = pitch_class_index()
+   problems = []
+   with open(csv_path, mode='r', encoding='utf-8') as csvfile:
+      reader = csv.DictReader(csvfile, delimiter='\t', fieldnames=['ModeAndDirection', 'KeyboardPicture',
+                                                                   'SongToPractice', 'Syllables'])
+      for row in reader:
+         description = _mode_description.match(html.unescape(row['ModeAndDirection']))
+         if not description:
+            problems.append(f"{csv_path}: cannot read the scale from {row['ModeAndDirection']!r}")
+            continue
+         mode, root, arrow = description.groups()
+         expected = ModeMatch(mode, root, 'up' if arrow == '->' else 'down')
+         if expected not in index.syllables:
+            problems.append(f"{csv_path}: {description.group(0)}: there is no such scale")
+         elif tuple(_syllable.findall(row['Syllables'])) != index.syllables[expected]:
+            problems.append(f"{csv_path}: {description.group(0)} is spelled {''.join(index.syllables[expected])}, "
+                            f"the row has {row['Syllables']}")
+   return problems
+
+
+def main(argv: Optional[List[str]] = None):
+   parser = argparse.ArgumentParser(description="Identify chords and scales, or check the hand-maintained decks")
+   commands = parser.add_subparsers(dest='command', required=True)
+   identify = commands.add_parser('identify', help="notes like K1 M1 G1, or syllables like KuMaGu")
+   identify.add_argument('notes', nargs='+')
+   validate = commands.add_parser('validate', help="check the syllables of data.csv and modes.txt")
+   validate.add_argument('--chords', default='data.csv')
+   validate.add_argument('--modes', default='modes.txt')
+   args = parser.parse_args(argv)
+
+   index = pitch_class_index()
+   if args.command == 'validate':
+      problems = validate_chord_rows(args.chords) + validate_mode_rows(args.modes)
+      for problem in problems:
+         print(problem)
+      print(f"{len(problems)} problems")
+      sys.exit(1 if problems else 0)
+
+   text = ' '.join(args.notes)
+   if _syllable.match(text):
+      try:
+         chords, modes = index.identify_syllables(text)
+      except ValueError:
+         parser.error(f"cannot read syllables from {text!r}")
+   else:
+      try:
+         notes = [Pitch.parse(note) for note in args.notes]
+      except (KeyError, ValueError, IndexError):
+         parser.error(f"cannot read notes from {text!r}")
+      chords, modes = index.identify_keys(notes), index.modes_with_pitches(notes)
+   for chord in chords:
+      print(f"chord: {chord.root} {chord.chord_type} {chord.inversion}")
+   for mode in modes:
+      print(f"scale: {mode.mode} {mode.root} {mode.direction}")
+   if not chords and not modes:
+      print("no chord or scale")
+
+
+if __name__ == '__main__':
+   main()
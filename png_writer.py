@@ -0,0 +1,74 @@
+import io
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional, Sequence, TYPE_CHECKING
+
+from draw_intervals import encode_pixels, write_file
+from image_variants import Variant, write_variants
+from instrumentation import stage
+
+if TYPE_CHECKING:
+   import numpy as np
+
+
+def default_writers() -> int:
+   # DECK_WRITERS background threads encode and write the PNGs, 0 encodes them in the render loop.
+   # On a single core there is nothing to overlap with, so the pipeline is off there by default.
+   return int(os.environ.get('DECK_WRITERS', 2 if (os.cpu_count() or 1) > 1 else 0))
+
+
+def default_queue_depth() -> int:
+   # How many rendered images may wait for a writer before rendering blocks
+   return int(os.environ.get('DECK_QUEUE_DEPTH', 8))
+
+
+class PngWriter:
+   """Encodes and writes rendered pixels on background threads, so the next image renders meanwhile."""
+
+   def __init__(self, writers: Optional[int] = None, queue_depth: Optional[int] = None):
+      # With no writer threads every image is encoded and written inside submit()
+      writers = default_writers() if writers is None else writers
+      self.executor = ThreadPoolExecutor(max_workers=writers, thread_name_prefix='png-writer') if writers > 0 else None
+      self.slots = threading.BoundedSemaphore(max(queue_depth or default_queue_depth(), writers, 1))
+      self.error: Optional[BaseException] = None
+
+   def __enter__(self):
+      return self
+
+   def __exit__(self, *exc_info):
+      self.close()
+
+   def submit(self, pixels: 'np.ndarray', backend: str, file_path: str, variants: Sequence[Variant] = (),
+              source: Optional['np.ndarray'] = None, source_scale: float = 1.0):
+      # Blocks while the queue is full, which keeps the rendered images in memory bounded.
+      # The variants are resampled from source, rendered at source_scale, or from pixels when there is no source.
+      if self.error is not None:
+         raise self.error
+      if self.executor is None:
+         self._write(pixels, backend, file_path, variants, source, source_scale)
+         return
+      self.slots.acquire()
+      future = self.executor.submit(self._write, pixels, backend, file_path, variants, source, source_scale)
+      future.add_done_callback(self._done)
+
+   def _done(self, future: Future):
+      self.slots.release()
+      if future.exception() is not None and self.error is None:
+         self.error = future.exception()
+
+   @staticmethod
+   def _write(pixels: 'np.ndarray', backend: str, file_path: str, variants: Sequence[Variant] = (),
+              source: Optional['np.ndarray'] = None, source_scale: float = 1.0):
+      if variants:
+         write_variants(pixels if source is None else source, source_scale, file_path, variants)
+      with stage('encode'):
+         buffer = io.BytesIO()
+         encode_pixels(pixels, buffer, backend)
+      write_file(file_path, buffer.getvalue())
+
+   def close(self):
+      if self.executor is not None:
+         self.executor.shutdown(wait=True)
+      if self.error is not None:
+         raise self.error
@@ -0,0 +1,250 @@
+import math
+import sys
+from typing import BinaryIO, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+from PIL import Image, ImageColor
+
+from draw_intervals import (keys_per_octave, white_keys_per_octave, white_key_pitch_classes, black_key_pitch_classes,
+                            note_names, black_keys, resize_pixels)
+from pitch import Pitch
+
+# Same page geometry as the matplotlib figures: 100 dpi and the default subplot margins
+dpi = 100
+axes_left, axes_right, axes_bottom, axes_top = 0.125, 0.9, 0.11, 0.88
+
+RGBA = Tuple[int, int, int, int]
+
+
+def to_rgba8(colour) -> RGBA:
+   if isinstance(colour, str):
+      rgba = ImageColor.getrgb(colour)
+      return rgba if len(rgba) == 4 else (*rgba, 255)
+   channels = [round(c * 255) for c in colour]
+   return tuple(channels) if len(channels) == 4 else (*channels, 255)
+
+
+class _Page:
+   # Maps data coordinates to pixel rows/columns the way Agg snaps rectilinear patches
+
+   def __init__(self, width_inches, height_inches, xlim, ylim):
+      self.width = round(width_inches * dpi)
+      self.height = round(height_inches * dpi)
+      self.xlim = xlim
+      self.ylim = ylim
+      self.x0 = axes_left * self.width
+      self.y0 = axes_bottom * self.height
+      self.sx = (axes_right - axes_left) * self.width / (xlim[1] - xlim[0])
+      self.sy = (axes_top - axes_bottom) * self.height / (ylim[1] - ylim[0])
+
+   def column(self, x: float) -> int:
+      return math.floor(self.x0 + (x - self.xlim[0]) * self.sx + 0.5)
+
+   def row(self, y: float) -> int:
+      return self.height - math.floor(self.y0 + (y - self.ylim[0]) * self.sy + 0.5)
+
+   def axes_box(self) -> Tuple[int, int, int, int]:
+      return (self.column(self.xlim[0]), self.row(self.ylim[1]), self.column(self.xlim[1]), self.row(self.ylim[0]))
+
+   def rectangle(self, x: float, y: float, width: float, height: float) -> Tuple[int, int, int, int]:
+      # left, top, right, bottom pixel of the outline, inclusive
+      return self.column(x), self.row(y + height), self.column(x + width), self.row(y)
+
+
+class _KeyMask:
+   def __init__(self, box: Tuple[int, int, int, int], clip: Tuple[int, int, int, int]):
+      left, top, right, bottom = box
+      clip_left, clip_top, clip_right, clip_bottom = clip
+      self.slices = (slice(max(top, clip_top), min(bottom, clip_bottom) + 1),
+                     slice(max(left, clip_left), min(right, clip_right) + 1))
+      rows = np.arange(self.slices[0].start, self.slices[0].stop)[:, None]
+      columns = np.arange(self.slices[1].start, self.slices[1].stop)[None, :]
+      self.outline = (rows == top) | (rows == bottom) | (columns == left) | (columns == right)
+      self.fill = ~self.outline
+      self.fill_shade: Optional[np.ndarray] = None
+
+   def cover(self, other: '_KeyMask'):
+      # Remove the pixels another key is drawn over
+      rows = np.arange(self.slices[0].start, self.slices[0].stop)[:, None]
+      columns = np.arange(self.slices[1].start, self.slices[1].stop)[None, :]
+      covered = ((rows >= other.slices[0].start) & (rows < other.slices[0].stop)
+                 & (columns >= other.slices[1].start) & (columns < other.slices[1].stop))
+      self.fill &= ~covered
+      self.outline &= ~covered
+
+   def shade(self, ink: np.ndarray):
+      # How much of each fill pixel is covered by the anti-aliased black outlines around it
+      self.fill_shade = 1 - ink[self.slices][self.fill][:, None]
+
+   def paint(self, image: np.ndarray, fill: RGBA, edge: Optional[RGBA] = None):
+      region = image[self.slices]
+      if self.fill_shade is None:
+         region[self.fill] = fill
+      else:
+         shaded = np.empty((len(self.fill_shade), 4), dtype=np.uint8)
+         shaded[:, :3] = np.rint(np.array(fill[:3]) * self.fill_shade)
+         shaded[:, 3] = fill[3]
+         region[self.fill] = shaded
+      if edge is not None:
+         region[self.outline] = edge
+
+
+def _outline_ink(masks: List[_KeyMask], shape) -> np.ndarray:
+   # Agg strokes a 1pt outline about 1.4px wide, so it bleeds into the pixels on either side
+   lines = np.zeros(shape, dtype=bool)
+   for mask in masks:
+      lines[mask.slices] |= mask.outline
+   ink = lines.astype(np.float32)
+   ink[:, :-1] = np.maximum(ink[:, :-1], 0.357 * lines[:, 1:])
+   ink[:, 1:] = np.maximum(ink[:, 1:], 0.196 * lines[:, :-1])
+   ink[:-1, :] = np.maximum(ink[:-1, :], 0.357 * lines[1:, :])
+   ink[1:, :] = np.maximum(ink[1:, :], 0.196 * lines[:-1, :])
+   return ink
+
+
+def _blank(page: _Page) -> np.ndarray:
+   return np.full((page.height, page.width, 4), 255, dtype=np.uint8)
+
+
+class KeyboardRaster:
+   """Keyboard bitmap with one mask per key, built once per (octaves, start white key)."""
+
+   def __init__(self, octaves: int, start_white_key: int):
+      total_white_keys = octaves * white_keys_per_octave
+      self.page = _Page(7/2*octaves, 2, (-start_white_key, total_white_keys-start_white_key), (0, 3))
+      # Patches are clipped to the axes, whose right and bottom edges fall just outside the image area
+      left, top, right, bottom = self.page.axes_box()
+      clip = (left, top, right - 1, bottom - 1)
+      white_masks: Dict[int, _KeyMask] = {}
+      black_masks: Dict[int, _KeyMask] = {}
+      for i in range(-start_white_key, white_keys_per_octave * octaves - start_white_key):
+         octave = i // white_keys_per_octave
+         white_key = white_key_pitch_classes[i % white_keys_per_octave]
+         white_masks[octave * keys_per_octave + white_key] = _KeyMask(self.page.rectangle(i, 0, 1, 3), clip)
+         black_key = black_key_pitch_classes[i % white_keys_per_octave]
+         if black_key is not None:
+            black_masks[octave * keys_per_octave + black_key] = _KeyMask(
+               self.page.rectangle(i+0.7, 1.3, (1-0.7)*2, 1.7), clip)
+      for white_mask in white_masks.values():
+         for black_mask in black_masks.values():
+            white_mask.cover(black_mask)
+
+      self.key_masks = {**white_masks, **black_masks}
+      self.black_key_indexes = set(black_masks)
+      self.base = _blank(self.page)
+      ink = _outline_ink(list(self.key_masks.values()), self.base.shape[:2])
+      for mask in self.key_masks.values():
+         mask.shade(ink)
+      black = to_rgba8('black')
+      for mask in white_masks.values():
+         mask.paint(self.base, to_rgba8('white'), black)
+      for mask in black_masks.values():
+         mask.paint(self.base, black, black)
+      self.image = self.base
+
+   def recolour(self, highlighted_notes: List[Pitch], colours: Dict[Pitch, str]):
+      self.image = self.base.copy()
+      for note in highlighted_notes:
+         self.paint_key(self.image, note, colours)
+
+   def paint_key(self, image: np.ndarray, note: Pitch, colours: Dict[Pitch, str]) -> Optional[Tuple[slice, slice]]:
+      # Colours one key of image and returns the rows and columns it touched, None for keys off the keyboard
+      if note not in self.key_masks:
+         return None
+      default_colour = 'darkred' if note in self.black_key_indexes else 'lightcoral'
+      mask = self.key_masks[note]
+      mask.paint(image, to_rgba8(colours.get(note, default_colour)))
+      return mask.slices
+
+   def save(self, file: Union[str, BinaryIO]):
+      Image.fromarray(self.image, 'RGBA').save(file, format='PNG')
+
+   def rasterise(self, scale: float = 1.0) -> np.ndarray:
+      # The compositor only knows the 100 dpi geometry, other scales are resampled from it
+      return resize_pixels(self.image, scale)
+
+
+class PianoRollRaster:
+   """Piano roll bitmap with one note mask per row, built once per (octaves, start index)."""
+
+   def __init__(self, octaves: int, start_index: int):
+      self.start_index = start_index
+      total_keys = octaves * keys_per_octave
+      self.page = _Page(8, 2*octaves, (0, 5), (0, total_keys))
+      axes_box = self.page.axes_box()
+      self.base = _blank(self.page)
+      whitesmoke = to_rgba8('whitesmoke')
+      for i in range(-start_index, total_keys-start_index):
+         is_sharp = note_names[i % keys_per_octave] in black_keys
+         back_colour = whitesmoke if is_sharp else to_rgba8('white')
+         _KeyMask(self.page.rectangle(0, i+start_index, 28, 1), axes_box).paint(
+            self.base, back_colour, whitesmoke)
+
+      self.note_masks = {i: _KeyMask(self.page.rectangle(1, i+start_index, 3, 1), axes_box)
+                         for i in range(-start_index, total_keys-start_index)}
+
+      left, top, right, bottom = axes_box
+      self.frame = np.zeros(self.base.shape[:2], dtype=bool)
+      self.frame[top:bottom+1, [left, right]] = True
+      self.frame[[top, bottom], left:right+1] = True
+      self.base[self.frame] = to_rgba8('black')
+      self.image = self.base
+
+   def place_notes(self, note_indexes: List[int], colours: List[str]):
+      self.image = self.base.copy()
+      whitesmoke = to_rgba8('whitesmoke')
+      for note, colour in zip(note_indexes, colours):
+         if note in self.note_masks:
+            self.note_masks[note].paint(self.image, to_rgba8(colour), whitesmoke)
+      # The axes frame is drawn above the patches
+      self.image[self.frame] = self.base[self.frame]
+
+   def save(self, file: Union[str, BinaryIO]):
+      Image.fromarray(self.image, 'RGBA').save(file, format='PNG')
+
+   def rasterise(self, scale: float = 1.0) -> np.ndarray:
+      # The compositor only knows the 100 dpi geometry, other scales are resampled from it
+      return resize_pixels(self.image, scale)
+
+
+_keyboard_rasters: Dict[Tuple[int, int], KeyboardRaster] = {}
+_piano_roll_rasters: Dict[Tuple[int, int], PianoRollRaster] = {}
+
+
+def get_keyboard_raster(octaves: int, start_white_key: int) -> KeyboardRaster:
+   key = (octaves, start_white_key)
+   if key not in _keyboard_rasters:
+      _keyboard_rasters[key] = KeyboardRaster(octaves, start_white_key)
+   return _keyboard_rasters[key]
+
+
+def get_piano_roll_raster(octaves: int, start_index: int) -> PianoRollRaster:
+   key = (octaves, start_index)
+   if key not in _piano_roll_rasters:
+      _piano_roll_rasters[key] = PianoRollRaster(octaves, start_index)
+   return _piano_roll_rasters[key]
+
+
+def compare_images(file_path_a: str, file_path_b: str, tolerance: int = 64) -> float:
+   # Fraction of pixels where any channel differs by more than the tolerance
+   a = np.asarray(Image.open(file_path_a).convert('RGBA'), dtype=np.int16)
+   b = np.asarray(Image.open(file_path_b).convert('RGBA'), dtype=np.int16)
+   if a.shape != b.shape:
+      return 1.0
+   return float((np.abs(a - b) > tolerance).any(axis=2).mean())
+
+
+if __name__ == '__main__':
+   # Usage: python raster_backend.py <matplotlib output dir> <raster output dir>
+   # Prints the images whose raster rendering differs noticeably from the matplotlib one
+   import os
+   matplotlib_dir, raster_dir = sys.argv[1:3]
+   worst = 0.0
+   for file_name in sorted(os.listdir(matplotlib_dir)):
+      if not file_name.endswith('.png'):
+         continue
+      difference = compare_images(os.path.join(matplotlib_dir, file_name), os.path.join(raster_dir, file_name))
+      worst = max(worst, difference)
+      if difference > 0.01:
+         print(f"{file_name}: {difference:.2%} of pixels differ")
+   print(f"worst difference: {worst:.2%}")
@@ -0,0 +1,76 @@
+import hashlib
+import json
+import os
+from typing import Dict, List, Optional, TYPE_CHECKING
+
+from draw_intervals import RENDERER_VERSION
+from image_variants import remove_variants
+
+if TYPE_CHECKING:
+   from image_dedup import Deduplicator
+
+
+def job_hash(job) -> str:
+   # Everything that changes the pixels of the image, but not where it is written
+   key = {
+      'kind': job.kind,
+      'notes': list(job.notes),
+      'colours': sorted([note, colour] for note, colour in job.colours.items()),
+      'octaves': job.octaves,
+      'backend': job.backend,
+      'renderer_version': RENDERER_VERSION,
+   }
+   sizes = getattr(job, 'sizes', ())
+   if sizes:
+      # Only with extra sizes, so the hashes of existing manifests stay valid
+      key['sizes'] = [str(size) for size in sizes]
+   return hashlib.sha256(json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def job_file_path(job) -> str:
+   return job.path + job.file_name
+
+
+class RenderCache:
+   """Build manifest of one deck: output file path -> hash of the inputs it was rendered from."""
+
+   def __init__(self, manifest_path: str):
+      self.manifest_path = manifest_path
+      self.manifest: Dict[str, str] = {}
+      if os.path.exists(manifest_path):
+         with open(manifest_path, mode='r', encoding='utf-8') as manifest_file:
+            self.manifest = json.load(manifest_file)
+
+   def outdated_jobs(self, jobs: List, dedup: Optional['Deduplicator'] = None) -> List:
+      # A duplicate that dedup left unwritten is up to date as long as the file with its pixels is there
+      def present(file_path: str) -> bool:
+         return os.path.exists(file_path) or (dedup is not None and dedup.holds(file_path))
+
+      return [job for job in jobs
+              if self.manifest.get(job_file_path(job)) != job_hash(job) or not present(job_file_path(job))]
+
+   def remove_stale(self, jobs: List) -> List[str]:
+      current = {job_file_path(job) for job in jobs}
+      stale = [file_path for file_path in self.manifest if file_path not in current]
+      for file_path in stale:
+         if os.path.exists(file_path):
+            os.remove(file_path)
+         remove_variants(file_path)
+         del self.manifest[file_path]
+      return stale
+
+   def rendered_before(self, job) -> bool:
+      return job_file_path(job) in self.manifest
+
+   def record(self, jobs: List):
+      for job in jobs:
+         self.manifest[job_file_path(job)] = job_hash(job)
+
+   def save(self):
+      directory = os.path.dirname(self.manifest_path)
+      if directory:
+         os.makedirs(directory, exist_ok=True)
+      tmp_path = self.manifest_path + '.tmp'
+      with open(tmp_path, mode='w', encoding='utf-8') as manifest_file:
+         json.dump(self.manifest, manifest_file, indent=1, sort_keys=True)
+      os.replace(tmp_path, self.manifest_path)
@@ -0,0 +1,256 @@
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from multiprocessing import Manager
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple, TYPE_CHECKING
+
+from draw_intervals import (draw_keyboard, draw_piano_roll, render_keyboard, render_piano_roll, encode_keyboard,
+                            encode_piano_roll, MATPLOTLIB, SVG)
+from image_variants import Variant, default_variants, remove_variants, render_scale
+from instrumentation import map_recording, stage
+from png_writer import PngWriter, default_writers
+from render_cache import RenderCache, job_file_path
+from scale_animation import draw_scale_animation, encode_scale_animation, file_animation_format
+
+if TYPE_CHECKING:
+   import numpy as np
+   from image_dedup import Deduplicator
+
+KEYBOARD = 'keyboard'
+PIANO_ROLL = 'pianoroll'
+ANIMATION = 'animation'  # Scale playback, the notes light up in the order they are listed
+
+# Output modes: one PNG per image, every image of a deck packed into atlas sheets, or an Anki package
+FILES = 'files'
+ATLAS = 'atlas'
+APKG = 'apkg'
+
+
+def default_backend() -> str:
+   # DECK_BACKEND=raster switches the decks to the NumPy compositor
+   return os.environ.get('DECK_BACKEND', MATPLOTLIB)
+
+
+@dataclass
+class RenderJob:
+   kind: str
+   path: str
+   file_name: str
+   notes: List[str]
+   colours: Dict[str, str] = field(default_factory=dict)
+   octaves: int = 2
+   backend: str = field(default_factory=default_backend)
+   sizes: Tuple[Variant, ...] = field(default_factory=default_variants)  # Written next to the 1x image
+
+
+def render_job(job: RenderJob):
+   if job.kind == KEYBOARD:
+      draw_keyboard(job.path, job.file_name, job.notes, job.colours, job.octaves, job.backend)
+   elif job.kind == PIANO_ROLL:
+      draw_piano_roll(job.path, job.file_name, job.notes, job.colours, job.octaves, job.backend)
+   elif job.kind == ANIMATION:
+      draw_scale_animation(job.path, job.file_name, job.notes, job.colours, job.octaves)
+   else:
+      raise ValueError(f"Unknown render job kind: {job.kind}")
+
+
+def render_job_pixels(job: RenderJob, scale: float = 1.0) -> 'np.ndarray':
+   if job.kind == KEYBOARD:
+      return render_keyboard(job.notes, job.colours, job.octaves, job.backend, scale)
+   elif job.kind == PIANO_ROLL:
+      return render_piano_roll(job.notes, job.colours, job.octaves, job.backend, scale)
+   elif job.kind == ANIMATION:
+      raise ValueError(f"{job.file_name} is an animation, it has no single image")
+   raise ValueError(f"Unknown render job kind: {job.kind}")
+
+
+def render_job_png(job: RenderJob) -> bytes:
+   if job.kind == KEYBOARD:
+      return encode_keyboard(job.notes, job.colours, job.octaves, job.backend)
+   elif job.kind == PIANO_ROLL:
+      return encode_piano_roll(job.notes, job.colours, job.octaves, job.backend)
+   elif job.kind == ANIMATION:
+      return encode_scale_animation(job.notes, job.colours, job.octaves, file_animation_format(job.file_name))
+   raise ValueError(f"Unknown render job kind: {job.kind}")
+
+
+def default_output_mode() -> str:
+   return os.environ.get('DECK_OUTPUT', FILES)
+
+
+def default_processes() -> int:
+   # The pool size can be set with DECK_PROCESSES, 1 renders in the calling process
+   return int(os.environ.get('DECK_PROCESSES', os.cpu_count() or 1))
+
+
+def render_jobs(jobs: List[RenderJob], processes: Optional[int] = None, cache: Optional[RenderCache] = None,
+                dedup: Optional['Deduplicator'] = None):
+   if cache is None:
+      outdated = jobs
+   else:
+      removed = cache.remove_stale(jobs)
+      outdated = cache.outdated_jobs(jobs, dedup)
+      # The sizes asked for may have changed, those of the last build go with the image
+      for job in outdated:
+         if cache.rendered_before(job):
+            remove_variants(job_file_path(job))
+      if dedup is not None:
+         # Duplicates of a rewritten or removed image have to get pixels of their own again
+         outdated_paths = [job_file_path(job) for job in outdated]
+         rewritten = set(dedup.duplicates_of(removed + outdated_paths)) - set(outdated_paths)
+         outdated += [job for job in jobs if job_file_path(job) in rewritten]
+         dedup.forget(removed)
+      print(f"rendering {len(outdated)} of {len(jobs)} images")
+
+   if dedup is None:
+      _render_all(outdated, processes or default_processes())
+   else:
+      dedup.forget([job_file_path(job) for job in outdated])
+      dedup.resolve(_render_all(outdated, processes or default_processes(), dedup.canonical),
+                    {job_file_path(job): job.sizes for job in outdated})
+      dedup.use_files([job_file_path(job) for job in jobs])
+      dedup.save()
+      print(dedup.report(len(outdated)))
+
+   if cache is not None:
+      cache.record(outdated)
+      cache.save()
+
+
+def _render_all(jobs: List[RenderJob], processes: int, claims: Optional[Dict[str, str]] = None) -> List[Tuple[str, str]]:
+   # Returns the (duplicate, canonical file) pairs found when deduplicating against claims
+   if processes <= 1 or len(jobs) <= 1:
+      return _render_pipelined(jobs, claims)
+
+   # Consecutive jobs usually share a figure template, so hand them out in contiguous chunks
+   chunksize = max(1, len(jobs) // (processes * 4))
+   chunks = [jobs[start:start + chunksize] for start in range(0, len(jobs), chunksize)]
+   if claims is None:
+      with ProcessPoolExecutor(max_workers=processes) as executor:
+         for _ in map_recording(executor, _render_pipelined, chunks):
+            pass
+      return []
+
+   # The workers claim digests in one shared dict, so each image is written by exactly one of them
+   with Manager() as manager:
+      shared_claims = manager.dict(claims)
+      with ProcessPoolExecutor(max_workers=processes) as executor:
+         duplicates = [duplicate for chunk_duplicates in
+                       map_recording(executor, partial(_render_pipelined, claims=shared_claims), chunks)
+                       for duplicate in chunk_duplicates]
+      claims.update(shared_claims.copy())
+   return duplicates
+
+
+def _render_pipelined(jobs: List[RenderJob], claims=None) -> List[Tuple[str, str]]:
+   # The render loop only rasterises, PNG encoding and writing overlap with it on the writer threads.
+   # With claims (pixel digest -> file), an image whose pixels another file already claimed is not encoded.
+   # Jobs with extra sizes are rendered once more at the largest size, which every extra size is resampled from.
+   if default_writers() <= 0 and claims is None and not any(job.sizes for job in jobs):
+      for job in jobs:
+         render_job(job)
+      return []
+   from image_dedup import pixel_digest
+
+   duplicates = []
+   with PngWriter() as writer:
+      for job in jobs:
+         if job.backend == SVG or job.kind == ANIMATION:
+            # SVG is templated text and animations are encoded frame by frame, there are no pixels to compare
+            # or hand to the writers
+            render_job(job)
+            continue
+         pixels = render_job_pixels(job)
+         file_path = job_file_path(job)
+         if claims is not None:
+            # Only images written with the same sizes can share their files
+            digest = pixel_digest(pixels) + ''.join(f" {size}" for size in job.sizes)
+            canonical_path = claims.setdefault(digest, file_path)
+            if canonical_path != file_path:
+               duplicates.append((file_path, canonical_path))
+               continue
+         scale = render_scale(job.sizes)
+         source = pixels if scale == 1 else render_job_pixels(job, scale)
+         writer.submit(pixels, job.backend, file_path, job.sizes, source, scale)
+   return duplicates
+
+
+def render_atlas(jobs: List[RenderJob], atlas_prefix: str, processes: Optional[int] = None):
+   from atlas import build_atlas
+
+   processes = processes or default_processes()
+   if processes <= 1 or len(jobs) <= 1:
+      pixels = [render_job_pixels(job) for job in jobs]
+   else:
+      chunksize = max(1, len(jobs) // (processes * 4))
+      with ProcessPoolExecutor(max_workers=processes) as executor:
+         pixels = list(map_recording(executor, render_job_pixels, jobs, chunksize))
+   return build_atlas({job.file_name: image for job, image in zip(jobs, pixels)}, atlas_prefix)
+
+
+def iter_job_pngs(jobs: List[RenderJob], processes: Optional[int] = None) -> Iterator[Tuple[str, bytes]]:
+   # (file name, PNG bytes) in job order, each one as soon as it is encoded
+   processes = processes or default_processes()
+   if processes <= 1 or len(jobs) <= 1:
+      for job in jobs:
+         yield job.file_name, render_job_png(job)
+      return
+   chunksize = max(1, len(jobs) // (processes * 4))
+   with ProcessPoolExecutor(max_workers=processes) as executor:
+      for job, data in zip(jobs, map_recording(executor, render_job_png, jobs, chunksize)):
+         yield job.file_name, data
+
+
+def iter_media_files(paths: Sequence[str]) -> Iterator[Tuple[str, bytes]]:
+   for path in paths:
+      with open(path, 'rb') as media_file:
+         yield os.path.basename(path), media_file.read()
+
+
+def render_deck(jobs: List[RenderJob], output_dir: str, deck_name: str, csv_path: str,
+                output_mode: Optional[str] = None, note_keys: Optional[List[str]] = None,
+                media_paths: Sequence[str] = ()):
+   # Renders a whole deck after its CSV has been written, in the configured output mode. note_keys are the
+   # DeckStore keys of the CSV rows, which the .apkg notes are identified by; media_paths are files the cards use
+   # besides the images, like sound clips, that go into the .apkg with them.
+   output_mode = output_mode or default_output_mode()
+   svg = any(job.backend == SVG for job in jobs)
+   if svg:
+      from svg_backend import svg_jobs, use_svg_files
+
+      if output_mode == ATLAS:
+         raise ValueError("Atlas sheets are bitmaps, build SVG decks with DECK_OUTPUT=files or apkg")
+      jobs = svg_jobs(jobs)
+      use_svg_files(csv_path)
+   with stage('render'):
+      if output_mode == ATLAS:
+         from atlas import rewrite_csv
+
+         # Animations cannot be packed into a sheet, they stay files of their own
+         animations = [job for job in jobs if job.kind == ANIMATION]
+         if animations:
+            render_jobs(animations, cache=RenderCache(os.path.join(output_dir, 'render-manifest.json')))
+         index = render_atlas([job for job in jobs if job.kind != ANIMATION],
+                              os.path.join(output_dir, f"{deck_name}-atlas"))
+         rewrite_csv(csv_path, index)
+      elif output_mode == APKG:
+         from anki_package import write_package
+
+         media = itertools.chain(iter_job_pngs(jobs), iter_media_files(media_paths))
+         write_package(os.path.join(output_dir, f"{deck_name}.apkg"), deck_name, csv_path, media, note_keys)
+      elif output_mode == FILES:
+         from image_dedup import deduplicator, CSV
+
+         # Dedup compares pixels, which SVG images never have
+         dedup = None if svg else deduplicator()
+         render_jobs(jobs, cache=RenderCache(os.path.join(output_dir, 'render-manifest.json')), dedup=dedup)
+         if dedup is not None and dedup.mode == CSV:
+            dedup.rewrite_csv(csv_path)
+         if any(job.sizes for job in jobs):
+            from image_variants import use_srcset
+
+            use_srcset(csv_path, {job.file_name: job.sizes for job in jobs})
+      else:
+         raise ValueError(f"Unknown output mode: {output_mode}")
@@ -0,0 +1,267 @@
+import argparse
+import json
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+from urllib.parse import parse_qs, urlsplit
+
+from draw_intervals import MATPLOTLIB, RASTER, SVG
+from pitch import Pitch
+from render_cache import job_hash
+from render_jobs import RenderJob, render_job_png, default_backend, default_processes, KEYBOARD, PIANO_ROLL
+
+# Renders card images on first request instead of up front:
+#   python render_server.py --port 8765
+#   GET /render.png?type=keyboard&notes=K1,M1,G1&colours=K1:yellow,M1:%2390EE90&octaves=2
+#   GET /render?type=pianoroll&notes=K1,G1&backend=svg
+#   GET /voice-leading?root=G&type=dominant%20seventh&inversion=root&k=5
+# Images are kept in a size-bounded in-memory LRU and in a disk tier keyed by the render inputs.
+
+default_port = 8765
+default_cache_bytes = 64 * 1024 * 1024
+default_disk_dir = 'output/server-cache/'
+
+
+class LruCache:
+   """PNG bytes by key, evicting the least recently used images beyond max_bytes."""
+
+   def __init__(self, max_bytes: int):
+      self.max_bytes = max_bytes
+      self.size = 0
+      self.entries: 'OrderedDict[str, bytes]' = OrderedDict()
+      self.lock = threading.Lock()
+
+   def get(self, key: str) -> Optional[bytes]:
+      with self.lock:
+         data = self.entries.get(key)
+         if data is not None:
+            self.entries.move_to_end(key)
+         return data
+
+   def put(self, key: str, data: bytes):
+      with self.lock:
+         if key in self.entries:
+            self.size -= len(self.entries.pop(key))
+         if len(data) > self.max_bytes:
+            return
+         self.entries[key] = data
+         self.size += len(data)
+         while self.size > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= len(evicted)
+
+
+def _pitch(note: str) -> Pitch:
+   try:
+      return Pitch.parse(note)
+   except (KeyError, ValueError, IndexError):
+      raise ValueError(f"unknown note {note!r}, notes look like K1 or M2") from None
+
+
+def parse_request(query: str) -> RenderJob:
+   # Raises ValueError for parameters that do not describe an image
+   parameters = {name: values[-1] for name, values in parse_qs(query, keep_blank_values=True).items()}
+   kind = parameters.get('type', KEYBOARD)
+   if kind not in (KEYBOARD, PIANO_ROLL):
+      raise ValueError(f"type must be {KEYBOARD} or {PIANO_ROLL}")
+   notes = [_pitch(note) for note in parameters.get('notes', '').split(',') if note]
+   if not notes:
+      raise ValueError("notes must name at least one note, e.g. notes=K1,M1,G1")
+   colours = {}
+   for pair in filter(None, parameters.get('colours', '').split(',')):
+      note, _, colour = pair.partition(':')
+      if not colour:
+         raise ValueError(f"colours must look like K1:yellow, got {pair!r}")
+      colours[_pitch(note)] = colour
+   octaves = int(parameters.get('octaves', 2))
+   if not 1 <= octaves <= 8:
+      raise ValueError("octaves must be between 1 and 8")
+   backend = parameters.get('backend', default_backend())
+   if backend not in (MATPLOTLIB, RASTER, SVG):
+      raise ValueError(f"backend must be {MATPLOTLIB}, {RASTER} or {SVG}")
+   # The URL alone describes the image: no DECK_SIZES variants, so hashes and ETags do not depend on the environment
+   return RenderJob(kind, '', '', notes, colours, octaves, backend, sizes=())
+
+
+class ImageService:
+   """Memory, then disk, then a render; concurrent requests for the same image share one render."""
+
+   def __init__(self, cache_bytes: int = default_cache_bytes, disk_dir: Optional[str] = default_disk_dir,
+                processes: Optional[int] = None):
+      self.memory = LruCache(cache_bytes)
+      self.disk_dir = disk_dir
+      if disk_dir:
+         os.makedirs(disk_dir, exist_ok=True)
+      processes = processes or default_processes()
+      # The figure templates are shared state, so renders run in worker processes or one at a time
+      self.pool = ProcessPoolExecutor(max_workers=processes) if processes > 1 else None
+      self.render_lock = threading.Lock()
+      self.in_flight: Dict[str, Future] = {}
+      self.in_flight_lock = threading.Lock()
+      # Coalesced hits are requests that waited for the render another request had already started
+      self.stats = {'memory_hits': 0, 'disk_hits': 0, 'coalesced_hits': 0, 'renders': 0, 'errors': 0}
+      self.stats_lock = threading.Lock()
+
+   def _count(self, name: str):
+      with self.stats_lock:
+         self.stats[name] += 1
+
+   def image(self, job: RenderJob) -> bytes:
+      key = job_hash(job)
+      data = self.memory.get(key)
+      if data is not None:
+         self._count('memory_hits')
+         return data
+
+      with self.in_flight_lock:
+         future = self.in_flight.get(key)
+         owner = future is None
+         if owner:
+            future = self.in_flight[key] = Future()
+      if not owner:
+         self._count('coalesced_hits')
+         return future.result()
+
+      try:
+         data = self._load_or_render(key, job)
+         self.memory.put(key, data)
+         future.set_result(data)
+         return data
+      except BaseException as error:
+         future.set_exception(error)
+         raise
+      finally:
+         with self.in_flight_lock:
+            del self.in_flight[key]
+
+   def _load_or_render(self, key: str, job: RenderJob) -> bytes:
+      extension = 'svg' if job.backend == SVG else 'png'
+      disk_path = os.path.join(self.disk_dir, f"{key}.{extension}") if self.disk_dir else None
+      if disk_path and os.path.exists(disk_path):
+         with open(disk_path, 'rb') as png_file:
+            self._count('disk_hits')
+            return png_file.read()
+
+      if self.pool is not None:
+         data = self.pool.submit(render_job_png, job).result()
+      else:
+         with self.render_lock:
+            data = render_job_png(job)
+      self._count('renders')
+      if disk_path:
+         tmp_path = f"{disk_path}.{threading.get_ident()}.tmp"
+         with open(tmp_path, 'wb') as png_file:
+            png_file.write(data)
+         os.replace(tmp_path, disk_path)
+      return data
+
+   def summary(self) -> dict:
+      with self.stats_lock:
+         stats = dict(self.stats)
+      stats.update(memory_images=len(self.memory.entries), memory_bytes=self.memory.size)
+      return stats
+
+   def close(self):
+      if self.pool is not None:
+         self.pool.shutdown()
+
+
+class RenderRequestHandler(BaseHTTPRequestHandler):
+   service: ImageService  # Set on the subclass made by make_server
+
+   def do_GET(self):
+      url = urlsplit(self.path)
+      if url.path == '/stats':
+         self._send(HTTPStatus.OK, json.dumps(self.service.summary()).encode('utf-8'), 'application/json')
+      elif url.path in ('/render', '/render.png'):
+         self._render(url.query)
+      elif url.path == '/voice-leading':
+         self._voice_leading(url.query)
+      else:
+         self._send(HTTPStatus.NOT_FOUND, b"not found\n", 'text/plain')
+
+   def _render(self, query: str):
+      try:
+         job = parse_request(query)
+      except ValueError as error:
+         self._send(HTTPStatus.BAD_REQUEST, f"bad request: {error}\n".encode('utf-8'), 'text/plain')
+         return
+      etag = f'"{job_hash(job)}"'
+      if self.headers.get('If-None-Match') == etag:
+         # The URL fully describes the image, so a client holding it needs nothing rendered
+         self._send(HTTPStatus.NOT_MODIFIED, b'', None, etag)
+         return
+      try:
+         data = self.service.image(job)
+      except (ValueError, KeyError) as error:
+         # Unknown colour names and the like only show up while rendering
+         self.service._count('errors')
+         self._send(HTTPStatus.BAD_REQUEST, f"cannot render: {error}\n".encode('utf-8'), 'text/plain')
+         return
+      self._send(HTTPStatus.OK, data, 'image/svg+xml' if job.backend == SVG else 'image/png', etag)
+
+   def _voice_leading(self, query: str):
+      # The chords reached from root, type and inversion with the least semitone movement
+      from voice_leading import voice_leading_index
+
+      parameters = {name: values[-1] for name, values in parse_qs(query).items()}
+      try:
+         neighbours = voice_leading_index().nearest(parameters.get('root', ''), parameters.get('type', ''),
+                                                    parameters.get('inversion', 'root'), int(parameters.get('k', 5)))
+      except (KeyError, ValueError) as error:
+         self._send(HTTPStatus.BAD_REQUEST, f"bad request: {error}\n".encode('utf-8'), 'text/plain')
+         return
+      body = [{'root': neighbour.voicing.root, 'type': neighbour.voicing.chord_type,
+               'inversion': neighbour.voicing.inversion, 'distance': neighbour.distance,
+               'pitches': list(neighbour.pitches)} for neighbour in neighbours]
+      self._send(HTTPStatus.OK, json.dumps(body).encode('utf-8'), 'application/json')
+
+   def _send(self, status: HTTPStatus, body: bytes, content_type: Optional[str], etag: Optional[str] = None):
+      self.send_response(status)
+      if content_type:
+         self.send_header('Content-Type', content_type)
+      if etag:
+         self.send_header('ETag', etag)
+         self.send_header('Cache-Control', 'public, max-age=31536000, immutable')
+      self.send_header('Content-Length', str(len(body)))
+      self.end_headers()
+      if body:
+         self.wfile.write(body)
+
+   def log_message(self, format, *args):
+      if os.environ.get('DECK_SERVER_LOG'):
+         super().log_message(format, *args)
+
+
+def make_server(host: str, port: int, service: ImageService) -> ThreadingHTTPServer:
+   handler = type('Handler', (RenderRequestHandler,), {'service': service})
+   return ThreadingHTTPServer((host, port), handler)
+
+
+def main(argv=None):
+   parser = argparse.ArgumentParser(description="Serve keyboard and piano roll images rendered on demand")
+   parser.add_argument('--host', default='127.0.0.1')
+   parser.add_argument('--port', type=int, default=default_port)
+   parser.add_argument('--cache-bytes', type=int, default=default_cache_bytes, help="size of the in-memory LRU")
+   parser.add_argument('--disk-dir', default=default_disk_dir, help="disk tier, '' turns it off")
+   parser.add_argument('--processes', type=int, help="render worker processes (DECK_PROCESSES by default)")
+   args = parser.parse_args(argv)
+
+   service = ImageService(args.cache_bytes, args.disk_dir or None, args.processes)
+   server = make_server(args.host, args.port, service)
+   print(f"serving on http://{args.host}:{server.server_address[1]}/render.png")
+   try:
+      server.serve_forever()
+   except KeyboardInterrupt:
+      pass
+   finally:
+      server.server_close()
+      service.close()
+
+
+if __name__ == '__main__':
+   main()
@@ -0,0 +1,136 @@
+import os
+import struct
+import zlib
+from typing import Dict, Iterator, List, Optional, Tuple, TYPE_CHECKING
+
+from draw_intervals import parse_notes, prepare_keyboard, write_file, RASTER
+from instrumentation import stage
+from pitch import NoteLike
+
+if TYPE_CHECKING:
+   import numpy as np
+
+# Animated keyboards that light up the notes of a scale one by one, in the order they are sung. Every frame is the
+# one before with one more key coloured, so a frame is just the rectangle of that key, painted with the raster
+# backend's key mask: nothing is re-rendered and no two keyboards are compared. APNG players show the playback,
+# anything else shows the finished scale. Switched on for the modes deck with DECK_ANIMATIONS=apng (or gif).
+
+APNG = 'apng'
+GIF = 'gif'
+extensions = {APNG: '.apng', GIF: '.gif'}
+note_ms = 400
+hold_ms = 1600  # The whole scale stays up this long before the playback starts again
+
+Frame = Tuple['np.ndarray', Tuple[int, int]]  # Pixels and the (top, left) corner they go at
+
+
+def default_animation_format() -> Optional[str]:
+   animation_format = os.environ.get('DECK_ANIMATIONS', '') or None
+   if animation_format is not None and animation_format not in extensions:
+      raise ValueError(f"DECK_ANIMATIONS is one of {', '.join(extensions)}, got {animation_format!r}")
+   return animation_format
+
+
+def file_animation_format(file_name: str) -> str:
+   extension = os.path.splitext(file_name)[1]
+   for name, name_extension in extensions.items():
+      if extension == name_extension:
+         return name
+   raise ValueError(f"Not an animation file name: {file_name}")
+
+
+class ScaleAnimation:
+   """Playback frames on the raster keyboard that the static image of the same notes is drawn on."""
+
+   def __init__(self, notes: List[NoteLike], colours: Dict[NoteLike, str] = None, octaves=2):
+      self.keyboard = prepare_keyboard(notes, colours, octaves, RASTER)
+      self.final = self.keyboard.image  # recolour() made a new image, later recolours leave this one alone
+      self.notes, self.colours = parse_notes(notes, colours)
+
+   def frames(self) -> Iterator[Frame]:
+      # The bare keyboard, then the rectangle of each key as it lights up
+      image = self.keyboard.base.copy()
+      yield image.copy(), (0, 0)
+      for note in self.notes:
+         slices = self.keyboard.paint_key(image, note, self.colours)
+         if slices is not None:
+            yield image[slices].copy(), (slices[0].start, slices[1].start)
+
+   def full_frames(self) -> Iterator['np.ndarray']:
+      # Whole keyboards, for formats that cannot place a frame
+      image = None
+      for pixels, (top, left) in self.frames():
+         if image is None:
+            image = pixels
+         else:
+            image = image.copy()
+            image[top:top + pixels.shape[0], left:left + pixels.shape[1]] = pixels
+         yield image
+
+
+def _delays(count: int) -> List[int]:
+   return [note_ms] * (count - 1) + [hold_ms]
+
+
+def _chunk(kind: bytes, data: bytes) -> bytes:
+   return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+
+def _image_data(pixels: 'np.ndarray') -> bytes:
+   # Every row with the PNG "up" filter: keys are vertical, so most rows of a keyboard filter to zeros
+   import numpy as np
+
+   rows = pixels.reshape(pixels.shape[0], -1)
+   filtered = np.empty((rows.shape[0], rows.shape[1] + 1), dtype=np.uint8)
+   filtered[:, 0] = 2
+   filtered[0, 1:] = rows[0]
+   filtered[1:, 1:] = rows[1:] - rows[:-1]
+   return zlib.compress(filtered.tobytes(), 9)
+
+
+def encode_apng(default_image: 'np.ndarray', frames: List[Frame]) -> bytes:
+   # The default image comes before the first frame control, so it is not part of the animation
+   height, width = default_image.shape[:2]
+   chunks = [b'\x89PNG\r\n\x1a\n',
+             _chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0)),
+             _chunk(b'acTL', struct.pack('>II', len(frames), 0)),
+             _chunk(b'IDAT', _image_data(default_image))]
+   sequence = 0
+   for (pixels, (top, left)), delay in zip(frames, _delays(len(frames))):
+      # Frames are kept (dispose none) and replace the pixels under them (blend source)
+      chunks.append(_chunk(b'fcTL', struct.pack('>IIIIIHHBB', sequence, pixels.shape[1], pixels.shape[0], left,
+                                                top, delay, 1000, 0, 0)))
+      chunks.append(_chunk(b'fdAT', struct.pack('>I', sequence + 1) + _image_data(pixels)))
+      sequence += 2
+   chunks.append(_chunk(b'IEND', b''))
+   return b''.join(chunks)
+
+
+def encode_gif(default_image: 'np.ndarray', frames: List['np.ndarray']) -> bytes:
+   # Pillow stores only the changed rectangle of each GIF frame. One palette, from the finished scale, which has
+   # every colour the frames have.
+   import io
+   from PIL import Image
+
+   palette = Image.fromarray(default_image, 'RGBA').convert('RGB').quantize(256)
+   images = [Image.fromarray(frame, 'RGBA').convert('RGB').quantize(palette=palette, dither=Image.Dither.NONE)
+             for frame in frames]
+   buffer = io.BytesIO()
+   images[0].save(buffer, format='GIF', save_all=True, append_images=images[1:], duration=_delays(len(images)),
+                  loop=0)
+   return buffer.getvalue()
+
+
+def encode_scale_animation(notes: List[NoteLike], colours: Dict[NoteLike, str] = None, octaves=2,
+                           animation_format: str = APNG) -> bytes:
+   animation = ScaleAnimation(notes, colours, octaves)
+   with stage('encode'):
+      if animation_format == GIF:
+         return encode_gif(animation.final, list(animation.full_frames()))
+      return encode_apng(animation.final, list(animation.frames()))
+
+
+def draw_scale_animation(path, file_name: str, notes: List[NoteLike], colours: Dict[NoteLike, str] = None,
+                         octaves=2):
+   # The format comes from the file name, .apng or .gif
+   write_file(path + file_name, encode_scale_animation(notes, colours, octaves, file_animation_format(file_name)))
@@ -0,0 +1,259 @@
+import argparse
+import re
+from dataclasses import dataclass
+from typing import BinaryIO, Iterable, List, Optional, Sequence, Union
+
+from draw_intervals import (draw_canvas, encode_template, rasterise_template, keys_per_octave, note_names, black_keys,
+                            resize_pixels, write_file, MATPLOTLIB, RASTER, SVG)
+from instrumentation import stage
+from pitch import Pitch, PitchClass, NoteLike
+
+# Piano rolls of timed note sequences: melodies and chord progressions over time rather than one column of notes.
+# The background rows and the notes are drawn as one collection each, so the cost per note stays flat for songs
+# with thousands of notes. The figure grows with the sequence:
+#   python sequence_roll.py song jurassic.png "Du DuTeDu DuTeDu MaMa GuGu" --tonic D1
+#   python sequence_roll.py progression progression.png K:major G:major:first-inversion L:minor
+
+rows_per_inch = 6  # Twelve rows are two inches high, like draw_piano_roll
+beats_per_inch = 4
+min_width_inches = 4
+max_width_inches = 40  # Longer songs are squeezed rather than making the image ever wider
+default_note_colour = 'pink'
+
+
+@dataclass
+class TimedNote:
+   pitch: Pitch
+   onset: float  # In beats
+   duration: float
+   colour: Optional[object] = None  # Anything the renderers accept, default_note_colour when None
+
+
+def progression_notes(chords: Iterable['Chord'], beats_per_chord: float = 2.0) -> List[TimedNote]:
+   # One chord after the other, every note of a chord coloured as make_chord coloured it
+   return [TimedNote(note, i * beats_per_chord, beats_per_chord, chord.colours.get(note))
+           for i, chord in enumerate(chords) for note in chord.notes]
+
+
+# Syllable vowels of notes above the tonic and below it, see interval_to_letters
+_down_vowels = {'e', 'o', 'y', 'yo'}
+_syllable = re.compile(r'([KTDNMFJGRLPB])([aeiouy]+)')
+_syllable_word = re.compile(r'(?:[KTDNMFJGRLPB][aeiouy]+)+')
+
+
+def melody_from_syllables(text: str, tonic: NoteLike = 'K1', beats_per_syllable: float = 1.0) -> List[TimedNote]:
+   # Songs are written as syllables sung against the tonic, e.g. "Du DuTeDu" in D: the letter is the note and the
+   # vowel tells whether it lies above the tonic or below it ("uu" is the octave). Every syllable is one beat,
+   # words that are not made of syllables (titles, translations, markup) are skipped.
+   tonic = Pitch.parse(tonic)
+   notes = []
+   syllables = [syllable for word in re.findall(r'[A-Za-z]+', text) if _syllable_word.fullmatch(word)
+                for syllable in _syllable.findall(word)]
+   for letter, vowel in syllables:
+      above = (PitchClass[letter] - tonic.pitch_class) % keys_per_octave
+      if vowel in _down_vowels:
+         # "y" on the tonic itself is the octave below
+         pitch = tonic - (keys_per_octave - above if above or vowel == 'y' else 0)
+      elif vowel == 'uu' and not above:
+         pitch = tonic + keys_per_octave
+      else:
+         pitch = tonic + above
+      notes.append(TimedNote(Pitch(pitch), len(notes) * beats_per_syllable, beats_per_syllable))
+   return notes
+
+
+class _Layout:
+   # Whole octaves around the notes, and as many beats as the sequence lasts
+
+   def __init__(self, notes: Sequence[TimedNote]):
+      if not notes:
+         raise ValueError("A sequence roll needs at least one note")
+      self.low = min(note.pitch for note in notes) // keys_per_octave * keys_per_octave
+      self.high = (max(note.pitch for note in notes) // keys_per_octave + 1) * keys_per_octave
+      self.beats = max(note.onset + note.duration for note in notes)
+      self.width_inches = min(max(self.beats / beats_per_inch, min_width_inches), max_width_inches)
+      self.height_inches = (self.high - self.low) / rows_per_inch
+
+   def is_sharp(self, pitch: int) -> bool:
+      return note_names[pitch % keys_per_octave] in black_keys
+
+
+class SequenceRollFigure:
+   """matplotlib figure with one PolyCollection for the rows and one for the notes."""
+
+   def __init__(self, notes: Sequence[TimedNote]):
+      import numpy as np
+      from matplotlib.backends.backend_agg import FigureCanvasAgg
+      from matplotlib.collections import PolyCollection
+      from matplotlib.figure import Figure
+
+      layout = _Layout(notes)
+      self.figure = Figure(figsize=(layout.width_inches, layout.height_inches))
+      self.canvas = FigureCanvasAgg(self.figure)
+      axes = self.figure.add_subplot()
+      axes.set_xlim(0, layout.beats)
+      axes.set_ylim(layout.low, layout.high)
+
+      rows = np.arange(layout.low, layout.high)
+      axes.add_collection(PolyCollection(
+         _boxes(np.zeros(len(rows)), rows, np.full(len(rows), layout.beats)),
+         facecolors=['whitesmoke' if layout.is_sharp(row) else 'white' for row in rows], edgecolors='whitesmoke'))
+      axes.add_collection(PolyCollection(
+         _boxes(np.array([note.onset for note in notes]), np.array([note.pitch for note in notes]),
+                np.array([note.duration for note in notes])),
+         facecolors=[_note_colour(note) for note in notes], edgecolors='whitesmoke', linewidths=0.5))
+      axes.set_xticks([])
+      axes.set_yticks([])
+
+   def save(self, file: Union[str, BinaryIO]):
+      self.figure.savefig(file, format='png')
+
+   def rasterise(self, scale: float = 1.0) -> 'np.ndarray':
+      return draw_canvas(self.figure, self.canvas, scale)
+
+
+def _boxes(x: 'np.ndarray', y: 'np.ndarray', width: 'np.ndarray') -> 'np.ndarray':
+   # [n, corner, xy] rectangles one row high, built without any per-note objects
+   import numpy as np
+
+   return np.stack([np.stack([x, y], axis=-1), np.stack([x + width, y], axis=-1),
+                    np.stack([x + width, y + 1], axis=-1), np.stack([x, y + 1], axis=-1)], axis=1)
+
+
+def _note_colour(note: TimedNote):
+   return default_note_colour if note.colour is None else note.colour
+
+
+class SequenceRollRaster:
+   """The same roll painted straight into a NumPy image, one slice fill per row and per note."""
+
+   def __init__(self, notes: Sequence[TimedNote]):
+      import numpy as np
+      from raster_backend import _Page, _KeyMask, _blank, to_rgba8
+
+      layout = _Layout(notes)
+      page = _Page(layout.width_inches, layout.height_inches, (0, layout.beats), (layout.low, layout.high))
+      axes_box = page.axes_box()
+      self.image = _blank(page)
+      whitesmoke = to_rgba8('whitesmoke')
+      for row in range(layout.low, layout.high):
+         _KeyMask(page.rectangle(0, row, layout.beats, 1), axes_box).paint(
+            self.image, whitesmoke if layout.is_sharp(row) else to_rgba8('white'), whitesmoke)
+
+      # Pixel boxes of every note at once, then a fill per note whatever the size of the song
+      onsets = np.array([note.onset for note in notes])
+      pitches = np.array([note.pitch for note in notes])
+      lefts = np.floor(page.x0 + onsets * page.sx + 0.5).astype(int)
+      rights = np.floor(page.x0 + (onsets + [note.duration for note in notes]) * page.sx + 0.5).astype(int)
+      bottoms = page.height - np.floor(page.y0 + (pitches - layout.low) * page.sy + 0.5).astype(int)
+      tops = page.height - np.floor(page.y0 + (pitches + 1 - layout.low) * page.sy + 0.5).astype(int)
+      colours = {}
+      for note, left, top, right, bottom in zip(notes, lefts, tops, rights, bottoms):
+         colour = _note_colour(note)
+         key = colour if isinstance(colour, str) else tuple(colour)
+         if key not in colours:
+            colours[key] = to_rgba8(colour)
+         self.image[top:bottom + 1, left:right + 1] = whitesmoke
+         self.image[top + 1:bottom, left + 1:right] = colours[key]
+
+      left, top, right, bottom = axes_box
+      self.image[top:bottom + 1, [left, right]] = to_rgba8('black')
+      self.image[[top, bottom], left:right + 1] = to_rgba8('black')
+
+   def save(self, file: Union[str, BinaryIO]):
+      from PIL import Image
+      Image.fromarray(self.image, 'RGBA').save(file, format='PNG')
+
+   def rasterise(self, scale: float = 1.0) -> 'np.ndarray':
+      return resize_pixels(self.image, scale)
+
+
+class SequenceRollSvg:
+   """SVG text with the row and note rectangles written out directly."""
+
+   def __init__(self, notes: Sequence[TimedNote]):
+      from svg_backend import _document, row_height, svg_colour
+
+      layout = _Layout(notes)
+      # Same proportions as the PNG: an inch is as wide as rows_per_inch rows are high
+      width = round(layout.width_inches * rows_per_inch * row_height)
+      height = (layout.high - layout.low) * row_height
+      beat_width = width / layout.beats
+
+      def y(pitch: int) -> int:
+         return (layout.high - 1 - pitch) * row_height
+
+      sharp_rows = ''.join(f'<use href="#r" y="{y(row)}"/>' for row in range(layout.low, layout.high)
+                           if layout.is_sharp(row))
+      note_rects = ''.join(
+         f'<rect x="{note.onset * beat_width:.4g}" y="{y(note.pitch)}" width="{note.duration * beat_width:.4g}" '
+         f'height="{row_height}" fill="{svg_colour(_note_colour(note))}"/>' for note in notes)
+      self.data = _document(width, height,
+                            f'<defs><rect id="r" width="{width}" height="{row_height}"/></defs>'
+                            f'<rect width="{width}" height="{height}" fill="#fff"/><g fill="#f5f5f5">{sharp_rows}</g>'
+                            f'<g stroke="#f5f5f5" stroke-width=".5">{note_rects}</g>'
+                            f'<rect width="{width}" height="{height}" fill="none" stroke="#000"/>')
+
+   def save(self, file: Union[str, BinaryIO]):
+      from svg_backend import _write
+      _write(self.data, file)
+
+   def rasterise(self, scale: float = 1.0):
+      raise ValueError("The svg backend renders vector images, use the matplotlib or raster backend for pixels")
+
+
+def _prepare_sequence_roll(notes: Sequence[TimedNote], backend=MATPLOTLIB):
+   with stage('patches'):
+      if backend == RASTER:
+         return SequenceRollRaster(notes)
+      elif backend == SVG:
+         return SequenceRollSvg(notes)
+      return SequenceRollFigure(notes)
+
+
+def draw_sequence_roll(path, file_name: str, notes: Sequence[TimedNote], backend=MATPLOTLIB):
+   write_file(path + file_name, encode_template(_prepare_sequence_roll(notes, backend)))
+
+
+def render_sequence_roll(notes: Sequence[TimedNote], backend=MATPLOTLIB, scale: float = 1.0) -> 'np.ndarray':
+   return rasterise_template(_prepare_sequence_roll(notes, backend), scale)
+
+
+def encode_sequence_roll(notes: Sequence[TimedNote], backend=MATPLOTLIB) -> bytes:
+   return encode_template(_prepare_sequence_roll(notes, backend))
+
+
+def main(argv: Optional[List[str]] = None):
+   from render_jobs import default_backend
+
+   parser = argparse.ArgumentParser(description="Draw a piano roll of a melody or a chord progression")
+   commands = parser.add_subparsers(dest='command', required=True)
+   song = commands.add_parser('song', help="a melody written in syllables, as in the SongToPractice column")
+   song.add_argument('output', help="image file to write")
+   song.add_argument('syllables')
+   song.add_argument('--tonic', default='K1', help="note the syllables are sung against, e.g. D1")
+   progression = commands.add_parser('progression', help="chords such as K:major G:major:first-inversion 'D:minor seventh'")
+   progression.add_argument('output', help="image file to write")
+   progression.add_argument('chords', nargs='+', metavar='root:type:inversion')
+   progression.add_argument('--beats', type=float, default=2.0, help="beats per chord")
+   for command in (song, progression):
+      command.add_argument('--backend', default=default_backend(), choices=[MATPLOTLIB, RASTER, SVG])
+   args = parser.parse_args(argv)
+
+   if args.command == 'song':
+      notes = melody_from_syllables(args.syllables, args.tonic)
+   else:
+      from chord_syllables import make_chord
+
+      chords = []
+      for chord in args.chords:
+         parts = chord.split(':')
+         root, chord_type, inversion = parts[0], *(parts[1:] + ['major', 'root'][len(parts) - 1:])[:2]
+         chords.append(make_chord(root, chord_type, inversion.replace('-', ' '), 1))
+      notes = progression_notes(chords, args.beats)
+   draw_sequence_roll('', args.output, notes, args.backend)
+   print(f"{args.output}: {len(notes)} notes")
+
+
+if __name__ == '__main__':
+   main()
@@ -0,0 +1,170 @@
+import os
+from dataclasses import replace
+from typing import BinaryIO, Dict, List, Union
+
+from draw_intervals import (keys_per_octave, white_keys_per_octave, white_key_pitch_classes, black_key_pitch_classes,
+                            note_names, black_keys, SVG)
+from pitch import Pitch
+
+# Keyboards and piano rolls as SVG text: key and row shapes are defined once in <defs> and placed with <use>,
+# only highlighted keys and notes carry their own fill. Same layout as the figures, in whole-number units.
+
+key_width = 20  # One white key
+key_height = 60
+black_key_offset = 14  # Black keys sit at 0.7 of the white key on their left and are 0.6 keys wide
+black_key_width = 12
+black_key_height = 34
+row_height = 10  # One piano roll row
+roll_unit = 100  # One unit of the piano roll's x axis, which runs from 0 to 5
+note_start, note_length = 1, 3
+pixels_per_unit = 2
+
+_header = ('<svg xmlns="http://www.w3.org/2000/svg" '
+           'width="{width}" height="{height}" viewBox="-.5 -.5 {view_width} {view_height}">')
+
+
+def svg_colour(colour) -> str:
+   # Names, hex strings and RGBA tuples as accepted by the other backends
+   from raster_backend import to_rgba8
+
+   red, green, blue, alpha = to_rgba8(colour)
+   return f"#{red:02x}{green:02x}{blue:02x}" + (f"{alpha:02x}" if alpha < 255 else '')
+
+
+def _document(width: int, height: int, body: str) -> bytes:
+   return (_header.format(width=width * pixels_per_unit, height=height * pixels_per_unit,
+                          view_width=width + 1, view_height=height + 1) + body + '</svg>').encode('utf-8')
+
+
+def _write(data: bytes, file: Union[str, BinaryIO]):
+   if isinstance(file, str):
+      with open(file, 'wb') as svg_file:
+         svg_file.write(data)
+   else:
+      file.write(data)
+
+
+def _fill(colour: str) -> str:
+   return f' fill="{colour}"' if colour else ''
+
+
+class KeyboardSvg:
+   """Key positions of one (octaves, start white key) layout, recoloured for every image."""
+
+   def __init__(self, octaves: int, start_white_key: int):
+      self.width = octaves * white_keys_per_octave * key_width
+      self.white_keys: Dict[int, int] = {}  # Pitch -> x
+      self.black_keys: Dict[int, int] = {}
+      for i in range(-start_white_key, white_keys_per_octave * octaves - start_white_key):
+         octave = i // white_keys_per_octave
+         x = (i + start_white_key) * key_width
+         self.white_keys[octave * keys_per_octave + white_key_pitch_classes[i % white_keys_per_octave]] = x
+         black_key = black_key_pitch_classes[i % white_keys_per_octave]
+         if black_key is not None:
+            self.black_keys[octave * keys_per_octave + black_key] = x + black_key_offset
+      self.defs = (f'<defs><rect id="w" width="{key_width}" height="{key_height}"/>'
+                   f'<rect id="b" width="{black_key_width}" height="{black_key_height}"/></defs>')
+      self.fills: Dict[int, str] = {}
+
+   def recolour(self, highlighted_notes: List[Pitch], colours: Dict[Pitch, str]):
+      self.fills = {}
+      for note in highlighted_notes:
+         if note in self.black_keys:
+            self.fills[note] = svg_colour(colours.get(note, 'darkred'))
+         elif note in self.white_keys:
+            self.fills[note] = svg_colour(colours.get(note, 'lightcoral'))
+
+   def document(self) -> bytes:
+      white = ''.join(f'<use href="#w" x="{x}"{_fill(self.fills.get(note))}/>'
+                      for note, x in self.white_keys.items())
+      black = ''.join(f'<use href="#b" x="{x}"{_fill(self.fills.get(note))}/>'
+                      for note, x in self.black_keys.items())
+      return _document(self.width, key_height, f'{self.defs}<g fill="#fff" stroke="#000">{white}</g>'
+                                               f'<g fill="#000" stroke="#000">{black}</g>')
+
+   def save(self, file: Union[str, BinaryIO]):
+      _write(self.document(), file)
+
+   def rasterise(self, scale: float = 1.0):
+      raise ValueError("The svg backend renders vector images, use the matplotlib or raster backend for pixels")
+
+
+class PianoRollSvg:
+   """Piano roll background of one (octaves, start index) layout, with the notes placed for every image."""
+
+   def __init__(self, octaves: int, start_index: int):
+      self.start_index = start_index
+      self.total_keys = octaves * keys_per_octave
+      self.width = 5 * roll_unit
+      self.height = self.total_keys * row_height
+      sharp_rows = ''.join(f'<use href="#r" y="{self._y(i)}"/>'
+                           for i in range(-start_index, self.total_keys - start_index)
+                           if note_names[i % keys_per_octave] in black_keys)
+      self.background = (f'<defs><rect id="r" width="{self.width}" height="{row_height}"/>'
+                         f'<rect id="n" x="{note_start * roll_unit}" width="{note_length * roll_unit}" '
+                         f'height="{row_height}"/></defs>'
+                         f'<rect width="{self.width}" height="{self.height}" fill="#fff"/>'
+                         f'<g fill="#f5f5f5">{sharp_rows}</g>')
+      self.frame = f'<rect width="{self.width}" height="{self.height}" fill="none" stroke="#000"/>'
+      self.notes = ''
+
+   def _y(self, note: int) -> int:
+      # Row of the note counted from the top, the lowest note is at the bottom
+      return (self.total_keys - 1 - (note + self.start_index)) * row_height
+
+   def place_notes(self, note_indexes: List[int], colours: List[str]):
+      self.notes = ''.join(f'<use href="#n" y="{self._y(note)}" fill="{svg_colour(colour)}"/>'
+                           for note, colour in zip(note_indexes, colours)
+                           if 0 <= note + self.start_index < self.total_keys)
+
+   def document(self) -> bytes:
+      return _document(self.width, self.height,
+                       f'{self.background}<g stroke="#f5f5f5">{self.notes}</g>{self.frame}')
+
+   def save(self, file: Union[str, BinaryIO]):
+      _write(self.document(), file)
+
+   def rasterise(self, scale: float = 1.0):
+      raise ValueError("The svg backend renders vector images, use the matplotlib or raster backend for pixels")
+
+
+_keyboard_svgs: Dict[tuple, KeyboardSvg] = {}
+_piano_roll_svgs: Dict[tuple, PianoRollSvg] = {}
+
+
+def get_keyboard_svg(octaves: int, start_white_key: int) -> KeyboardSvg:
+   key = (octaves, start_white_key)
+   if key not in _keyboard_svgs:
+      _keyboard_svgs[key] = KeyboardSvg(octaves, start_white_key)
+   return _keyboard_svgs[key]
+
+
+def get_piano_roll_svg(octaves: int, start_index: int) -> PianoRollSvg:
+   key = (octaves, start_index)
+   if key not in _piano_roll_svgs:
+      _piano_roll_svgs[key] = PianoRollSvg(octaves, start_index)
+   return _piano_roll_svgs[key]
+
+
+def svg_file_name(file_name: str) -> str:
+   return os.path.splitext(file_name)[0] + '.svg'
+
+
+def svg_jobs(jobs: list) -> list:
+   # The decks name their images .png, with the svg backend the files are .svg instead
+   return [replace(job, file_name=svg_file_name(job.file_name)) if job.backend == SVG else job for job in jobs]
+
+
+def use_svg_files(csv_path: str):
+   # Points every <img src="....png"> of a deck CSV at the .svg file of the same name
+   from atlas import image_tag
+
+   def replace_name(match) -> str:
+      if not match.group(1).endswith('.png'):
+         return match.group(0)  # Animations and other files that were never rendered as SVG
+      return match.group(0).replace(match.group(1), svg_file_name(match.group(1)))
+
+   with open(csv_path, mode='r', encoding='utf-8') as csvfile:
+      text = csvfile.read()
+   with open(csv_path, mode='w', encoding='utf-8') as csvfile:
+      csvfile.write(image_tag.sub(replace_name, text))
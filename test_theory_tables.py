@@ -0,0 +1,12 @@
+import pytest
+
+from theory_tables import all_scales_intervals, interval_semitones, keys_per_octave
+
+
+@pytest.mark.parametrize('scale', list(all_scales_intervals))
+def test_scale_halves_have_the_same_pitch_classes(scale):
+   # The octave below the tonic and the octave above it are the same scale
+   intervals = all_scales_intervals[scale]
+   down = {interval_semitones[step] % keys_per_octave for step in intervals if step.startswith('-')}
+   up = {interval_semitones[step] % keys_per_octave for step in intervals if not step.startswith('-')}
+   assert down == up
@@ -0,0 +1,156 @@
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from draw_intervals import keys_per_octave
+
+# Syllable vowels by semitone distance from the root, for notes above (up) and below (down) it
+up_qualities = ['u', 'i', 'a', 'i', 'a', 'u', 'ya', 'u', 'i', 'a', 'i', 'a']
+do_qualities = ['u', 'e', 'o', 'e', 'o', 'y', 'yo', 'y', 'e', 'o', 'e', 'o']
+syllable_vocabulary = sorted(set(up_qualities) | set(do_qualities))
+
+# Adding a chord type or a scale only needs a new entry here
+chord_type_intervals: Dict[str, Tuple[int, ...]] = {
+   'major': (0, 4, 7),
+   'minor': (0, 3, 7),
+   'augmented': (0, 4, 8),
+   'diminished': (0, 3, 6),
+   'major seventh': (0, 4, 7, 11),
+   'dominant seventh': (0, 4, 7, 10),
+   'minor seventh': (0, 3, 7, 10),
+   'minor major seventh': (0, 3, 7, 11),
+   'half-diminished seventh': (0, 3, 6, 10),
+   'diminished seventh': (0, 3, 6, 9),
+   'augmented major seventh': (0, 4, 8, 11),
+   'major ninth': (0, 4, 7, 11, 14),
+   'dominant ninth': (0, 4, 7, 10, 14),
+   'minor ninth': (0, 3, 7, 10, 14),
+}
+chord_type_names = list(chord_type_intervals)
+inversion_names = ['root', 'first inversion', 'second inversion', 'third inversion', 'fourth inversion']
+
+# Define scale intervals for each mode, including intervals below the tonic
+scales_intervals = {
+   'Ionian': ['-P8', '-m7', '-m6', '-P5', '-P4', '-m3', '-m2', 'P1', 'M2', 'M3', 'P4', 'P5', 'M6', 'M7', 'P8'],
+   'Dorian': ['-P8', '-m7', '-M6', '-P5', '-P4', '-m3', '-M2', 'P1', 'M2', 'm3', 'P4', 'P5', 'M6', 'm7', 'P8'],
+   'Phrygian': ['-P8', '-M7', '-M6', '-P5', '-P4', '-M3', '-M2', 'P1', 'm2', 'm3', 'P4', 'P5', 'm6', 'm7', 'P8'],
+   'Lydian': ['-P8', '-m7', '-m6', '-d5', '-P4', '-m3', '-m2', 'P1', 'M2', 'M3', 'A4', 'P5', 'M6', 'M7', 'P8'],  # A4 is augmented 4th
+   'Mixolydian': ['-P8', '-m7', '-m6', '-P5', '-P4', '-m3', '-M2', 'P1', 'M2', 'M3', 'P4', 'P5', 'M6', 'm7', 'P8'],
+   'Aeolian': ['-P8', '-m7', '-M6', '-P5', '-P4', '-M3', '-M2', 'P1', 'M2', 'm3', 'P4', 'P5', 'm6', 'm7', 'P8'],
+   'Locrian': ['-P8', '-M7', '-M6', '-P5', '-A4', '-M3', '-M2', 'P1', 'm2', 'm3', 'P4', 'd5', 'm6', 'm7', 'P8'],  # d5 is diminished 5th
+}
+
+# The classic mode deck covers scales_intervals, the extended vocabulary every scale in all_scales_intervals
+extended_scale_steps = {
+   'Harmonic minor': ['P1', 'M2', 'm3', 'P4', 'P5', 'm6', 'M7', 'P8'],
+   'Locrian natural 6': ['P1', 'm2', 'm3', 'P4', 'd5', 'M6', 'm7', 'P8'],
+   'Ionian augmented': ['P1', 'M2', 'M3', 'P4', 'A5', 'M6', 'M7', 'P8'],
+   'Dorian sharp 4': ['P1', 'M2', 'm3', 'A4', 'P5', 'M6', 'm7', 'P8'],
+   'Phrygian dominant': ['P1', 'm2', 'M3', 'P4', 'P5', 'm6', 'm7', 'P8'],
+   'Lydian sharp 2': ['P1', 'A2', 'M3', 'A4', 'P5', 'M6', 'M7', 'P8'],
+   'Ultralocrian': ['P1', 'm2', 'm3', 'd4', 'd5', 'm6', 'd7', 'P8'],
+   'Melodic minor': ['P1', 'M2', 'm3', 'P4', 'P5', 'M6', 'M7', 'P8'],
+   'Dorian flat 2': ['P1', 'm2', 'm3', 'P4', 'P5', 'M6', 'm7', 'P8'],
+   'Lydian augmented': ['P1', 'M2', 'M3', 'A4', 'A5', 'M6', 'M7', 'P8'],
+   'Lydian dominant': ['P1', 'M2', 'M3', 'A4', 'P5', 'M6', 'm7', 'P8'],
+   'Mixolydian flat 6': ['P1', 'M2', 'M3', 'P4', 'P5', 'm6', 'm7', 'P8'],
+   'Locrian sharp 2': ['P1', 'M2', 'm3', 'P4', 'd5', 'm6', 'm7', 'P8'],
+   'Altered': ['P1', 'm2', 'm3', 'd4', 'd5', 'm6', 'm7', 'P8'],
+   'Major pentatonic': ['P1', 'M2', 'M3', 'P5', 'M6', 'P8'],
+   'Minor pentatonic': ['P1', 'm3', 'P4', 'P5', 'm7', 'P8'],
+}
+
+inverted_qualities = {'P': 'P', 'M': 'm', 'm': 'M', 'A': 'd', 'd': 'A'}
+
+
+def _scale_with_lower_octave(steps: List[str]) -> List[str]:
+   # Same layout as scales_intervals: the scale an octave below the tonic, then the scale above it
+   below = [f"-{inverted_qualities[step[0]]}{9 - int(step[1:])}" for step in steps[:-1]]
+   return below + steps
+
+
+all_scales_intervals = {**scales_intervals,
+                        **{name: _scale_with_lower_octave(steps) for name, steps in extended_scale_steps.items()}}
+
+interval_semitones = {
+   'P1': 0, 'm2': 1, 'M2': 2, 'm3': 3, 'A2': 3, 'M3': 4, 'd4': 4,  'P4': 5,  'A4': 6,   'd5': 6,   'P5': 7, 'A5':8, 'm6': 8,    'M6': 9, 'd7': 9,  'm7': 10,   'M7': 11,   'P8': 12,
+   '-m2': -1, '-M2': -2, '-m3': -3, '-A2': -3, '-M3': -4, '-d4': -4, '-P4': -5, '-A4': -6, '-d5': -6, '-P5': -7, '-A5':-8, '-m6': -8, '-M6': -9, '-d7': -9, '-m7': -10, '-M7': -11, '-P8': -12
+}
+interval_vocabulary = list(interval_semitones)
+mode_names = list(all_scales_intervals)
+direction_names = ['up', 'down']
+
+_roots = np.arange(keys_per_octave)
+
+
+def _build_chord_tables():
+   max_notes = max(len(intervals) for intervals in chord_type_intervals.values())
+   shape = (keys_per_octave, len(chord_type_names), len(inversion_names), max_notes)
+   pitches = np.full(shape, -1, dtype=np.int16)
+   syllables = np.full(shape, -1, dtype=np.int8)
+   colours = np.full(shape, -1, dtype=np.int8)
+   up_syllable_codes = np.array([syllable_vocabulary.index(s) for s in up_qualities], dtype=np.int8)
+   do_syllable_codes = np.array([syllable_vocabulary.index(s) for s in do_qualities], dtype=np.int8)
+
+   for type_index, type_name in enumerate(chord_type_names):
+      intervals = np.array(chord_type_intervals[type_name])
+      size = len(intervals)
+      for inversion in range(min(size, len(inversion_names))):
+         # The inversion moves the lowest notes an octave up; the notes below the root are sung downwards
+         voicing = np.roll(intervals, -inversion)
+         voicing[size - inversion:] += keys_per_octave
+         # Ninths can land above a raised root, so the voicing is listed from the bass up
+         voicing = np.sort(voicing)
+         below_root = voicing < (keys_per_octave if inversion else 0)
+         voiced = _roots[:, None] + voicing[None, :]
+         voiced -= keys_per_octave * (voiced >= keys_per_octave).all(axis=1, keepdims=True)
+         semitones = voicing % keys_per_octave
+         pitches[:, type_index, inversion, :size] = voiced
+         syllables[:, type_index, inversion, :size] = np.where(below_root, do_syllable_codes[semitones],
+                                                               up_syllable_codes[semitones])
+         colours[:, type_index, inversion, :size] = below_root * keys_per_octave + semitones
+   return pitches, syllables, colours
+
+
+def _build_mode_tables():
+   # Scales with fewer steps are padded at the end, mode_lengths says how many steps are real
+   steps = max(len(scale) for scale in all_scales_intervals.values()) // 2 + 1
+   shape = (keys_per_octave, len(mode_names), len(direction_names), steps)
+   intervals = np.zeros(shape[1:], dtype=np.int8)
+   lengths = np.zeros(len(mode_names), dtype=np.int8)
+   for mode_index, mode in enumerate(mode_names):
+      scale = all_scales_intervals[mode]
+      up = scale[len(scale) // 2:]
+      down = scale[:len(scale) // 2 + 1]
+      lengths[mode_index] = len(up)
+      intervals[mode_index, 0, :len(up)] = [interval_vocabulary.index(interval) for interval in up]
+      intervals[mode_index, 1, :len(down)] = [interval_vocabulary.index(interval) for interval in down]
+   semitones = np.array(list(interval_semitones.values()), dtype=np.int16)[intervals]
+   pitches = _roots[:, None, None, None] + semitones[None]
+   return pitches.astype(np.int16), np.broadcast_to(intervals, shape), lengths
+
+
+# [root, chord type, inversion, note] -> pitch index from octave 0, syllable code and palette chord colour slot
+# (12 * below the root + semitones from the root), -1 past the chord
+chord_pitches, chord_syllable_codes, chord_colour_codes = _build_chord_tables()
+# [root, mode, direction, step] -> pitch index relative to octave 0 and code into interval_vocabulary
+mode_pitches, mode_interval_codes, mode_lengths = _build_mode_tables()
+
+
+def chord_entry(root_index: int, type_name: str, inversion_name: str) -> Tuple[List[int], List[str], List[int]]:
+   type_index = chord_type_names.index(type_name)
+   inversion_index = inversion_names.index(inversion_name)
+   pitches = chord_pitches[root_index, type_index, inversion_index]
+   size = int((pitches >= 0).sum())
+   return (pitches[:size].tolist(),
+           [syllable_vocabulary[code] for code in chord_syllable_codes[root_index, type_index, inversion_index, :size]],
+           chord_colour_codes[root_index, type_index, inversion_index, :size].tolist())
+
+
+def mode_entry(root_index: int, mode: str, direction_name: str) -> Tuple[List[int], List[int]]:
+   # Pitch indexes and interval codes (into interval_vocabulary) of one scale
+   mode_index = mode_names.index(mode)
+   direction_index = direction_names.index(direction_name)
+   length = mode_lengths[mode_index]
+   return (mode_pitches[root_index, mode_index, direction_index, :length].tolist(),
+           mode_interval_codes[root_index, mode_index, direction_index, :length].tolist())
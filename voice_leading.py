@@ -0,0 +1,143 @@
+import argparse
+from dataclasses import dataclass
+from itertools import combinations
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from pitch import PitchClass
+from theory_tables import chord_pitches, chord_type_names, inversion_names, keys_per_octave
+
+# For every chord voicing of the decks, the voicings reached with the least semitone movement across every root,
+# chord type and inversion. Distances between all voicings of two chord sizes are computed at once: the notes of both
+# voicings are paired from the bass up, the smaller chord doubling some of its notes so that a triad can lead to a
+# seventh or ninth chord, and the other voicing may also be played up to two octaves lower or higher. A doubled note
+# counts once for every voice it moves into.
+#   python voice_leading.py K major root -k 5
+
+default_k = 8
+octave_shifts = np.arange(-2, 3)
+
+
+@dataclass(frozen=True)
+class Voicing:
+   root: str  # Pitch class name, as the decks name roots
+   chord_type: str
+   inversion: str
+   pitches: Tuple[int, ...]  # From the bass up, relative to octave 0
+
+   @property
+   def key(self) -> Tuple[str, str, str]:
+      return self.root, self.chord_type, self.inversion
+
+
+@dataclass(frozen=True)
+class Neighbour:
+   voicing: Voicing
+   distance: int  # Semitones moved by all voices together
+   octave_shift: int  # Octaves the neighbour is moved by to get there
+
+   @property
+   def pitches(self) -> Tuple[int, ...]:
+      return tuple(pitch + self.octave_shift * keys_per_octave for pitch in self.voicing.pitches)
+
+
+class VoiceLeadingIndex:
+   """The k nearest voicings of every voicing, computed once, looked up by (root, chord type, inversion)."""
+
+   def __init__(self, k: int = default_k):
+      self.k = k
+      self.neighbours: Dict[Tuple[str, str, str], List[Neighbour]] = {}
+      voicings: List[Voicing] = []
+      groups: List[Tuple[slice, np.ndarray]] = []  # Where the voicings of each chord size are, and their pitches
+      sizes = (chord_pitches >= 0).sum(axis=-1)
+      for size in sorted(set(sizes[sizes > 0].tolist())):
+         roots, types, inversions = np.nonzero(sizes == size)
+         groups.append((slice(len(voicings), len(voicings) + len(roots)),
+                        chord_pitches[roots, types, inversions, :size].astype(np.int32)))
+         voicings += [Voicing(PitchClass(root).name, chord_type_names[chord_type], inversion_names[inversion],
+                              tuple(chord_pitches[root, chord_type, inversion, :size].tolist()))
+                      for root, chord_type, inversion in zip(roots, types, inversions)]
+
+      distances = np.empty((len(voicings), len(voicings)), dtype=np.int32)
+      shifts = np.empty_like(distances)
+      for sources, source_pitches in groups:
+         for targets, target_pitches in groups:
+            distances[sources, targets], shifts[sources, targets] = self._distances(source_pitches, target_pitches)
+      # A voicing is never its own neighbour, whichever octave it is moved to
+      np.fill_diagonal(distances, np.iinfo(distances.dtype).max)
+      # Ties keep the canonical deck order, smaller chords first; the voicing itself sorts last
+      nearest = np.argsort(distances, axis=1, kind='stable')[:, :k]
+      for i, voicing in enumerate(voicings):
+         self.neighbours[voicing.key] = [Neighbour(voicings[j], int(distances[i, j]), int(shifts[i, j]))
+                                         for j in nearest[i]]
+
+   @staticmethod
+   def _distances(sources: np.ndarray, targets: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+      # [source, target] smallest total movement over the octave shifts and the doublings, and the shift that gives it
+      best_distances = best_shifts = None
+      for source_voices, target_voices in _pairings(sources.shape[1], targets.shape[1]):
+         moved = np.abs(targets[None, None, :, target_voices] + octave_shifts[:, None, None, None] * keys_per_octave
+                        - sources[None, :, None, source_voices]).sum(axis=-1)  # [shift, source, target]
+         best = moved.argmin(axis=0)
+         distances = np.take_along_axis(moved, best[None], axis=0)[0]
+         if best_distances is None:
+            best_distances, best_shifts = distances, octave_shifts[best]
+         else:
+            closer = distances < best_distances
+            best_distances = np.where(closer, distances, best_distances)
+            best_shifts = np.where(closer, octave_shifts[best], best_shifts)
+      return best_distances, best_shifts
+
+   def nearest(self, root: str, chord_type: str, inversion: str = 'root', k: Optional[int] = None) -> List[Neighbour]:
+      key = (root, chord_type, inversion)
+      if key not in self.neighbours:
+         raise KeyError(f"Unknown chord voicing: {root} {chord_type} {inversion}")
+      k = self.k if k is None else k
+      if not 1 <= k <= self.k:
+         raise ValueError(f"k must be between 1 and {self.k}, got {k}")
+      return self.neighbours[key][:k]
+
+
+def _pairings(source_size: int, target_size: int) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+   # Voice indexes of both chords, paired from the bass up, for every way the smaller chord can double its notes.
+   # Pairings with crossing voices never move less, so these are all that need trying; equal sizes give one.
+   size = max(source_size, target_size)
+   for steps in combinations(range(1, size), min(source_size, target_size) - 1):
+      doubled = np.zeros(size, dtype=np.intp)
+      doubled[list(steps)] = 1
+      doubled = np.cumsum(doubled)
+      voices = np.arange(size)
+      yield (doubled, voices) if source_size < target_size else (voices, doubled)
+
+
+_index: Optional[VoiceLeadingIndex] = None
+
+
+def voice_leading_index() -> VoiceLeadingIndex:
+   # Built on first use and shared by every caller of the process
+   global _index
+   if _index is None:
+      _index = VoiceLeadingIndex()
+   return _index
+
+
+def main(argv: Optional[List[str]] = None):
+   parser = argparse.ArgumentParser(description="List the chords reached from a chord with the smoothest voice leading")
+   parser.add_argument('root', help="root note, e.g. K")
+   parser.add_argument('chord_type', help=f"one of: {', '.join(chord_type_names)}")
+   parser.add_argument('inversion', nargs='?', default='root', help=f"one of: {', '.join(inversion_names)}")
+   parser.add_argument('-k', type=int, default=5, help=f"how many chords to list, at most {default_k}")
+   args = parser.parse_args(argv)
+
+   try:
+      neighbours = voice_leading_index().nearest(args.root, args.chord_type, args.inversion, args.k)
+   except (KeyError, ValueError) as error:
+      parser.error(str(error))
+   for neighbour in neighbours:
+      voicing = neighbour.voicing
+      print(f"{neighbour.distance:3d}  {voicing.root} {voicing.chord_type} {voicing.inversion}  {neighbour.pitches}")
+
+
+if __name__ == '__main__':
+   main()